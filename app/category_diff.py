@@ -0,0 +1,162 @@
+"""
+Порівняння та об'єднання дерев категорій конкурента (оновлення категорій).
+
+Обидва дерева проходяться один раз. Старе дерево індексується за ID,
+URL та назвою серед дітей одного батька (індекси за нормалізованим URL та
+назвою будуються тільки при першому промаху за ID). Нове дерево
+обходиться зверху вниз, і кожна нова категорія зіставляється зі старою:
+- за ID,
+- інакше за URL,
+- інакше за назвою серед старих дітей категорії, зіставленої з батьком.
+Зіставлення за ID та URL глобальне, тому категорія, перенесена в інший розділ,
+розпізнається як переміщена, а не як видалена й додана.
+
+Результат - дерево в структурі нового парсингу (дані категорій - з нового
+парсингу) та набір змін:
+- added - нові категорії,
+- moved - категорії зі зміненим батьком,
+- renamed - категорії зі зміненою назвою,
+- missing - старі категорії, яких немає в новому парсингу. Вони залишаються
+  в дереві з позначкою needs_manual_check під тим самим батьком.
+"""
+from typing import Dict, List, Optional, Tuple
+
+# Батько кореневих категорій у старому дереві
+_ROOT = -1
+
+
+def _name_key(category: Dict) -> str:
+    return (category.get("name") or "").strip().lower()
+
+
+def _url_key(url: Optional[str]) -> Optional[str]:
+    """URL для порівняння: без query/fragment та завершального '/', схема та домен - у нижньому регістрі"""
+    if not url:
+        return None
+    url = str(url).strip().split("#", 1)[0].split("?", 1)[0].rstrip("/")
+    scheme, separator, rest = url.partition("://")
+    if not separator:
+        return url or None
+    host, slash, path = rest.partition("/")
+    return f"{scheme.lower()}://{host.lower()}{slash}{path}"
+
+
+def _summary(category: Dict) -> Dict:
+    return {"id": category.get("id"), "name": category.get("name"), "url": category.get("url")}
+
+
+def merge_category_trees(old_categories: List[Dict], new_categories: List[Dict]) -> Tuple[List[Dict], Dict]:
+    """
+    Об'єднує старе та нове дерева категорій за O(n).
+    Повертає (об'єднане дерево, набір змін {"matched", "added", "moved", "renamed", "missing"}).
+    """
+    # Старе дерево у прямому порядку обходу: вузол та позиція батька
+    old_nodes: List[Dict] = []
+    old_parent: List[int] = []
+    by_id: Dict[str, int] = {}
+    by_raw_url: Dict[str, int] = {}
+    stack = [(category, _ROOT) for category in reversed(old_categories or [])]
+    while stack:
+        category, parent = stack.pop()
+        position = len(old_nodes)
+        old_nodes.append(category)
+        old_parent.append(parent)
+        category_id = category.get("id")
+        if category_id:
+            by_id.setdefault(category_id, position)
+        url = category.get("url")
+        if url:
+            by_raw_url.setdefault(url, position)
+        children = category.get("children")
+        if children:
+            for child in reversed(children):
+                stack.append((child, position))
+
+    # Індекси за нормалізованим URL та назвою серед дітей будуються тільки при першому
+    # промаху за ID (зазвичай ID категорій стабільні і нормалізація не потрібна)
+    lazy: Dict[str, Dict] = {}
+
+    def find_by_url(url: Optional[str]) -> Optional[int]:
+        if not url:
+            return None
+        position = by_raw_url.get(url)
+        if position is not None and merged_by_old[position] is None:
+            return position
+        if "url" not in lazy:
+            lazy["url"] = {}
+            for position, old in enumerate(old_nodes):
+                key = _url_key(old.get("url"))
+                if key:
+                    lazy["url"].setdefault(key, position)
+        return lazy["url"].get(_url_key(url))
+
+    def sibling_candidates(parent: int, category: Dict):
+        if "name" not in lazy:
+            lazy["name"] = {}
+            for position, old in enumerate(old_nodes):
+                name = _name_key(old)
+                if name:
+                    lazy["name"].setdefault((old_parent[position], name), []).append(position)
+        return lazy["name"].get((parent, _name_key(category)), ())
+
+    # Позиція старого вузла -> вузол об'єднаного дерева
+    merged_by_old: List[Optional[Dict]] = [None] * len(old_nodes)
+    changes = {"matched": 0, "added": [], "moved": [], "renamed": [], "missing": []}
+
+    merged: List[Dict] = []
+    # (нова категорія, позиція старого вузла, зіставленого з батьком (None - батько новий), список дітей, ID батька)
+    pending = [(category, _ROOT, merged, None) for category in reversed(new_categories or [])]
+    while pending:
+        category, old_parent_position, siblings, parent_id = pending.pop()
+        category_id = category.get("id")
+        position = by_id.get(category_id)
+        if position is None or merged_by_old[position] is not None:
+            position = find_by_url(category.get("url"))
+            if position is None or merged_by_old[position] is not None:
+                position = None
+                if old_parent_position is not None:
+                    for candidate in sibling_candidates(old_parent_position, category):
+                        if merged_by_old[candidate] is None:
+                            position = candidate
+                            break
+
+        node = dict(category)
+        node["children"] = []
+        siblings.append(node)
+        if position is None:
+            changes["added"].append({**_summary(category), "parent_id": parent_id})
+        else:
+            merged_by_old[position] = node
+            changes["matched"] += 1
+            old = old_nodes[position]
+            if old_parent[position] != old_parent_position:
+                from_parent = old_parent[position]
+                changes["moved"].append({
+                    **_summary(category),
+                    "from_parent_id": old_nodes[from_parent].get("id") if from_parent != _ROOT else None,
+                    "to_parent_id": parent_id
+                })
+            if old.get("name") != category.get("name") and \
+                    (old.get("name") or "").strip() != (category.get("name") or "").strip():
+                changes["renamed"].append({
+                    "id": category_id, "old_name": old.get("name"), "new_name": category.get("name")
+                })
+        children = category.get("children")
+        if children:
+            children_list = node["children"]
+            for child in reversed(children):
+                pending.append((child, position, children_list, category_id))
+
+    # Незнайдені старі категорії - під тим самим батьком (батько обробляється раніше за дітей)
+    for position, old in enumerate(old_nodes):
+        if merged_by_old[position] is not None:
+            continue
+        node = dict(old)
+        node["needs_manual_check"] = True
+        node["children"] = []
+        merged_by_old[position] = node
+        parent = old_parent[position]
+        (merged if parent == _ROOT else merged_by_old[parent]["children"]).append(node)
+        changes["missing"].append(_summary(old))
+
+    return merged, changes
@@ -0,0 +1,251 @@
+"""
+In-memory індекси конкурентів.
+
+Індекс доменів: нормалізований домен сайту конкурента -> (competitor_id, назва).
+Будується з competitors.json один раз і перебудовується, коли змінюється
+сигнатура файлу (будь-яке збереження конкурентів), тому визначення конкурента
+за URL товару - пошук у словнику без читання файлу та розбору URL усіх конкурентів.
+
+Індекс категорій: дерево категорій кожного конкурента, сплощене в словники
+(ID -> вузол, URL -> вузол, шлях назв -> вузол, батьківські вузли). Вузли
+записуються в прямому порядку обходу (як їх знаходив рекурсивний пошук), тому
+нащадки вузла - неперервний відрізок цього порядку, і перевірка "чи є вузол
+нащадком" та кількість підкатегорій обчислюються за O(1).
+Дерева будуються при першому зверненні і скидаються разом зі зміною competitors.json.
+
+Товари категорій: category_path товару (з індексу товарів, ProductIndex.category_paths)
+зіставляється з вузлом дерева його конкурента один раз на унікальний шлях, тому
+товари категорії разом з підкатегоріями та кількість товарів у всіх категоріях -
+прохід по унікальних шляхах конкурента, а не по каталогу.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from .product_index import normalize_url
+
+
+def normalize_domain(url_or_netloc: Optional[str]) -> Optional[str]:
+    """Домен у нижньому регістрі без порту, облікових даних та префікса www."""
+    if not url_or_netloc:
+        return None
+    value = url_or_netloc.strip()
+    netloc = urlsplit(value).netloc if "//" in value else value.split("/", 1)[0]
+    host = netloc.rsplit("@", 1)[-1].split(":", 1)[0].strip(".").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return host or None
+
+
+class CompetitorDomainIndex:
+    """Домен -> активний конкурент (з урахуванням www та піддоменів)"""
+
+    def __init__(self):
+        self.signature = None
+        self.by_domain: Dict[str, Tuple[str, str]] = {}
+
+    def rebuild(self, competitors: Iterable[Dict], signature=None):
+        """Перебудовує індекс; при однаковому домені перевага в першого конкурента (як у списку)"""
+        self.by_domain = {}
+        for competitor in competitors:
+            if not competitor.get("active", True):
+                continue
+            competitor_id = competitor.get("id")
+            competitor_name = competitor.get("name")
+            domain = normalize_domain(competitor.get("url"))
+            if domain and competitor_id and competitor_name and domain not in self.by_domain:
+                self.by_domain[domain] = (competitor_id, competitor_name)
+        self.signature = signature
+
+    def invalidate(self):
+        self.signature = None
+
+    def find(self, url: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        Конкурент за URL товару: точний збіг домену, інакше найближчий батьківський
+        домен (m.shop.com -> shop.com). Повертає (competitor_id, назва) або None.
+        """
+        domain = normalize_domain(url)
+        while domain:
+            found = self.by_domain.get(domain)
+            if found:
+                return found
+            parent = domain.split(".", 1)[1] if "." in domain else ""
+            # Не піднімаємося до домену верхнього рівня (com, ua)
+            domain = parent if "." in parent else None
+        return None
+
+
+def category_name_key(name: Optional[str]) -> str:
+    """Назва категорії для порівняння (без регістру та пробілів на краях)"""
+    return (name or "").strip().lower()
+
+
+class CategoryTree:
+    """Сплощене дерево категорій одного конкурента"""
+
+    def __init__(self, categories: Iterable[Dict]):
+        self.by_id: Dict[str, Dict] = {}
+        self.by_url: Dict[str, Dict] = {}
+        self.by_path: Dict[Tuple[str, ...], Dict] = {}
+        self.by_name: Dict[str, List[str]] = {}
+        self.parent: Dict[str, Optional[str]] = {}
+        self.order: List[str] = []
+        self._position: Dict[str, int] = {}
+        # Позиція після останнього нащадка вузла в self.order
+        self._end: Dict[str, int] = {}
+        self._names: Dict[str, str] = {}
+        # category_path товару -> ID категорії (None - шлях не відповідає дереву)
+        self._resolved: Dict[Tuple[str, ...], Optional[str]] = {}
+
+        # Ітеративний обхід у прямому порядку; (вузол, ID батька, шлях назв) або маркер завершення піддерева
+        stack: List[Tuple] = [(category, None, ()) for category in reversed(list(categories or []))]
+        while stack:
+            category, parent_id, parent_path = stack.pop()
+            if category is None:
+                self._end[parent_id] = len(self.order)
+                continue
+            category_id = category.get("id")
+            name = category_name_key(category.get("name"))
+            path = parent_path + (name,)
+            self.by_path.setdefault(path, category)
+            url = normalize_url(category.get("url"))
+            if url:
+                self.by_url.setdefault(url, category)
+            children = category.get("children") or []
+            if category_id is None or category_id in self.by_id:
+                # Дублікат ID: вузол доступний за URL та шляхом, його піддерево - через батька
+                stack.extend((child, parent_id, path) for child in reversed(children))
+                continue
+            self.by_id[category_id] = category
+            self.parent[category_id] = parent_id
+            self._names[category_id] = name
+            self.by_name.setdefault(name, []).append(category_id)
+            self._position[category_id] = len(self.order)
+            self.order.append(category_id)
+            stack.append((None, category_id, None))
+            stack.extend((child, category_id, path) for child in reversed(children))
+
+    def ancestors(self, category_id: str) -> List[Dict]:
+        """Предки категорії від кореня до безпосереднього батька"""
+        result = []
+        parent_id = self.parent.get(category_id)
+        while parent_id is not None:
+            result.append(self.by_id[parent_id])
+            parent_id = self.parent.get(parent_id)
+        result.reverse()
+        return result
+
+    def descendant_ids(self, category_id: str) -> List[str]:
+        """ID усіх нащадків категорії (у прямому порядку обходу)"""
+        position = self._position.get(category_id)
+        if position is None:
+            return []
+        return self.order[position + 1:self._end[category_id]]
+
+    def descendants_count(self, category_id: str) -> int:
+        position = self._position.get(category_id)
+        return self._end[category_id] - position - 1 if position is not None else 0
+
+    def is_descendant(self, category_id: str, ancestor_id: str) -> bool:
+        """Чи є category_id нащадком ancestor_id (або ним самим)"""
+        position = self._position.get(category_id)
+        start = self._position.get(ancestor_id)
+        if position is None or start is None:
+            return False
+        return start <= position < self._end[ancestor_id]
+
+    def find_path(self, names: Iterable[str]) -> Optional[Dict]:
+        """
+        Категорія за шляхом назв: повний шлях від кореня або ланцюжок
+        послідовних рівнів, що закінчується категорією з останньою назвою.
+        """
+        keys = tuple(category_name_key(name) for name in names)
+        if not keys:
+            return None
+        found = self.by_path.get(keys)
+        if found is not None:
+            return found
+        for category_id in self.by_name.get(keys[-1], ()):
+            current = self.parent.get(category_id)
+            matched = True
+            for name in reversed(keys[:-1]):
+                if current is None or self._names[current] != name:
+                    matched = False
+                    break
+                current = self.parent.get(current)
+            if matched:
+                return self.by_id[category_id]
+        return None
+
+    def resolve(self, category_path: Tuple[str, ...]) -> Optional[str]:
+        """
+        ID категорії для category_path товару: найдовший відрізок шляху, що відповідає
+        дереву (шлях товару може починатися з "Головна" або закінчуватися назвою товару).
+        """
+        if category_path in self._resolved:
+            return self._resolved[category_path]
+        found = None
+        for end in range(len(category_path), 0, -1):
+            for start in range(end):
+                category = self.find_path(category_path[start:end])
+                if category is not None:
+                    found = category.get("id")
+                    break
+            if found is not None:
+                break
+        self._resolved[category_path] = found
+        return found
+
+    def product_ids(self, category_id: str, category_paths: Dict[Tuple[str, ...], Set[str]]) -> Set[str]:
+        """ID товарів категорії та всіх її підкатегорій (category_paths - шляхи товарів конкурента)"""
+        result: Set[str] = set()
+        for category_path, ids in category_paths.items():
+            resolved = self.resolve(category_path)
+            if resolved is not None and self.is_descendant(resolved, category_id):
+                result |= ids
+        return result
+
+    def product_counts(self, category_paths: Dict[Tuple[str, ...], Set[str]]) -> Dict[str, int]:
+        """Кількість товарів кожної категорії разом з підкатегоріями"""
+        counts = dict.fromkeys(self.order, 0)
+        for category_path, ids in category_paths.items():
+            resolved = self.resolve(category_path)
+            if resolved is not None:
+                counts[resolved] += len(ids)
+        # Зворотний прямий порядок: діти обробляються раніше за батьків
+        for category_id in reversed(self.order):
+            parent_id = self.parent[category_id]
+            if parent_id is not None:
+                counts[parent_id] += counts[category_id]
+        return counts
+
+
+class CompetitorCategoryIndex:
+    """Дерева категорій конкурентів за ID конкурента"""
+
+    def __init__(self):
+        self.signature = None
+        self.competitors: Dict[str, Dict] = {}
+        self._trees: Dict[str, CategoryTree] = {}
+
+    def rebuild(self, competitors: Iterable[Dict], signature=None):
+        self.competitors = {}
+        for competitor in competitors:
+            competitor_id = competitor.get("id")
+            if competitor_id and competitor_id not in self.competitors:
+                self.competitors[competitor_id] = competitor
+        self._trees = {}
+        self.signature = signature
+
+    def invalidate(self):
+        self.signature = None
+
+    def tree(self, competitor_id: str) -> Optional[CategoryTree]:
+        """Сплощене дерево категорій конкурента (None - конкурента немає)"""
+        tree = self._trees.get(competitor_id)
+        if tree is None:
+            competitor = self.competitors.get(competitor_id)
+            if competitor is None:
+                return None
+            tree = self._trees[competitor_id] = CategoryTree(competitor.get("categories") or [])
+        return tree
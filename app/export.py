@@ -0,0 +1,114 @@
+"""
+Потоковий експорт товарів та історії цін (NDJSON або CSV, за бажанням - gzip).
+
+Дані формуються генераторами частинами по EXPORT_CHUNK_ROWS рядків і
+одразу віддаються клієнту (StreamingResponse), тому пам'ять не залежить від
+розміру каталогу: у пам'яті тримається тільки поточна частина рядків та
+історія одного товару. Стиснення gzip - потокове (zlib.compressobj).
+"""
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from .price_history import expand_history, load_history
+from .storage import dumps
+
+# Скільки рядків формується за один крок генератора
+EXPORT_CHUNK_ROWS = 500
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# Колонки CSV за замовчуванням
+PRODUCT_EXPORT_FIELDS = [
+    "id", "name", "name_parsed", "sku", "url", "competitor_id", "status", "price",
+    "availability", "category_path", "last_parsed_at", "created_at"
+]
+HISTORY_EXPORT_FIELDS = ["product_id", "date", "price", "availability", "last_confirmed_at", "count"]
+
+
+def _csv_value(value):
+    if isinstance(value, (list, tuple)):
+        return " / ".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return dumps(value).decode("utf-8")
+    return value
+
+
+def _encode_rows(rows: List[Dict], export_format: str, fields: Optional[List[str]], header: bool) -> bytes:
+    """Частина експорту: рядки NDJSON або CSV (з заголовком, якщо header)"""
+    if export_format == "ndjson":
+        if fields:
+            rows = [{field: row.get(field) for field in fields} for row in rows]
+        return b"".join(dumps(row) + b"\n" for row in rows)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    for row in rows:
+        writer.writerow([_csv_value(row.get(field)) for field in fields])
+    return buffer.getvalue().encode("utf-8")
+
+
+async def _encode_stream(rows: AsyncIterator[Dict], export_format: str,
+                         fields: Optional[List[str]]) -> AsyncIterator[bytes]:
+    chunk: List[Dict] = []
+    header = export_format == "csv"
+    async for row in rows:
+        chunk.append(row)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield _encode_rows(chunk, export_format, fields, header)
+            chunk, header = [], False
+    if chunk or header:
+        yield _encode_rows(chunk, export_format, fields, header)
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Потокове стиснення gzip"""
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def _product_rows(products: Iterable[Dict]) -> AsyncIterator[Dict]:
+    for product in products:
+        yield product
+
+
+async def _history_rows(products: Iterable[Dict], start: Optional[str], end: Optional[str],
+                        expand: bool) -> AsyncIterator[Dict]:
+    """Відрізки (або спостереження при expand) історії товарів, що перетинаються з періодом [start, end]"""
+    for product in products:
+        runs = await load_history(product["id"], product.get("history_run"))
+        if start:
+            runs = [run for run in runs if (run.get("last_confirmed_at") or run.get("date") or "") >= start]
+        if end:
+            runs = [run for run in runs if (run.get("date") or "") <= end]
+        for row in expand_history(runs) if expand else runs:
+            if expand and ((start and row["date"] < start) or (end and row["date"] > end)):
+                continue
+            yield {"product_id": product["id"], **row}
+
+
+def export_products(products: Iterable[Dict], export_format: str = "ndjson", fields: Optional[List[str]] = None,
+                    compress: bool = False) -> AsyncIterator[bytes]:
+    """Потік експорту товарів (NDJSON - повні записи або fields, CSV - fields або PRODUCT_EXPORT_FIELDS)"""
+    if export_format == "csv" and not fields:
+        fields = PRODUCT_EXPORT_FIELDS
+    stream = _encode_stream(_product_rows(products), export_format, fields)
+    return gzip_stream(stream) if compress else stream
+
+
+def export_history(products: Iterable[Dict], start: Optional[str] = None, end: Optional[str] = None,
+                   export_format: str = "ndjson", expand: bool = False,
+                   compress: bool = False) -> AsyncIterator[bytes]:
+    """Потік експорту історії цін товарів за період (межі - ISO дати, включно)"""
+    fields = HISTORY_EXPORT_FIELDS if export_format == "csv" else None
+    if expand and fields:
+        fields = ["product_id", "date", "price", "availability"]
+    stream = _encode_stream(_history_rows(products, start, end, expand), export_format, fields)
+    return gzip_stream(stream) if compress else stream
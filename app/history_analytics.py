@@ -0,0 +1,227 @@
+"""
+Колонкове представлення історії цін для аналітики.
+
+Замість списку словників {"date", "price", "availability"} історія товару
+зберігається в пам'яті як набір типізованих масивів однакової довжини
+(один елемент - один відрізок незмінних значень з журналу історії):
+- starts / confirmed - час початку та останнього підтвердження (epoch, секунди)
+- prices - ціна (NaN, якщо ціни немає)
+- availability - код наявності (AVAILABILITY_CODES)
+- counts - кількість спостережень у відрізку
+
+Якщо встановлено NumPy, масиви - numpy.ndarray і статистика та ресемплінг
+векторизовані; інакше використовується модуль array і прості цикли.
+Колонки кешуються для кожного товару, поки не змінився файл журналу
+або відкритий відрізок товару. Кеш обмежений MAX_CACHED_COLUMNS товарами
+(витісняються ті, що найдовше не запитувались); колонки видалених товарів
+прибираються після збереження бази (prune_columns_cache).
+"""
+import array
+import bisect
+import math
+from collections import OrderedDict
+from datetime import datetime
+from typing import Container, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необов'язковий - без нього обчислення в чистому Python
+    np = None
+
+from .price_history import get_history_path, load_history
+from .storage import get_file_signature
+
+# Коди наявності (int8)
+AVAILABILITY_UNKNOWN = 0
+AVAILABILITY_CODES = {
+    "в наявності": 1,
+    "є в наявності": 1,
+    "немає в наявності": 2,
+    "закінчився": 2,
+    "під замовлення": 3,
+}
+AVAILABILITY_OTHER = 4
+AVAILABILITY_LABELS = {0: None, 1: "в наявності", 2: "немає в наявності", 3: "під замовлення", 4: "інше"}
+
+# Інтервали ресемплінгу (секунди)
+RESAMPLE_INTERVALS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+# Найбільша кількість точок ряду за один запит (погодинний ряд приблизно за 5,7 року)
+MAX_RESAMPLE_POINTS = 50_000
+
+# Найбільша кількість товарів у кеші колонок
+MAX_CACHED_COLUMNS = 2000
+
+# Кеш колонок (LRU): product_id -> (сигнатура журналу, відкритий відрізок, колонки)
+_columns_cache: "OrderedDict[str, Tuple[Optional[Tuple[int, int, int]], Tuple, HistoryColumns]]" = OrderedDict()
+
+
+def availability_code(value: Optional[str]) -> int:
+    """Код наявності для рядка availability"""
+    if not value:
+        return AVAILABILITY_UNKNOWN
+    return AVAILABILITY_CODES.get(value.strip().lower(), AVAILABILITY_OTHER)
+
+
+def _epoch(value: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _isoformat(value: float) -> str:
+    return datetime.fromtimestamp(value).isoformat()
+
+
+class HistoryColumns:
+    """Історія товару у вигляді типізованих масивів (по елементу на відрізок)"""
+
+    def __init__(self, starts, confirmed, prices, availability, counts):
+        self.starts = starts
+        self.confirmed = confirmed
+        self.prices = prices
+        self.availability = availability
+        self.counts = counts
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def from_runs(cls, runs: List[Dict]) -> "HistoryColumns":
+        """Будує колонки з відрізків журналу історії (load_history)"""
+        runs = [run for run in runs if not math.isnan(_epoch(run.get("date")))]
+        starts = [_epoch(run["date"]) for run in runs]
+        confirmed = [
+            max(start, _epoch(run.get("last_confirmed_at")) if run.get("last_confirmed_at") else start)
+            for start, run in zip(starts, runs)
+        ]
+        prices = [float(run["price"]) if run.get("price") is not None else math.nan for run in runs]
+        availability = [availability_code(run.get("availability")) for run in runs]
+        counts = [int(run.get("count", 1)) for run in runs]
+        if np is not None:
+            return cls(
+                np.array(starts, dtype=np.float64), np.array(confirmed, dtype=np.float64),
+                np.array(prices, dtype=np.float64), np.array(availability, dtype=np.int8),
+                np.array(counts, dtype=np.int32)
+            )
+        return cls(
+            array.array("d", starts), array.array("d", confirmed), array.array("d", prices),
+            array.array("b", availability), array.array("l", counts)
+        )
+
+    def summary(self) -> Dict:
+        """Мінімальна, максимальна, середня (за спостереженнями) ціна та зміна ціни у відсотках"""
+        if np is not None:
+            valid = ~np.isnan(self.prices)
+            prices = self.prices[valid]
+            counts = self.counts[valid]
+            if prices.size == 0:
+                return _empty_summary(len(self), int(self.counts.sum()))
+            first, last = float(prices[0]), float(prices[-1])
+            minimum, maximum = float(prices.min()), float(prices.max())
+            mean = float((prices * counts).sum() / counts.sum())
+            observations = int(self.counts.sum())
+        else:
+            pairs = [(price, count) for price, count in zip(self.prices, self.counts) if not math.isnan(price)]
+            if not pairs:
+                return _empty_summary(len(self), sum(self.counts))
+            first, last = pairs[0][0], pairs[-1][0]
+            minimum = min(price for price, _ in pairs)
+            maximum = max(price for price, _ in pairs)
+            mean = sum(price * count for price, count in pairs) / sum(count for _, count in pairs)
+            observations = sum(self.counts)
+
+        return {
+            "runs": len(self),
+            "observations": observations,
+            "first_price": first,
+            "last_price": last,
+            "min_price": minimum,
+            "max_price": maximum,
+            "mean_price": round(mean, 4),
+            "pct_change": round((last - first) / first * 100, 4) if first else None,
+            "first_date": _isoformat(self.starts[0]),
+            "last_date": _isoformat(self.confirmed[-1]),
+            "last_availability": AVAILABILITY_LABELS.get(int(self.availability[-1]))
+        }
+
+    def resample(self, interval_seconds: int, start: Optional[float] = None, end: Optional[float] = None) -> List[Dict]:
+        """
+        Ступінчастий ряд з кроком interval_seconds: для кожного інтервалу (дата його початку) -
+        ціна та наявність на кінець інтервалу (значення відрізка діють до наступної зміни).
+        Ряд не виходить за межі спостережень (end обмежується останнім підтвердженням);
+        якщо точок більше за MAX_RESAMPLE_POINTS - ValueError.
+        """
+        if len(self) == 0:
+            return []
+        start = self.starts[0] if start is None else max(start, self.starts[0])
+        end = self.confirmed[-1] if end is None else min(end, self.confirmed[-1])
+        if end < start:
+            return []
+        start = math.floor(start / interval_seconds) * interval_seconds
+        if (end - start) // interval_seconds + 1 > MAX_RESAMPLE_POINTS:
+            raise ValueError(
+                f"Забагато точок ряду (більше {MAX_RESAMPLE_POINTS}): збільште інтервал або звузьте період"
+            )
+
+        if np is not None:
+            points = np.arange(start, end + 1, interval_seconds, dtype=np.float64)
+            indexes = np.searchsorted(self.starts, points + interval_seconds, side="left") - 1
+            points, indexes = points[indexes >= 0], indexes[indexes >= 0]
+            prices = self.prices[indexes]
+            codes = self.availability[indexes]
+            return [
+                {
+                    "date": _isoformat(point),
+                    "price": None if math.isnan(price) else price,
+                    "availability": AVAILABILITY_LABELS.get(code)
+                }
+                for point, price, code in zip(points.tolist(), prices.tolist(), codes.tolist())
+            ]
+
+        series = []
+        point = start
+        while point <= end:
+            index = bisect.bisect_left(self.starts, point + interval_seconds) - 1
+            if index >= 0:
+                price = self.prices[index]
+                series.append({
+                    "date": _isoformat(point),
+                    "price": None if math.isnan(price) else price,
+                    "availability": AVAILABILITY_LABELS.get(self.availability[index])
+                })
+            point += interval_seconds
+        return series
+
+
+def _empty_summary(runs: int, observations: int) -> Dict:
+    return {
+        "runs": runs, "observations": int(observations), "first_price": None, "last_price": None,
+        "min_price": None, "max_price": None, "mean_price": None, "pct_change": None,
+        "first_date": None, "last_date": None, "last_availability": None
+    }
+
+
+async def load_columns(product: Dict) -> HistoryColumns:
+    """Колонки історії товару (з кешу, якщо журнал та відкритий відрізок не змінились)"""
+    product_id = product["id"]
+    signature = get_file_signature(get_history_path(product_id))
+    run = product.get("history_run") or {}
+    run_key = (run.get("date"), run.get("last_confirmed_at"), run.get("count"))
+    cached = _columns_cache.get(product_id)
+    if cached is not None and cached[0] == signature and cached[1] == run_key:
+        _columns_cache.move_to_end(product_id)
+        return cached[2]
+
+    columns = HistoryColumns.from_runs(await load_history(product_id, run or None))
+    _columns_cache[product_id] = (signature, run_key, columns)
+    _columns_cache.move_to_end(product_id)
+    while len(_columns_cache) > MAX_CACHED_COLUMNS:
+        _columns_cache.popitem(last=False)
+    return columns
+
+
+def prune_columns_cache(product_ids: Container[str]):
+    """Прибирає з кешу колонки товарів, яких немає серед product_ids (видалені товари)"""
+    for product_id in [product_id for product_id in _columns_cache if product_id not in product_ids]:
+        del _columns_cache[product_id]
@@ -1,34 +1,70 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Query
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import Optional, List
+from contextlib import asynccontextmanager
 import json
 import os
 import uuid
 import asyncio
 import logging
+import math
 from datetime import datetime
-from urllib.parse import urlparse, unquote
 
 logger = logging.getLogger(__name__)
 from .models import (
     Product, ProductAdd, APIKeyAdd, Settings, APIKey, Competitor, CompetitorAdd, DiscoverProductsRequest,
     CharacteristicGroup, Characteristic, CharacteristicValue, ProductCharacteristics,
-    CharacteristicGroupAdd, CharacteristicAdd, CharacteristicValueAdd
+    CharacteristicGroupAdd, CharacteristicAdd, CharacteristicValueAdd, RefreshScheduleAdd
 )
 from .parser import (
-    load_db, save_db, load_settings, save_settings,
-    parse_product, parse_product_full, save_result, is_first_parse, get_active_api_key,
-    get_token_statistics, save_token_usage, load_competitors, save_competitors,
+    load_db, load_db_view, load_competitors_view, load_characteristics_view, load_schedules_view, save_db,
+    load_progress_view, load_settings, save_settings,
+    refresh_product, is_first_parse, get_active_api_key,
+    get_product_by_id, get_product_index, get_token_statistics, save_token_usage, load_competitors, save_competitors,
     parse_all_products, parse_single_product, parse_single_product_full, parse_competitor_categories,
     update_competitor_categories, discover_products, parse_newly_discovered_products,
-    parse_filtered_products, parse_selected_products,
-    load_progress, save_progress, get_task_status,
-    load_characteristics, save_characteristics, get_characteristics_for_product, get_product_characteristic_values
+    parse_filtered_products, parse_selected_products, select_filtered_products,
+    get_competitor_category_index, get_category_product_counts,
+    parse_stale_products, import_products, parse_import_text, make_new_product, MAX_IMPORT_PRODUCTS,
+    get_task_status, register_task, update_task_progress, append_product_log, update_competitor_fields,
+    make_task_signature, claim_task, release_task, run_coalesced_task,
+    load_characteristics, save_characteristics, get_characteristics_for_product, get_product_characteristic_values,
+    load_schedules, save_schedules, recover_pending_results, close_result_buffer, migrate_product_history,
+    migrate_product_logs, migrate_token_usage_history,
+    DB_FILE, SETTINGS_FILE, COMPETITORS_FILE, SCHEDULES_FILE, CHARACTERISTICS_FILE
 )
+from .price_history import load_history, load_histories, expand_history
+from .history_analytics import load_columns, RESAMPLE_INTERVALS
+from .product_logs import load_logs
+from .token_usage import flush_token_usage
+from .product_listing import paginate_products, parse_sort, project_fields
+from .product_index import DEFAULT_PRICE_EDGES, normalize_url
+from .export import EXPORT_FORMATS, export_history, export_products
+from .parquet_export import (
+    is_available as parquet_export_available, get_export_state as get_parquet_export_state, run_parquet_export_task
+)
+from .storage import get_store_lock, StoreConflictError, dumps
+from .scheduler import scheduler, CronExpression, describe_schedule, resolve_daily_fetch_budget, get_run_interval_seconds
+from .prioritizer import build_refresh_plan
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запуск та зупинка фонового планувальника оновлень, буфера відкладеного запису та обліку токенів"""
+    await migrate_product_history()
+    await migrate_product_logs()
+    await migrate_token_usage_history()
+    await recover_pending_results()
+    scheduler.start()
+    yield
+    await scheduler.stop()
+    await close_result_buffer()
+    await flush_token_usage()
+
 
-app = FastAPI(title="GPT Product Parser")
+app = FastAPI(title="GPT Product Parser", lifespan=lifespan)
 
 # CORS для фронтенду
 app.add_middleware(
@@ -39,6 +75,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.exception_handler(StoreConflictError)
+async def store_conflict_handler(request, exc: StoreConflictError):
+    """Дані змінено іншим запитом між читанням та записом - клієнт має повторити дію"""
+    return JSONResponse(
+        status_code=409,
+        content={"detail": f"Дані змінено іншим запитом, повторіть дію. {str(exc)}"}
+    )
+
 # Статичні файли
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -71,39 +117,54 @@ async def competitors_page():
 @app.post("/products/add")
 async def add_product(product: ProductAdd):
     """Додати новий товар"""
-    db = await load_db()
+    async with get_store_lock(DB_FILE):
+        db = await load_db()
     
-    raw_name = (product.name or "").strip()
-    if not raw_name:
         # Якщо назву не передали — формуємо максимально просту за URL
-        try:
-            parsed = urlparse(product.url)
-            last_part = (parsed.path or "").rstrip("/").split("/")[-1]
-            last_part = unquote(last_part).replace("-", " ").replace("_", " ").strip()
-            raw_name = last_part if last_part else "Новий товар"
-        except Exception:
-            raw_name = "Новий товар"
-    
-    new_product = {
-        "id": str(uuid.uuid4()),
-        "name": raw_name,
-        "url": product.url,
-        "status": "pending",
-        "name_parsed": None,
-        "sku": None,
-        "price": None,
-        "availability": None,
-        "history": [],
-        "created_at": datetime.now().isoformat(),
-        "last_parsed_at": None
-    }
+        new_product = make_new_product(product.url, product.name)
     
-    db["products"].append(new_product)
-    await save_db(db)
+        db["products"].append(new_product)
+        await save_db(db, changed_ids=[new_product["id"]])
     
     return {"success": True, "product": new_product}
 
 
+@app.post("/products/import")
+async def import_products_endpoint(request: Request):
+    """
+    Масовий імпорт товарів.
+    Тіло - JSON: список URL, список {"url", "name"} або {"urls": [...]};
+    або multipart-форма з файлом (поле file) - CSV з колонкою url або текст з URL по рядках.
+    Дублікати пропускаються, усі нові товари зберігаються одним записом.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Файл не передано (поле file)")
+        entries = parse_import_text((await upload.read()).decode("utf-8", errors="replace"))
+    else:
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некоректний JSON")
+        if isinstance(payload, dict):
+            payload = payload.get("urls") or payload.get("products") or []
+        if not isinstance(payload, list):
+            raise HTTPException(status_code=400, detail="Очікується список URL або товарів")
+        entries = [
+            {"url": item, "name": None} if isinstance(item, str) else
+            {"url": item.get("url") or "", "name": item.get("name")}
+            for item in payload if isinstance(item, (str, dict))
+        ]
+    
+    if len(entries) > MAX_IMPORT_PRODUCTS:
+        raise HTTPException(status_code=413, detail=f"Забагато товарів в одному імпорті (максимум {MAX_IMPORT_PRODUCTS})")
+    
+    return {"success": True, **await import_products(entries)}
+
+
 @app.get("/products/list")
 async def list_products(
     name: Optional[str] = None,
@@ -113,153 +174,160 @@ async def list_products(
     availability: Optional[str] = None,
     price_from: Optional[float] = None,
     price_to: Optional[float] = None,
-    problematic: Optional[bool] = None
+    problematic: Optional[bool] = None,
+    sort: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None
 ):
-    """Отримати список товарів з фільтрами"""
+    """
+    Отримати список товарів з фільтрами (через вторинні індекси товарів).
+    sort - price, last_parsed_at, name або competitor ("-" - за спаданням),
+    limit/cursor - сторінка та курсор наступної сторінки (next_cursor у відповіді),
+    fields - поля товарів у відповіді через кому (за замовчуванням - усі).
+    """
     try:
-        db = await load_db()
-        products = db.get("products", [])
+        parse_sort(sort)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        filtered = await select_filtered_products({
+            "name": name,
+            "competitor_id": competitor_id,
+            "category_ids": category_ids,
+            "status": status,
+            "availability": availability,
+            "price_from": price_from,
+            "price_to": price_to,
+            "problematic": problematic
+        })
     except Exception as e:
         import traceback
         print(f"Помилка завантаження бази даних: {e}")
         print(traceback.format_exc())
-        return {"products": []}
-    
-    # Застосовуємо фільтри
-    filtered = products
-    
-    # Фільтр по назві
-    if name:
-        name_lower = name.lower()
-        filtered = [p for p in filtered if name_lower in (p.get("name", "") or "").lower() or 
-                    name_lower in (p.get("name_parsed", "") or "").lower()]
-    
-    # Фільтр по конкурентові
-    if competitor_id and competitor_id != "all":
-        filtered = [p for p in filtered if p.get("competitor_id") == competitor_id]
-    
-    # Фільтр по категоріях (перевіряємо category_path - шукаємо ID категорій у шляху)
-    if category_ids:
-        try:
-            if isinstance(category_ids, str):
-                category_ids = [category_ids]
-            # Шукаємо товари, у яких category_path містить хоча б одну з вибраних категорій
-            # Для цього потрібно знайти категорії за ID у competitors.json
-            competitors_db = await load_competitors()
-            
-            # Збираємо всі назви категорій за ID
-            category_names = []
-            def find_category_by_id(categories, cat_id):
-                for cat in categories:
-                    if cat.get("id") == cat_id:
-                        return cat.get("name")
-                    if cat.get("children"):
-                        found = find_category_by_id(cat["children"], cat_id)
-                        if found:
-                            return found
-                return None
-            
-            for competitor in competitors_db.get("competitors", []):
-                for cat_id in category_ids:
-                    cat_name = find_category_by_id(competitor.get("categories", []), cat_id)
-                    if cat_name:
-                        category_names.append(cat_name)
-            
-            if category_names:
-                filtered = [p for p in filtered if any(
-                    cat_name in (p.get("category_path", []) or []) for cat_name in category_names
-                )]
-        except Exception as e:
-            import traceback
-            print(f"Помилка фільтрації по категоріях: {e}")
-            print(traceback.format_exc())
-            # Продовжуємо без фільтрації по категоріях
-    
-    # Фільтр по статусу
-    if status:
-        filtered = [p for p in filtered if p.get("status") == status]
-    
-    # Фільтр по наявності
-    if availability:
-        filtered = [p for p in filtered if (p.get("availability") or "").lower() == availability.lower()]
-    
-    # Фільтр по ціні від
-    if price_from is not None:
-        filtered = [p for p in filtered if p.get("price") is not None and p.get("price", 0) >= price_from]
-    
-    # Фільтр по ціні до
-    if price_to is not None:
-        filtered = [p for p in filtered if p.get("price") is not None and p.get("price", 0) <= price_to]
-    
-    # Фільтр проблемних товарів (товари з помилками або без ціни/наявності)
-    if problematic:
-        filtered = [p for p in filtered if (
-            p.get("status") == "error" or
-            (p.get("status") == "parsed" and (p.get("price") is None or p.get("availability") is None))
-        )]
-    
-    return {"products": filtered}
+        return {"products": [], "total": 0, "next_cursor": None}
+
+    competitor_names = None
+    if sort and sort.lstrip("-+") == "competitor":
+        competitors_db = await load_competitors_view()
+        competitor_names = {c.get("id"): c.get("name") for c in competitors_db.get("competitors", [])}
+    try:
+        page, next_cursor = paginate_products(filtered, sort, cursor, limit, competitor_names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"products": project_fields(page, fields), "total": len(filtered), "next_cursor": next_cursor}
+
+
+@app.get("/products/facets")
+async def product_facets(
+    name: Optional[str] = None,
+    competitor_id: Optional[str] = None,
+    category_ids: Optional[List[str]] = Query(None),
+    status: Optional[str] = None,
+    availability: Optional[str] = None,
+    price_from: Optional[float] = None,
+    price_to: Optional[float] = None,
+    problematic: Optional[bool] = None,
+    price_edges: Optional[List[float]] = Query(None)
+):
+    """
+    Кількість товарів за конкурентами, категоріями, статусами, наявністю та ціновими
+    інтервалами для поточних фільтрів (ті ж фільтри, що і в /products/list).
+    price_edges - межі цінових інтервалів (за замовчуванням DEFAULT_PRICE_EDGES).
+    """
+    filters = {
+        "name": name,
+        "competitor_id": competitor_id if competitor_id != "all" else None,
+        "category_ids": category_ids,
+        "status": status,
+        "availability": availability,
+        "price_from": price_from,
+        "price_to": price_to,
+        "problematic": problematic
+    }
+    index = await get_product_index()
+    if any(value not in (None, "", False, []) for value in filters.values()):
+        products = await select_filtered_products(filters)
+        total = len(products)
+    else:
+        # Без фільтрів лічильники беруться безпосередньо з розмірів індексів
+        products = None
+        total = len(index.by_id)
+    counts = index.facet_counts(products, price_edges or DEFAULT_PRICE_EDGES)
+
+    def ranked(field_counts):
+        return sorted(field_counts.items(), key=lambda item: (-item[1], str(item[0])))
+
+    competitors_db = await load_competitors_view()
+    competitor_names = {c.get("id"): c.get("name") for c in competitors_db.get("competitors", [])}
+    return {
+        "total": total,
+        "competitors": [
+            {"id": value, "name": competitor_names.get(value), "count": count}
+            for value, count in ranked(counts["competitor_id"])
+        ],
+        "categories": [{"name": value, "count": count} for value, count in ranked(counts["category"])],
+        "status": [{"value": value, "count": count} for value, count in ranked(counts["status"])],
+        "availability": [{"value": value or None, "count": count} for value, count in ranked(counts["availability"])],
+        "price": counts["price"]
+    }
+
+
+@app.get("/products/search")
+async def search_products(q: str, limit: int = Query(20, ge=1, le=500)):
+    """Повнотекстовий пошук товарів за назвою та артикулом (за релевантністю)"""
+    index = await get_product_index()
+    matches = index.search(q) or []
+    return {
+        "total": len(matches),
+        "products": [{**index.get(product_id), "score": score} for product_id, score in matches[:limit]]
+    }
 
 
 @app.post("/products/parse_one/{product_id}")
 async def parse_one_product(product_id: str):
     """Спарсити один товар"""
-    db = await load_db()
-    
-    product_data = None
-    for p in db["products"]:
-        if p["id"] == product_id:
-            product_data = p
-            break
-    
+    product_data = await get_product_by_id(product_id)
     if not product_data:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
-    product = Product(**product_data)
-    
     try:
-        parsed_data = await parse_product(product)
-        await save_result(product_id, parsed_data)
+        # Явний запит не обмежується вікном оновлення; якщо товар вже парситься іншою задачею -
+        # чекаємо її завершення і повертаємо її результат замість повторного парсингу
+        parsed_data = await refresh_product(product_data, respect_window=False)
+        if parsed_data is None:
+            return {"success": True, "product": await get_product_by_id(product_id), "skipped": True}
         
         # Перевіряємо, чи товар не вимкнений конкурентом
         if parsed_data.get("status") == "disabled_by_competitor":
             # Товар вимкнений конкурентом - це не помилка, але повертаємо інформацію
-            for p in db["products"]:
-                if p["id"] == product_id:
-                    return {"success": True, "product": p, "parsed_data": parsed_data, "disabled": True}
+            p = await get_product_by_id(product_id)
+            if p:
+                return {"success": True, "product": p, "parsed_data": parsed_data, "disabled": True}
         
-        # Додаємо лог про успішний парсинг
-        for p in db["products"]:
-            if p["id"] == product_id:
-                if "logs" not in p:
-                    p["logs"] = []
-                log_entry = {
-                    "date": datetime.now().isoformat(),
-                    "operation": "parse",
-                    "status": "success",
-                    "message": f"Товар успішно спарсено. Ціна: {parsed_data.get('price')}, Наявність: {parsed_data.get('availability')}"
-                }
-                p["logs"].append(log_entry)
-                await save_db(db)
-                return {"success": True, "product": p, "parsed_data": parsed_data}
+        # Додаємо лог про успішний парсинг (на свіжій копії бази, вже з результатом парсингу)
+        log_entry = {
+            "date": datetime.now().isoformat(),
+            "operation": "parse",
+            "status": "success",
+            "message": f"Товар успішно спарсено. Ціна: {parsed_data.get('price')}, Наявність: {parsed_data.get('availability')}"
+        }
+        p = await append_product_log(product_id, log_entry)
+        if p:
+            return {"success": True, "product": p, "parsed_data": parsed_data}
         
         return {"success": True, "parsed_data": parsed_data}
     except Exception as e:
         # Оновлюємо статус на помилку та додаємо лог
-        for p in db["products"]:
-            if p["id"] == product_id:
-                p["status"] = "error"
-                if "logs" not in p:
-                    p["logs"] = []
-                log_entry = {
-                    "date": datetime.now().isoformat(),
-                    "operation": "parse",
-                    "status": "error",
-                    "message": str(e)
-                }
-                p["logs"].append(log_entry)
-                break
-        await save_db(db)
+        log_entry = {
+            "date": datetime.now().isoformat(),
+            "operation": "parse",
+            "status": "error",
+            "message": str(e)
+        }
+        await append_product_log(product_id, log_entry, {"status": "error"})
         
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -267,65 +335,44 @@ async def parse_one_product(product_id: str):
 @app.post("/products/parse_full/{product_id}")
 async def parse_full_product(product_id: str):
     """Спарсити товар з повними даними (назва, SKU, ціна, наявність)"""
-    db = await load_db()
-    
-    product_data = None
-    for p in db["products"]:
-        if p["id"] == product_id:
-            product_data = p
-            break
-    
+    product_data = await get_product_by_id(product_id)
     if not product_data:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
-    product = Product(**product_data)
-    
     try:
-        parsed_data = await parse_product_full(product)
-        await save_result(product_id, parsed_data)
-        
-        # Перезавантажуємо db після збереження, щоб отримати оновлені дані
-        db = await load_db()
+        # Якщо товар вже парситься іншою задачею - повертаємо її результат замість повторного парсингу
+        parsed_data = await refresh_product(product_data, full=True, respect_window=False)
+        if parsed_data is None:
+            return {"success": True, "product": await get_product_by_id(product_id), "skipped": True}
         
         # Перевіряємо, чи товар не вимкнений конкурентом
         if parsed_data.get("status") == "disabled_by_competitor":
             # Товар вимкнений конкурентом - це не помилка, але повертаємо інформацію
-            for p in db["products"]:
-                if p["id"] == product_id:
-                    return {"success": True, "product": p, "parsed_data": parsed_data, "disabled": True}
+            p = await get_product_by_id(product_id)
+            if p:
+                return {"success": True, "product": p, "parsed_data": parsed_data, "disabled": True}
         
-        # Додаємо лог про успішний парсинг
-        for p in db["products"]:
-            if p["id"] == product_id:
-                if "logs" not in p:
-                    p["logs"] = []
-                log_entry = {
-                    "date": datetime.now().isoformat(),
-                    "operation": "parse_full",
-                    "status": "success",
-                    "message": f"Всі дані товару успішно спарсено. Назва: {parsed_data.get('name')}, SKU: {parsed_data.get('sku')}, Ціна: {parsed_data.get('price')}, Наявність: {parsed_data.get('availability')}"
-                }
-                p["logs"].append(log_entry)
-                await save_db(db)
-                return {"success": True, "product": p, "parsed_data": parsed_data}
+        # Додаємо лог про успішний парсинг (на свіжій копії бази, вже з результатом парсингу)
+        log_entry = {
+            "date": datetime.now().isoformat(),
+            "operation": "parse_full",
+            "status": "success",
+            "message": f"Всі дані товару успішно спарсено. Назва: {parsed_data.get('name')}, SKU: {parsed_data.get('sku')}, Ціна: {parsed_data.get('price')}, Наявність: {parsed_data.get('availability')}"
+        }
+        p = await append_product_log(product_id, log_entry)
+        if p:
+            return {"success": True, "product": p, "parsed_data": parsed_data}
         
         return {"success": True, "parsed_data": parsed_data}
     except Exception as e:
         # Оновлюємо статус на помилку та додаємо лог
-        for p in db["products"]:
-            if p["id"] == product_id:
-                p["status"] = "error"
-                if "logs" not in p:
-                    p["logs"] = []
-                log_entry = {
-                    "date": datetime.now().isoformat(),
-                    "operation": "parse_full",
-                    "status": "error",
-                    "message": str(e)
-                }
-                p["logs"].append(log_entry)
-                break
-        await save_db(db)
+        log_entry = {
+            "date": datetime.now().isoformat(),
+            "operation": "parse_full",
+            "status": "error",
+            "message": str(e)
+        }
+        await append_product_log(product_id, log_entry, {"status": "error"})
         
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -339,8 +386,11 @@ async def parse_all_products_legacy():
     for product_data in db["products"]:
         product = Product(**product_data)
         try:
-            parsed_data = await parse_product(product)
-            await save_result(product.id, parsed_data)
+            parsed_data = await refresh_product(product_data, respect_window=False)
+            if parsed_data is None:
+                # Товар вже спарсила інша задача
+                results.append({"product_id": product.id, "product_name": product.name, "success": True, "skipped": True})
+                continue
             results.append({
                 "product_id": product.id,
                 "product_name": product.name,
@@ -373,17 +423,18 @@ async def get_keys():
 @app.post("/settings/add_key")
 async def add_key(key_data: APIKeyAdd):
     """Додати новий API ключ"""
-    settings = await load_settings()
+    async with get_store_lock(SETTINGS_FILE):
+        settings = await load_settings()
     
-    new_key = APIKey(
-        id=str(uuid.uuid4()),
-        name=key_data.name,
-        key=key_data.key,
-        active=False
-    )
+        new_key = APIKey(
+            id=str(uuid.uuid4()),
+            name=key_data.name,
+            key=key_data.key,
+            active=False
+        )
     
-    settings.keys.append(new_key)
-    await save_settings(settings)
+        settings.keys.append(new_key)
+        await save_settings(settings)
     
     return {"success": True, "key": new_key.dict()}
 
@@ -391,47 +442,49 @@ async def add_key(key_data: APIKeyAdd):
 @app.post("/settings/activate_key/{key_id}")
 async def activate_key(key_id: str):
     """Активувати API ключ"""
-    settings = await load_settings()
+    async with get_store_lock(SETTINGS_FILE):
+        settings = await load_settings()
     
-    # Деактивуємо всі ключі
-    for key in settings.keys:
-        key.active = False
-    
-    # Активуємо вибраний ключ
-    found = False
-    for key in settings.keys:
-        if key.id == key_id:
-            key.active = True
-            settings.current_key = key_id
-            found = True
-            break
+        # Деактивуємо всі ключі
+        for key in settings.keys:
+            key.active = False
+    
+        # Активуємо вибраний ключ
+        found = False
+        for key in settings.keys:
+            if key.id == key_id:
+                key.active = True
+                settings.current_key = key_id
+                found = True
+                break
     
-    if not found:
-        raise HTTPException(status_code=404, detail="Ключ не знайдено")
+        if not found:
+            raise HTTPException(status_code=404, detail="Ключ не знайдено")
     
-    await save_settings(settings)
+        await save_settings(settings)
     return {"success": True, "current_key": settings.current_key}
 
 
 @app.delete("/settings/delete_key/{key_id}")
 async def delete_key(key_id: str):
     """Видалити API ключ"""
-    settings = await load_settings()
+    async with get_store_lock(SETTINGS_FILE):
+        settings = await load_settings()
     
-    # Не можна видалити активний ключ
-    if settings.current_key == key_id:
-        raise HTTPException(
-            status_code=400,
-            detail="Не можна видалити активний ключ. Спочатку активуйте інший."
-        )
+        # Не можна видалити активний ключ
+        if settings.current_key == key_id:
+            raise HTTPException(
+                status_code=400,
+                detail="Не можна видалити активний ключ. Спочатку активуйте інший."
+            )
     
-    settings.keys = [k for k in settings.keys if k.id != key_id]
+        settings.keys = [k for k in settings.keys if k.id != key_id]
     
-    # Якщо видалений ключ був поточним, очищаємо
-    if settings.current_key == key_id:
-        settings.current_key = None
+        # Якщо видалений ключ був поточним, очищаємо
+        if settings.current_key == key_id:
+            settings.current_key = None
     
-    await save_settings(settings)
+        await save_settings(settings)
     return {"success": True}
 
 
@@ -452,14 +505,7 @@ async def product_page(product_id: str):
 @app.get("/products/{product_id}")
 async def get_product(product_id: str):
     """Отримати детальну інформацію про товар"""
-    db = await load_db()
-    
-    product_data = None
-    for p in db["products"]:
-        if p["id"] == product_id:
-            product_data = p
-            break
-    
+    product_data = await get_product_by_id(product_id)
     if not product_data:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
@@ -480,27 +526,96 @@ async def get_product(product_id: str):
             "availability": product_data.get("availability"),
             "updated_at": product_data.get("last_parsed_at")
         },
-        "history": product_data.get("history", []),
-        "parsing_rules": product_data.get("parsing_rules"),
-        "logs": product_data.get("logs", [])
+        "history": expand_history(await load_history(product_id, product_data.get("history_run"))),
+        "parsing_rules": product_data.get("parsing_rules")
     }
     
     return response
 
 
+@app.get("/products/{product_id}/history")
+async def get_product_history(product_id: str, expand: bool = False):
+    """
+    Отримати історію цін та наявності товару (з журналу історії).
+    За замовчуванням - відрізки незмінних значень (date, last_confirmed_at, count),
+    expand=true - повний ряд спостережень (відновлюється з offsets відрізків).
+    """
+    product_data = await get_product_by_id(product_id)
+    if not product_data:
+        raise HTTPException(status_code=404, detail="Товар не знайдено")
+    
+    runs = await load_history(product_id, product_data.get("history_run"))
+    return {"product_id": product_id, "history": expand_history(runs) if expand else runs}
+
+
+@app.get("/products/{product_id}/logs")
+async def get_product_logs(product_id: str, limit: Optional[int] = None):
+    """Отримати останні записи логу операцій товару (сторінка товару завантажує їх окремо)"""
+    if not await get_product_by_id(product_id):
+        raise HTTPException(status_code=404, detail="Товар не знайдено")
+    
+    return {"product_id": product_id, "logs": await load_logs(product_id, limit)}
+
+
+def _parse_epoch(value: Optional[str], name: str) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некоректна дата {name}: {value}")
+
+
+@app.get("/products/{product_id}/history/analytics")
+async def get_product_history_analytics(product_id: str, interval: str = "day",
+                                        start: Optional[str] = None, end: Optional[str] = None):
+    """
+    Аналітика історії товару: мінімальна/максимальна/середня ціна, зміна ціни у відсотках
+    та ступінчастий ряд з кроком interval (hour, day, week) для графіка.
+    """
+    if interval not in RESAMPLE_INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Невідомий інтервал: {interval}")
+    product_data = await get_product_by_id(product_id)
+    if not product_data:
+        raise HTTPException(status_code=404, detail="Товар не знайдено")
+    
+    columns = await load_columns(product_data)
+    try:
+        series = columns.resample(RESAMPLE_INTERVALS[interval], _parse_epoch(start, "start"), _parse_epoch(end, "end"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "product_id": product_id,
+        "interval": interval,
+        "summary": columns.summary(),
+        "series": series
+    }
+
+
+@app.get("/history/analytics")
+async def get_history_analytics(competitor_id: Optional[str] = None, category_ids: Optional[List[str]] = Query(None),
+                                limit: int = 1000):
+    """Зведена аналітика історії цін для набору товарів (фільтр за конкурентом та категоріями)"""
+    products = await select_filtered_products({
+        "competitor_id": competitor_id,
+        "category_ids": category_ids or []
+    })
+    products = products[:max(0, limit)]
+    
+    items = []
+    for product_data in products:
+        columns = await load_columns(product_data)
+        items.append({"product_id": product_data["id"], **columns.summary()})
+    
+    return {"total": len(items), "items": items}
+
+
 @app.post("/products/regenerate_rules/{product_id}")
 async def regenerate_rules(product_id: str):
     """Регенерувати правила парсингу для товару"""
     from .gpt_client import GPTClient
     
-    db = await load_db()
-    
-    product_data = None
-    for p in db["products"]:
-        if p["id"] == product_id:
-            product_data = p
-            break
-    
+    product_data = await get_product_by_id(product_id)
     if not product_data:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
@@ -535,21 +650,14 @@ async def regenerate_rules(product_id: str):
         if token_usage:
             await save_token_usage(api_key_obj.id, token_usage)
         
-        # Зберігаємо правила
-        product_data["parsing_rules"] = rules
-        await save_db(db)
-        
-        # Додаємо лог
+        # Зберігаємо правила та лог (генерація тривала - записуємо на свіжу копію бази)
         log_entry = {
             "date": datetime.now().isoformat(),
             "operation": "regenerate_rules",
             "status": "success",
             "message": "Правила парсингу успішно регенеровано"
         }
-        if "logs" not in product_data:
-            product_data["logs"] = []
-        product_data["logs"].append(log_entry)
-        await save_db(db)
+        await append_product_log(product_id, log_entry, {"parsing_rules": rules})
         
         return {"success": True, "rules": rules}
     except Exception as e:
@@ -560,10 +668,7 @@ async def regenerate_rules(product_id: str):
             "status": "error",
             "message": str(e)
         }
-        if "logs" not in product_data:
-            product_data["logs"] = []
-        product_data["logs"].append(log_entry)
-        await save_db(db)
+        await append_product_log(product_id, log_entry)
         
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -573,14 +678,7 @@ async def test_rules(product_id: str):
     """Тестувати правила парсингу для товару"""
     from .gpt_client import GPTClient
     
-    db = await load_db()
-    
-    product_data = None
-    for p in db["products"]:
-        if p["id"] == product_id:
-            product_data = p
-            break
-    
+    product_data = await get_product_by_id(product_id)
     if not product_data:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
@@ -611,10 +709,7 @@ async def test_rules(product_id: str):
             "status": "success" if result["success"] else "error",
             "message": f"Тест правил: {'успішно' if result['success'] else 'помилки знайдено'}"
         }
-        if "logs" not in product_data:
-            product_data["logs"] = []
-        product_data["logs"].append(log_entry)
-        await save_db(db)
+        await append_product_log(product_id, log_entry)
         
         return result
     except Exception as e:
@@ -625,10 +720,7 @@ async def test_rules(product_id: str):
             "status": "error",
             "message": str(e)
         }
-        if "logs" not in product_data:
-            product_data["logs"] = []
-        product_data["logs"].append(log_entry)
-        await save_db(db)
+        await append_product_log(product_id, log_entry)
         
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -638,20 +730,21 @@ async def test_rules(product_id: str):
 @app.post("/competitors/add")
 async def add_competitor(competitor: CompetitorAdd):
     """Додати нового конкурента"""
-    competitors_db = await load_competitors()
-    
-    new_competitor = {
-        "id": str(uuid.uuid4()),
-        "name": competitor.name,
-        "url": competitor.url,
-        "categories": [],
-        "last_parsed": None,
-        "notes": competitor.notes or "",
-        "active": True
-    }
+    async with get_store_lock(COMPETITORS_FILE):
+        competitors_db = await load_competitors()
+    
+        new_competitor = {
+            "id": str(uuid.uuid4()),
+            "name": competitor.name,
+            "url": competitor.url,
+            "categories": [],
+            "last_parsed": None,
+            "notes": competitor.notes or "",
+            "active": True
+        }
     
-    competitors_db["competitors"].append(new_competitor)
-    await save_competitors(competitors_db)
+        competitors_db["competitors"].append(new_competitor)
+        await save_competitors(competitors_db)
     
     return {"success": True, "competitor": new_competitor}
 
@@ -659,62 +752,26 @@ async def add_competitor(competitor: CompetitorAdd):
 @app.get("/competitors/list")
 async def list_competitors():
     """Отримати список всіх конкурентів"""
-    competitors_db = await load_competitors()
+    competitors_db = await load_competitors_view()
     return {"competitors": competitors_db["competitors"]}
 
 
-@app.get("/competitors/{competitor_id}")
-async def get_competitor(competitor_id: str):
-    """Отримати детальну інформацію про конкурента"""
-    competitors_db = await load_competitors()
-    
-    competitor_data = None
-    for c in competitors_db["competitors"]:
-        if c["id"] == competitor_id:
-            competitor_data = c
-            break
-    
-    if not competitor_data:
-        raise HTTPException(status_code=404, detail="Конкурент не знайдено")
-    
-    return competitor_data
-
-
-@app.get("/competitors/by_name/{competitor_name}")
-async def get_competitor_by_name(competitor_name: str):
-    """Знайти конкурента за назвою"""
-    from urllib.parse import unquote
-    competitors_db = await load_competitors()
-    
-    # Декодуємо URL-encoded назву
-    competitor_name = unquote(competitor_name)
-    competitor_name_lower = competitor_name.lower().strip()
-    
-    # Спочатку шукаємо точний збіг
-    for c in competitors_db["competitors"]:
-        if c["name"].lower().strip() == competitor_name_lower:
-            return {"id": c["id"], "name": c["name"]}
-    
-    # Потім шукаємо частковий збіг (назва містить шукану назву або навпаки)
-    for c in competitors_db["competitors"]:
-        c_name_lower = c["name"].lower().strip()
-        if competitor_name_lower in c_name_lower or c_name_lower in competitor_name_lower:
-            return {"id": c["id"], "name": c["name"]}
-    
-    # Якщо не знайдено, повертаємо None
-    return None
-
-
 @app.get("/competitors/by_category")
 async def get_competitor_by_category(category_path: List[str] = Query(None)):
     """Знайти конкурента за категорією товару (category_path)"""
     if not category_path or len(category_path) == 0:
         return None
     
-    competitors_db = await load_competitors()
+    category_index = await get_competitor_category_index()
+    active_competitors = [c for c in category_index.competitors.values() if c.get("active", True)]
+    
+    # Точний збіг шляху (без урахування регістру) - пошук у сплощених деревах
+    for competitor in active_competitors:
+        if category_index.tree(competitor["id"]).find_path(category_path) is not None:
+            return {"id": competitor["id"], "name": competitor["name"]}
     
     def find_category_in_competitor(categories, search_path):
-        """Рекурсивно шукає категорію в дереві категорій конкурента"""
+        """Рекурсивно шукає категорію в дереві за частковим збігом назв (якщо точного збігу немає)"""
         if not search_path or len(search_path) == 0:
             return False
         
@@ -742,10 +799,7 @@ async def get_competitor_by_category(category_path: List[str] = Query(None)):
         return False
     
     # Шукаємо конкурента, у якого є така категорія
-    for competitor in competitors_db.get("competitors", []):
-        if not competitor.get("active", True):
-            continue
-        
+    for competitor in active_competitors:
         categories = competitor.get("categories", [])
         if find_category_in_competitor(categories, category_path):
             return {"id": competitor["id"], "name": competitor["name"]}
@@ -753,13 +807,56 @@ async def get_competitor_by_category(category_path: List[str] = Query(None)):
     return None
 
 
+@app.get("/competitors/{competitor_id}")
+async def get_competitor(competitor_id: str):
+    """Отримати детальну інформацію про конкурента"""
+    competitors_db = await load_competitors_view()
+    
+    competitor_data = None
+    for c in competitors_db["competitors"]:
+        if c["id"] == competitor_id:
+            competitor_data = c
+            break
+    
+    if not competitor_data:
+        raise HTTPException(status_code=404, detail="Конкурент не знайдено")
+    
+    return competitor_data
+
+
+@app.get("/competitors/by_name/{competitor_name}")
+async def get_competitor_by_name(competitor_name: str):
+    """Знайти конкурента за назвою"""
+    from urllib.parse import unquote
+    competitors_db = await load_competitors_view()
+    
+    # Декодуємо URL-encoded назву
+    competitor_name = unquote(competitor_name)
+    competitor_name_lower = competitor_name.lower().strip()
+    
+    # Спочатку шукаємо точний збіг
+    for c in competitors_db["competitors"]:
+        if c["name"].lower().strip() == competitor_name_lower:
+            return {"id": c["id"], "name": c["name"]}
+    
+    # Потім шукаємо частковий збіг (назва містить шукану назву або навпаки)
+    for c in competitors_db["competitors"]:
+        c_name_lower = c["name"].lower().strip()
+        if competitor_name_lower in c_name_lower or c_name_lower in competitor_name_lower:
+            return {"id": c["id"], "name": c["name"]}
+    
+    # Якщо не знайдено, повертаємо None
+    return None
+
+
 @app.delete("/competitors/{competitor_id}")
 async def delete_competitor(competitor_id: str):
     """Видалити конкурента"""
-    competitors_db = await load_competitors()
+    async with get_store_lock(COMPETITORS_FILE):
+        competitors_db = await load_competitors()
     
-    competitors_db["competitors"] = [c for c in competitors_db["competitors"] if c["id"] != competitor_id]
-    await save_competitors(competitors_db)
+        competitors_db["competitors"] = [c for c in competitors_db["competitors"] if c["id"] != competitor_id]
+        await save_competitors(competitors_db)
     
     return {"success": True}
 
@@ -769,7 +866,7 @@ async def parse_competitor_categories(competitor_id: str):
     """Спарсити категорії конкурента"""
     from .gpt_client import GPTClient
     
-    competitors_db = await load_competitors()
+    competitors_db = await load_competitors_view()
     
     competitor_data = None
     for c in competitors_db["competitors"]:
@@ -796,11 +893,11 @@ async def parse_competitor_categories(competitor_id: str):
         client = GPTClient(api_key_obj.key)
         categories = client.parse_competitor_categories(competitor_data["url"])
         
-        # Оновлюємо категорії конкурента
-        competitor_data["categories"] = categories
-        competitor_data["last_parsed"] = datetime.now().isoformat()
-        
-        await save_competitors(competitors_db)
+        # Оновлюємо категорії конкурента (на свіжій копії бази - парсинг міг тривати довго)
+        await update_competitor_fields(competitor_id, {
+            "categories": categories,
+            "last_parsed": datetime.now().isoformat()
+        })
         
         return {"success": True, "categories": categories}
     except Exception as e:
@@ -814,102 +911,88 @@ async def add_category_manually(competitor_id: str, request: dict):
     from urllib.parse import urlparse
     import hashlib
     
-    competitors_db = await load_competitors()
+    async with get_store_lock(COMPETITORS_FILE):
+        competitors_db = await load_competitors()
     
-    competitor_data = None
-    for c in competitors_db["competitors"]:
-        if c["id"] == competitor_id:
-            competitor_data = c
-            break
+        competitor_data = None
+        for c in competitors_db["competitors"]:
+            if c["id"] == competitor_id:
+                competitor_data = c
+                break
     
-    if not competitor_data:
-        raise HTTPException(status_code=404, detail="Конкурент не знайдено")
+        if not competitor_data:
+            raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
-    url = request.get("url", "").strip()
-    name = request.get("name", "").strip()
+        url = request.get("url", "").strip()
+        name = request.get("name", "").strip()
     
-    if not url:
-        raise HTTPException(status_code=400, detail="URL категорії обов'язковий")
-    if not name:
-        raise HTTPException(status_code=400, detail="Назва категорії обов'язкова")
+        if not url:
+            raise HTTPException(status_code=400, detail="URL категорії обов'язковий")
+        if not name:
+            raise HTTPException(status_code=400, detail="Назва категорії обов'язкова")
     
-    # Валідація URL
-    try:
-        parsed_url = urlparse(url)
-        if not parsed_url.scheme or not parsed_url.netloc:
-            raise HTTPException(status_code=400, detail="Невірний формат URL")
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Невірний URL: {str(e)}")
-    
-    # Перевірка домену URL - чи він належить поточному конкуренту
-    competitor_url = competitor_data.get("url", "").strip()
-    if competitor_url:
+        # Валідація URL
         try:
-            competitor_parsed = urlparse(competitor_url)
-            category_parsed = urlparse(url)
+            parsed_url = urlparse(url)
+            if not parsed_url.scheme or not parsed_url.netloc:
+                raise HTTPException(status_code=400, detail="Невірний формат URL")
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Невірний URL: {str(e)}")
+    
+        # Перевірка домену URL - чи він належить поточному конкуренту
+        competitor_url = competitor_data.get("url", "").strip()
+        if competitor_url:
+            try:
+                competitor_parsed = urlparse(competitor_url)
+                category_parsed = urlparse(url)
             
-            # Нормалізуємо домени (видаляємо www)
-            competitor_domain = competitor_parsed.netloc.lower().replace("www.", "")
-            category_domain = category_parsed.netloc.lower().replace("www.", "")
+                # Нормалізуємо домени (видаляємо www)
+                competitor_domain = competitor_parsed.netloc.lower().replace("www.", "")
+                category_domain = category_parsed.netloc.lower().replace("www.", "")
             
-            if competitor_domain != category_domain:
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"URL категорії належить іншому постачальнику. Домен конкурента: {competitor_parsed.netloc}, домен категорії: {category_parsed.netloc}"
-                )
-        except HTTPException:
-            raise
-        except Exception as e:
-            logger.warning(f"Помилка перевірки домену: {str(e)}")
-            # Якщо помилка перевірки, продовжуємо (не блокуємо додавання)
-    
-    # Генеруємо ID на основі URL
-    parsed = urlparse(url)
-    path = parsed.path.strip("/").replace("/", "-")
-    if path:
-        category_id = path
-    else:
-        # Якщо немає шляху, генеруємо на основі URL
-        category_id = hashlib.md5(url.encode()).hexdigest()[:12]
-    
-    # Перевіряємо, чи категорія з таким ID або URL вже існує
-    def category_exists(categories, cat_id=None, cat_url=None):
-        """Рекурсивно перевіряє існування категорії по ID або URL"""
-        for cat in categories:
-            # Перевірка по ID
-            if cat_id and cat.get("id") == cat_id:
-                return True, "ID"
-            # Перевірка по URL
-            if cat_url and cat.get("url") and cat.get("url").strip() == cat_url.strip():
-                return True, "URL"
-            if cat.get("children"):
-                exists, reason = category_exists(cat["children"], cat_id, cat_url)
-                if exists:
-                    return True, reason
-        return False, None
-    
-    exists, reason = category_exists(competitor_data.get("categories", []), category_id, url)
-    if exists:
-        if reason == "URL":
-            raise HTTPException(status_code=400, detail="Категорія з таким URL вже існує")
+                if competitor_domain != category_domain:
+                    raise HTTPException(
+                        status_code=400, 
+                        detail=f"URL категорії належить іншому постачальнику. Домен конкурента: {competitor_parsed.netloc}, домен категорії: {category_parsed.netloc}"
+                    )
+            except HTTPException:
+                raise
+            except Exception as e:
+                logger.warning(f"Помилка перевірки домену: {str(e)}")
+                # Якщо помилка перевірки, продовжуємо (не блокуємо додавання)
+    
+        # Генеруємо ID на основі URL
+        parsed = urlparse(url)
+        path = parsed.path.strip("/").replace("/", "-")
+        if path:
+            category_id = path
         else:
-            raise HTTPException(status_code=400, detail="Категорія з таким ID вже існує")
-    
-    # Створюємо нову категорію
-    new_category = {
-        "id": category_id,
-        "name": name,
-        "url": url,
-        "children": [],
-        "manual_added": True  # Позначаємо, що додано вручну
-    }
+            # Якщо немає шляху, генеруємо на основі URL
+            category_id = hashlib.md5(url.encode()).hexdigest()[:12]
+    
+        # Перевіряємо, чи категорія з таким ID або URL вже існує (індекс категорій конкурента)
+        category_tree = (await get_competitor_category_index()).tree(competitor_id)
+        if category_tree is not None:
+            if normalize_url(url) in category_tree.by_url:
+                raise HTTPException(status_code=400, detail="Категорія з таким URL вже існує")
+            if category_id in category_tree.by_id:
+                raise HTTPException(status_code=400, detail="Категорія з таким ID вже існує")
+    
+        # Створюємо нову категорію
+        new_category = {
+            "id": category_id,
+            "name": name,
+            "url": url,
+            "children": [],
+            "manual_added": True  # Позначаємо, що додано вручну
+        }
     
-    # Додаємо категорію до списку
-    if "categories" not in competitor_data:
-        competitor_data["categories"] = []
-    competitor_data["categories"].append(new_category)
+        # Додаємо категорію до списку
+        if "categories" not in competitor_data:
+            competitor_data["categories"] = []
+        competitor_data["categories"].append(new_category)
     
-    await save_competitors(competitors_db)
+        await save_competitors(competitors_db)
     
     # Якщо є активний API ключ, спробуємо автоматично оновити назву через GPT
     try:
@@ -938,8 +1021,14 @@ async def add_category_manually(competitor_id: str, request: dict):
                             return True
                 return False
             
-            update_category_name(competitor_data["categories"], category_id, parsed_name)
-            await save_competitors(competitors_db)
+            # Назву отримано після запиту до GPT - оновлюємо свіжу копію бази під блокуванням
+            async with get_store_lock(COMPETITORS_FILE):
+                competitors_db = await load_competitors()
+                for c in competitors_db["competitors"]:
+                    if c["id"] == competitor_id:
+                        update_category_name(c.get("categories", []), category_id, parsed_name)
+                        break
+                await save_competitors(competitors_db)
             
             return {
                 "success": True,
@@ -961,51 +1050,52 @@ async def add_category_manually(competitor_id: str, request: dict):
 @app.post("/competitors/{competitor_id}/delete_categories")
 async def delete_categories(competitor_id: str, request: dict):
     """Видалити вибрані категорії"""
-    competitors_db = await load_competitors()
+    async with get_store_lock(COMPETITORS_FILE):
+        competitors_db = await load_competitors()
     
-    competitor_data = None
-    for c in competitors_db["competitors"]:
-        if c["id"] == competitor_id:
-            competitor_data = c
-            break
+        competitor_data = None
+        for c in competitors_db["competitors"]:
+            if c["id"] == competitor_id:
+                competitor_data = c
+                break
     
-    if not competitor_data:
-        raise HTTPException(status_code=404, detail="Конкурент не знайдено")
+        if not competitor_data:
+            raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
-    category_ids = request.get("category_ids", [])
+        category_ids = request.get("category_ids", [])
     
-    if not category_ids or len(category_ids) == 0:
-        raise HTTPException(status_code=400, detail="Список ID категорій обов'язковий")
+        if not category_ids or len(category_ids) == 0:
+            raise HTTPException(status_code=400, detail="Список ID категорій обов'язковий")
     
-    def delete_categories_recursive(categories, ids_to_delete):
-        """Рекурсивно видаляє категорії за ID"""
-        result = []
-        deleted_count = 0
+        def delete_categories_recursive(categories, ids_to_delete):
+            """Рекурсивно видаляє категорії за ID"""
+            result = []
+            deleted_count = 0
         
-        for cat in categories:
-            if cat.get("id") in ids_to_delete:
-                deleted_count += 1
-                # Не додаємо категорію до результату (видаляємо)
-                continue
+            for cat in categories:
+                if cat.get("id") in ids_to_delete:
+                    deleted_count += 1
+                    # Не додаємо категорію до результату (видаляємо)
+                    continue
             
-            # Обробляємо дочірні категорії рекурсивно
-            if cat.get("children"):
-                filtered_children, children_deleted = delete_categories_recursive(cat["children"], ids_to_delete)
-                deleted_count += children_deleted
-                cat["children"] = filtered_children
+                # Обробляємо дочірні категорії рекурсивно
+                if cat.get("children"):
+                    filtered_children, children_deleted = delete_categories_recursive(cat["children"], ids_to_delete)
+                    deleted_count += children_deleted
+                    cat["children"] = filtered_children
             
-            result.append(cat)
+                result.append(cat)
         
-        return result, deleted_count
+            return result, deleted_count
     
-    filtered_categories, deleted_count = delete_categories_recursive(
-        competitor_data.get("categories", []), 
-        category_ids
-    )
+        filtered_categories, deleted_count = delete_categories_recursive(
+            competitor_data.get("categories", []), 
+            category_ids
+        )
     
-    competitor_data["categories"] = filtered_categories
+        competitor_data["categories"] = filtered_categories
     
-    await save_competitors(competitors_db)
+        await save_competitors(competitors_db)
     
     return {
         "success": True,
@@ -1030,32 +1120,18 @@ async def category_page(competitor_id: str, category_id: str):
 @app.get("/competitors/{competitor_id}/category/{category_id}/data")
 async def get_category_data(competitor_id: str, category_id: str):
     """Отримати дані категорії"""
-    competitors_db = await load_competitors()
-    
-    competitor_data = None
-    for c in competitors_db["competitors"]:
-        if c["id"] == competitor_id:
-            competitor_data = c
-            break
+    category_index = await get_competitor_category_index()
+    competitor_data = category_index.competitors.get(competitor_id)
     
     if not competitor_data:
         raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
-    def find_category(categories, cat_id):
-        """Рекурсивний пошук категорії"""
-        for cat in categories:
-            if cat["id"] == cat_id:
-                return cat, []
-            if "children" in cat and cat["children"]:
-                found, path = find_category(cat["children"], cat_id)
-                if found:
-                    return found, [cat] + path
-        return None, []
-    
-    category, path = find_category(competitor_data.get("categories", []), category_id)
+    category_tree = category_index.tree(competitor_id)
+    category = category_tree.by_id.get(category_id)
     
     if not category:
         raise HTTPException(status_code=404, detail="Категорія не знайдено")
+    path = category_tree.ancestors(category_id)
     
     # Формуємо breadcrumb
     breadcrumb = [{"name": competitor_data["name"], "url": f"/competitor/{competitor_id}"}]
@@ -1063,15 +1139,10 @@ async def get_category_data(competitor_id: str, category_id: str):
         breadcrumb.append({"name": p["name"], "url": f"/competitors/{competitor_id}/category/{p['id']}"})
     breadcrumb.append({"name": category["name"], "url": f"/competitors/{competitor_id}/category/{category_id}"})
     
-    # Підраховуємо підкатегорії
-    def count_subcategories(cats):
-        count = len(cats)
-        for cat in cats:
-            if "children" in cat and cat["children"]:
-                count += count_subcategories(cat["children"])
-        return count
-    
-    subcategories_count = count_subcategories(category.get("children", []))
+    subcategories_count = category_tree.descendants_count(category_id)
+    products_count = len(category_tree.product_ids(
+        category_id, (await get_product_index()).category_paths(competitor_id)
+    ))
     
     return {
         "category": category,
@@ -1080,10 +1151,20 @@ async def get_category_data(competitor_id: str, category_id: str):
             "name": competitor_data["name"]
         },
         "breadcrumb": breadcrumb,
-        "subcategories_count": subcategories_count
+        "subcategories_count": subcategories_count,
+        "products_count": products_count
     }
 
 
+@app.get("/competitors/{competitor_id}/category_counts")
+async def get_category_counts(competitor_id: str):
+    """Кількість товарів у кожній категорії конкурента (разом з підкатегоріями)"""
+    counts = await get_category_product_counts(competitor_id)
+    if counts is None:
+        raise HTTPException(status_code=404, detail="Конкурент не знайдено")
+    return {"counts": counts}
+
+
 # ========== API ENDPOINTS ДЛЯ ФОНОВИХ ЗАДАЧ ==========
 
 @app.post("/tasks/parse_products")
@@ -1092,19 +1173,17 @@ async def create_parse_all_task(background_tasks: BackgroundTasks):
     try:
         task_id = str(uuid.uuid4())
         
+        # Якщо такий же парсинг вже виконується - повертаємо існуючу задачу
+        signature = make_task_signature("parse_products")
+        existing_task_id = claim_task(signature, task_id)
+        if existing_task_id:
+            return {"task_id": existing_task_id, "coalesced": True}
+        
         # Ініціалізуємо прогрес
-        progress = await load_progress()
-        progress["tasks"][task_id] = {
-            "type": "parse_products",
-            "total": 0,
-            "done": 0,
-            "errors": [],
-            "status": "running"
-        }
-        await save_progress(progress)
+        await register_task(task_id, "parse_products")
         
         # Запускаємо фонову задачу
-        asyncio.create_task(parse_all_products(task_id))
+        asyncio.create_task(run_coalesced_task(signature, task_id, parse_all_products(task_id)))
         
         return {"task_id": task_id}
     except Exception as e:
@@ -1119,24 +1198,19 @@ async def create_parse_product_task(product_id: str, background_tasks: Backgroun
     task_id = str(uuid.uuid4())
     
     # Перевіряємо, чи товар існує
-    db = await load_db()
-    product_exists = any(p["id"] == product_id for p in db["products"])
-    if not product_exists:
+    if not await get_product_by_id(product_id):
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
+    signature = make_task_signature("parse_product", product_id)
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
     # Ініціалізуємо прогрес
-    progress = await load_progress()
-    progress["tasks"][task_id] = {
-        "type": "parse_product",
-        "total": 1,
-        "done": 0,
-        "errors": [],
-        "status": "running"
-    }
-    await save_progress(progress)
+    await register_task(task_id, "parse_product", total=1)
     
     # Запускаємо фонову задачу
-    asyncio.create_task(parse_single_product(task_id, product_id))
+    asyncio.create_task(run_coalesced_task(signature, task_id, parse_single_product(task_id, product_id)))
     
     return {"task_id": task_id}
 
@@ -1147,24 +1221,19 @@ async def create_parse_product_full_task(product_id: str, background_tasks: Back
     task_id = str(uuid.uuid4())
     
     # Перевіряємо, чи товар існує
-    db = await load_db()
-    product_exists = any(p["id"] == product_id for p in db["products"])
-    if not product_exists:
+    if not await get_product_by_id(product_id):
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
+    signature = make_task_signature("parse_product_full", product_id)
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
     # Ініціалізуємо прогрес
-    progress = await load_progress()
-    progress["tasks"][task_id] = {
-        "type": "parse_product_full",
-        "total": 1,
-        "done": 0,
-        "errors": [],
-        "status": "running"
-    }
-    await save_progress(progress)
+    await register_task(task_id, "parse_product_full", total=1)
     
     # Запускаємо фонову задачу
-    asyncio.create_task(parse_single_product_full(task_id, product_id))
+    asyncio.create_task(run_coalesced_task(signature, task_id, parse_single_product_full(task_id, product_id)))
     
     return {"task_id": task_id}
 
@@ -1175,24 +1244,21 @@ async def create_parse_categories_task(competitor_id: str, background_tasks: Bac
     task_id = str(uuid.uuid4())
     
     # Перевіряємо, чи конкурент існує
-    competitors_db = await load_competitors()
+    competitors_db = await load_competitors_view()
     competitor_exists = any(c["id"] == competitor_id for c in competitors_db["competitors"])
     if not competitor_exists:
         raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
+    signature = make_task_signature("parse_categories", competitor_id)
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
     # Ініціалізуємо прогрес
-    progress = await load_progress()
-    progress["tasks"][task_id] = {
-        "type": "parse_categories",
-        "total": 1,
-        "done": 0,
-        "errors": [],
-        "status": "running"
-    }
-    await save_progress(progress)
+    await register_task(task_id, "parse_categories", total=1)
     
     # Запускаємо фонову задачу
-    asyncio.create_task(parse_competitor_categories(task_id, competitor_id))
+    asyncio.create_task(run_coalesced_task(signature, task_id, parse_competitor_categories(task_id, competitor_id)))
     
     return {"task_id": task_id}
 
@@ -1203,24 +1269,21 @@ async def create_update_categories_task(competitor_id: str, background_tasks: Ba
     task_id = str(uuid.uuid4())
     
     # Перевіряємо, чи конкурент існує
-    competitors_db = await load_competitors()
+    competitors_db = await load_competitors_view()
     competitor_exists = any(c["id"] == competitor_id for c in competitors_db["competitors"])
     if not competitor_exists:
         raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
+    signature = make_task_signature("update_categories", competitor_id)
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
     # Ініціалізуємо прогрес
-    progress = await load_progress()
-    progress["tasks"][task_id] = {
-        "type": "update_categories",
-        "total": 1,
-        "done": 0,
-        "errors": [],
-        "status": "running"
-    }
-    await save_progress(progress)
+    await register_task(task_id, "update_categories", total=1)
     
     # Запускаємо фонову задачу
-    asyncio.create_task(update_competitor_categories(task_id, competitor_id))
+    asyncio.create_task(run_coalesced_task(signature, task_id, update_competitor_categories(task_id, competitor_id)))
     
     return {"task_id": task_id}
 
@@ -1237,38 +1300,32 @@ async def create_discover_products_task(request: DiscoverProductsRequest, backgr
         raise HTTPException(status_code=400, detail="category_ids обов'язковий та не може бути порожнім")
     
     # Перевіряємо, чи конкурент існує
-    competitors_db = await load_competitors()
+    competitors_db = await load_competitors_view()
     competitor_exists = any(c["id"] == competitor_id for c in competitors_db["competitors"])
     if not competitor_exists:
         raise HTTPException(status_code=404, detail="Конкурент не знайдено")
     
     task_id = str(uuid.uuid4())
     
+    signature = make_task_signature("discover_products", {"competitor_id": competitor_id, "category_ids": sorted(category_ids)})
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
     # Ініціалізуємо прогрес
-    progress = await load_progress()
-    progress["tasks"][task_id] = {
-        "type": "discover_products",
-        "total": len(category_ids),
-        "done": 0,
-        "errors": [],
-        "status": "running"
-    }
-    await save_progress(progress)
+    await register_task(task_id, "discover_products", total=len(category_ids))
     
     # Запускаємо фонову задачу
     try:
-        asyncio.create_task(discover_products(task_id, competitor_id, category_ids))
+        asyncio.create_task(run_coalesced_task(signature, task_id, discover_products(task_id, competitor_id, category_ids)))
         print(f"Запущено фонову задачу discover_products: task_id={task_id}")
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
         print(f"Помилка запуску задачі discover_products: {e}\n{error_details}")
+        release_task(signature, task_id)
         # Оновлюємо статус на failed
-        progress = await load_progress()
-        if task_id in progress["tasks"]:
-            progress["tasks"][task_id]["status"] = "failed"
-            progress["tasks"][task_id]["errors"] = [f"Помилка запуску: {str(e)}"]
-            await save_progress(progress)
+        await update_task_progress(task_id, status="failed", error=f"Помилка запуску: {str(e)}")
         raise
     
     return {"task_id": task_id}
@@ -1280,19 +1337,17 @@ async def create_parse_filtered_task(filters: dict, background_tasks: Background
     try:
         task_id = str(uuid.uuid4())
         
+        # Однакові фільтри - та сама задача
+        signature = make_task_signature("parse_filtered", filters)
+        existing_task_id = claim_task(signature, task_id)
+        if existing_task_id:
+            return {"task_id": existing_task_id, "coalesced": True}
+        
         # Ініціалізуємо прогрес
-        progress = await load_progress()
-        progress["tasks"][task_id] = {
-            "type": "parse_filtered",
-            "total": 0,
-            "done": 0,
-            "errors": [],
-            "status": "running"
-        }
-        await save_progress(progress)
+        await register_task(task_id, "parse_filtered")
         
         # Запускаємо фонову задачу
-        asyncio.create_task(parse_filtered_products(task_id, filters))
+        asyncio.create_task(run_coalesced_task(signature, task_id, parse_filtered_products(task_id, filters)))
         
         return {"task_id": task_id}
     except Exception as e:
@@ -1301,6 +1356,51 @@ async def create_parse_filtered_task(filters: dict, background_tasks: Background
         raise HTTPException(status_code=500, detail=f"Помилка створення задачі: {str(e)}\n{error_details}")
 
 
+@app.post("/tasks/parse_stale")
+async def create_parse_stale_task(request: dict, background_tasks: BackgroundTasks):
+    """
+    Створити задачу на інкрементальний парсинг тільки застарілих товарів.
+    max_age_minutes - товари, що парсились раніше, вважаються застарілими (за замовчуванням 1440).
+    disabled_recheck_minutes - як часто перевіряти товари disabled_by_competitor (за замовчуванням не перевіряти).
+    """
+    try:
+        try:
+            max_age_minutes = int(request.get("max_age_minutes", 1440))
+            disabled_recheck_minutes = request.get("disabled_recheck_minutes")
+            if disabled_recheck_minutes is not None:
+                disabled_recheck_minutes = int(disabled_recheck_minutes)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="max_age_minutes та disabled_recheck_minutes мають бути цілими числами")
+        if max_age_minutes < 0 or (disabled_recheck_minutes is not None and disabled_recheck_minutes < 0):
+            raise HTTPException(status_code=400, detail="Інтервали не можуть бути від'ємними")
+        
+        task_id = str(uuid.uuid4())
+        
+        signature = make_task_signature("parse_stale", {
+            "max_age_minutes": max_age_minutes,
+            "disabled_recheck_minutes": disabled_recheck_minutes
+        })
+        existing_task_id = claim_task(signature, task_id)
+        if existing_task_id:
+            return {"task_id": existing_task_id, "coalesced": True}
+        
+        # Ініціалізуємо прогрес
+        await register_task(task_id, "parse_stale")
+        
+        # Запускаємо фонову задачу
+        asyncio.create_task(run_coalesced_task(
+            signature, task_id, parse_stale_products(task_id, max_age_minutes, disabled_recheck_minutes)
+        ))
+        
+        return {"task_id": task_id}
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        raise HTTPException(status_code=500, detail=f"Помилка створення задачі: {str(e)}\n{error_details}")
+
+
 @app.post("/tasks/parse_selected")
 async def create_parse_selected_task(request: dict, background_tasks: BackgroundTasks):
     """Створити задачу на парсинг вибраних товарів"""
@@ -1313,26 +1413,25 @@ async def create_parse_selected_task(request: dict, background_tasks: Background
         task_id = str(uuid.uuid4())
         
         # Перевіряємо, чи всі товари існують
-        db = await load_db()
-        existing_ids = {p["id"] for p in db["products"]}
-        missing_ids = [pid for pid in product_ids if pid not in existing_ids]
+        index = await get_product_index()
+        missing_ids = [pid for pid in product_ids if index.get(pid) is None]
         
         if missing_ids:
             raise HTTPException(status_code=404, detail=f"Товари не знайдено: {', '.join(missing_ids[:5])}")
         
+        # Прибираємо дублікати ID, зберігаючи порядок
+        product_ids = list(dict.fromkeys(product_ids))
+        
+        signature = make_task_signature("parse_selected", sorted(product_ids))
+        existing_task_id = claim_task(signature, task_id)
+        if existing_task_id:
+            return {"task_id": existing_task_id, "coalesced": True}
+        
         # Ініціалізуємо прогрес
-        progress = await load_progress()
-        progress["tasks"][task_id] = {
-            "type": "parse_selected",
-            "total": len(product_ids),
-            "done": 0,
-            "errors": [],
-            "status": "running"
-        }
-        await save_progress(progress)
+        await register_task(task_id, "parse_selected", total=len(product_ids))
         
         # Запускаємо фонову задачу
-        asyncio.create_task(parse_selected_products(task_id, product_ids))
+        asyncio.create_task(run_coalesced_task(signature, task_id, parse_selected_products(task_id, product_ids)))
         
         return {"task_id": task_id}
     except HTTPException:
@@ -1356,7 +1455,8 @@ async def get_task_status_endpoint(task_id: str):
         "total": task.get("total", 0),
         "done": task.get("done", 0),
         "errors": task.get("errors", []),
-        "status": task.get("status", "unknown")
+        "status": task.get("status", "unknown"),
+        "skipped": task.get("skipped", 0)
     }
     
     # Додаємо додаткову інформацію для discover_products
@@ -1379,32 +1479,176 @@ async def get_task_errors(task_id: str):
     }
 
 
+# ========== API ENDPOINTS ДЛЯ РОЗКЛАДІВ ОНОВЛЕНЬ ==========
+
+def validate_schedule_data(schedule_data: RefreshScheduleAdd):
+    """Перевіряє cron-вираз та параметри розкладу"""
+    try:
+        CronExpression(schedule_data.cron)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Невірний cron-вираз: {str(e)}")
+    if schedule_data.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency має бути не менше 1")
+    if schedule_data.spread_minutes is not None and schedule_data.spread_minutes < 0:
+        raise HTTPException(status_code=400, detail="spread_minutes не може бути від'ємним")
+    if schedule_data.adaptive and not (schedule_data.daily_fetch_budget or schedule_data.daily_token_budget):
+        raise HTTPException(status_code=400, detail="Для адаптивного розкладу вкажіть daily_fetch_budget або daily_token_budget")
+
+
+@app.get("/schedules")
+async def list_schedules():
+    """Отримати список розкладів з часом наступного запуску"""
+    schedules_db = await load_schedules_view()
+    return {"schedules": [describe_schedule(s) for s in schedules_db.get("schedules", [])]}
+
+
+@app.post("/schedules")
+async def add_schedule(schedule_data: RefreshScheduleAdd):
+    """Додати розклад регулярного оновлення"""
+    validate_schedule_data(schedule_data)
+    async with get_store_lock(SCHEDULES_FILE):
+        schedules_db = await load_schedules()
+    
+        new_schedule = {
+            "id": str(uuid.uuid4()),
+            "name": schedule_data.name,
+            "cron": " ".join(schedule_data.cron.split()),
+            "competitor_id": schedule_data.competitor_id,
+            "category_ids": schedule_data.category_ids or [],
+            "spread_minutes": schedule_data.spread_minutes,
+            "concurrency": schedule_data.concurrency,
+            "active": schedule_data.active,
+            "adaptive": schedule_data.adaptive,
+            "daily_fetch_budget": schedule_data.daily_fetch_budget,
+            "daily_token_budget": schedule_data.daily_token_budget,
+            "last_run_at": None,
+            "created_at": datetime.now().isoformat()
+        }
+    
+        schedules_db.setdefault("schedules", []).append(new_schedule)
+        await save_schedules(schedules_db)
+    
+    return {"success": True, "schedule": describe_schedule(new_schedule)}
+
+
+@app.put("/schedules/{schedule_id}")
+async def update_schedule(schedule_id: str, schedule_data: RefreshScheduleAdd):
+    """Оновити розклад"""
+    validate_schedule_data(schedule_data)
+    async with get_store_lock(SCHEDULES_FILE):
+        schedules_db = await load_schedules()
+    
+        schedule = None
+        for s in schedules_db.get("schedules", []):
+            if s["id"] == schedule_id:
+                schedule = s
+                break
+    
+        if not schedule:
+            raise HTTPException(status_code=404, detail="Розклад не знайдено")
+    
+        schedule.update({
+            "name": schedule_data.name,
+            "cron": " ".join(schedule_data.cron.split()),
+            "competitor_id": schedule_data.competitor_id,
+            "category_ids": schedule_data.category_ids or [],
+            "spread_minutes": schedule_data.spread_minutes,
+            "concurrency": schedule_data.concurrency,
+            "active": schedule_data.active,
+            "adaptive": schedule_data.adaptive,
+            "daily_fetch_budget": schedule_data.daily_fetch_budget,
+            "daily_token_budget": schedule_data.daily_token_budget
+        })
+        await save_schedules(schedules_db)
+    
+    return {"success": True, "schedule": describe_schedule(schedule)}
+
+
+@app.delete("/schedules/{schedule_id}")
+async def delete_schedule(schedule_id: str):
+    """Видалити розклад"""
+    async with get_store_lock(SCHEDULES_FILE):
+        schedules_db = await load_schedules()
+        schedules_db["schedules"] = [s for s in schedules_db.get("schedules", []) if s["id"] != schedule_id]
+        await save_schedules(schedules_db)
+    return {"success": True}
+
+
+@app.get("/schedules/{schedule_id}/plan")
+async def get_schedule_plan(schedule_id: str, limit: int = 100):
+    """Отримати план адаптивного оновлення: частота змін та інтервал для кожного товару"""
+    schedules_db = await load_schedules_view()
+    schedule = None
+    for s in schedules_db.get("schedules", []):
+        if s["id"] == schedule_id:
+            schedule = s
+            break
+    
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Розклад не знайдено")
+    
+    products = await select_filtered_products({
+        "competitor_id": schedule.get("competitor_id"),
+        "category_ids": schedule.get("category_ids") or []
+    })
+    now = datetime.now()
+    daily_budget = await resolve_daily_fetch_budget(schedule)
+    histories = await load_histories(products)
+    plan = build_refresh_plan(products, daily_budget or len(products), now, histories)
+    
+    for item in plan:
+        # Товари без парсингу мають нескінченний пріоритет (не серіалізується в JSON)
+        if item["priority"] == float("inf"):
+            item["priority"] = None
+        else:
+            item["priority"] = round(item["priority"], 3)
+        item["change_rate_per_day"] = round(item["change_rate_per_day"], 4)
+    
+    return {
+        "schedule_id": schedule_id,
+        "daily_fetch_budget": round(daily_budget, 1),
+        "next_batch_limit": math.ceil(daily_budget * get_run_interval_seconds(schedule, now) / 86400),
+        "due_count": sum(1 for item in plan if item["due"]),
+        "plan": plan[:max(0, limit)]
+    }
+
+
+@app.post("/schedules/{schedule_id}/run")
+async def run_schedule_now(schedule_id: str):
+    """Запустити оновлення за розкладом негайно"""
+    task_id = await scheduler.trigger(schedule_id)
+    if not task_id:
+        raise HTTPException(status_code=404, detail="Розклад не знайдено")
+    return {"task_id": task_id}
+
+
 # ========== API ENDPOINTS ДЛЯ ХАРАКТЕРИСТИК ==========
 
 @app.get("/characteristics/groups")
 async def list_characteristic_groups():
     """Отримати список груп характеристик"""
-    characteristics_db = await load_characteristics()
+    characteristics_db = await load_characteristics_view()
     return {"groups": characteristics_db.get("groups", [])}
 
 
 @app.post("/characteristics/groups")
 async def add_characteristic_group(group_data: CharacteristicGroupAdd):
     """Додати нову групу характеристик"""
-    characteristics_db = await load_characteristics()
-    
-    new_group = {
-        "id": str(uuid.uuid4()),
-        "name": group_data.name,
-        "description": group_data.description or "",
-        "priority": group_data.priority or 2,
-        "category_path": group_data.category_path or [],
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+    
+        new_group = {
+            "id": str(uuid.uuid4()),
+            "name": group_data.name,
+            "description": group_data.description or "",
+            "priority": group_data.priority or 2,
+            "category_path": group_data.category_path or [],
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat()
+        }
     
-    characteristics_db.setdefault("groups", []).append(new_group)
-    await save_characteristics(characteristics_db)
+        characteristics_db.setdefault("groups", []).append(new_group)
+        await save_characteristics(characteristics_db)
     
     return {"success": True, "group": new_group}
 
@@ -1412,69 +1656,71 @@ async def add_characteristic_group(group_data: CharacteristicGroupAdd):
 @app.put("/characteristics/groups/{group_id}")
 async def update_characteristic_group(group_id: str, group_data: CharacteristicGroupAdd):
     """Оновити групу характеристик"""
-    characteristics_db = await load_characteristics()
-    groups = characteristics_db.get("groups", [])
-    
-    group_index = None
-    for i, g in enumerate(groups):
-        if g["id"] == group_id:
-            group_index = i
-            break
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+        groups = characteristics_db.get("groups", [])
+    
+        group_index = None
+        for i, g in enumerate(groups):
+            if g["id"] == group_id:
+                group_index = i
+                break
     
-    if group_index is None:
-        raise HTTPException(status_code=404, detail="Групу не знайдено")
+        if group_index is None:
+            raise HTTPException(status_code=404, detail="Групу не знайдено")
     
-    groups[group_index].update({
-        "name": group_data.name,
-        "description": group_data.description or "",
-        "priority": group_data.priority or 2,
-        "category_path": group_data.category_path or [],
-        "updated_at": datetime.now().isoformat()
-    })
+        groups[group_index].update({
+            "name": group_data.name,
+            "description": group_data.description or "",
+            "priority": group_data.priority or 2,
+            "category_path": group_data.category_path or [],
+            "updated_at": datetime.now().isoformat()
+        })
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     return {"success": True, "group": groups[group_index]}
 
 
 @app.delete("/characteristics/groups/{group_id}")
 async def delete_characteristic_group(group_id: str):
     """Видалити групу характеристик"""
-    characteristics_db = await load_characteristics()
-    
-    # Знаходимо групу, яку видаляємо, щоб отримати її категорії
-    groups = characteristics_db.get("groups", [])
-    deleted_group = None
-    for g in groups:
-        if g["id"] == group_id:
-            deleted_group = g
-            break
-    
-    # Видаляємо групу
-    characteristics_db["groups"] = [g for g in groups if g["id"] != group_id]
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+    
+        # Знаходимо групу, яку видаляємо, щоб отримати її категорії
+        groups = characteristics_db.get("groups", [])
+        deleted_group = None
+        for g in groups:
+            if g["id"] == group_id:
+                deleted_group = g
+                break
     
-    # Оновлюємо характеристики: видаляємо group_id та присвоюємо категорії групи
-    characteristics = characteristics_db.get("characteristics", [])
-    if deleted_group:
-        group_categories = deleted_group.get("category_path", [])
-        for char in characteristics:
-            if char.get("group_id") == group_id:
-                char["group_id"] = None
-                # Якщо у характеристики немає категорій, присвоюємо категорії групи
-                if not char.get("category_path"):
-                    char["category_path"] = group_categories.copy()
-                # Якщо є категорії, об'єднуємо (без дублікатів)
-                else:
-                    existing_categories = set(char.get("category_path", []))
-                    for cat in group_categories:
-                        if cat not in existing_categories:
-                            char["category_path"].append(cat)
-    else:
-        # Якщо групу не знайдено, просто видаляємо group_id
-        for char in characteristics:
-            if char.get("group_id") == group_id:
-                char["group_id"] = None
+        # Видаляємо групу
+        characteristics_db["groups"] = [g for g in groups if g["id"] != group_id]
+    
+        # Оновлюємо характеристики: видаляємо group_id та присвоюємо категорії групи
+        characteristics = characteristics_db.get("characteristics", [])
+        if deleted_group:
+            group_categories = deleted_group.get("category_path", [])
+            for char in characteristics:
+                if char.get("group_id") == group_id:
+                    char["group_id"] = None
+                    # Якщо у характеристики немає категорій, присвоюємо категорії групи
+                    if not char.get("category_path"):
+                        char["category_path"] = group_categories.copy()
+                    # Якщо є категорії, об'єднуємо (без дублікатів)
+                    else:
+                        existing_categories = set(char.get("category_path", []))
+                        for cat in group_categories:
+                            if cat not in existing_categories:
+                                char["category_path"].append(cat)
+        else:
+            # Якщо групу не знайдено, просто видаляємо group_id
+            for char in characteristics:
+                if char.get("group_id") == group_id:
+                    char["group_id"] = None
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     return {"success": True}
 
 
@@ -1485,7 +1731,7 @@ async def list_characteristics(
     group_id: Optional[str] = None
 ):
     """Отримати список характеристик з фільтрами"""
-    characteristics_db = await load_characteristics()
+    characteristics_db = await load_characteristics_view()
     characteristics = characteristics_db.get("characteristics", [])
     
     # Фільтрація
@@ -1516,25 +1762,26 @@ async def characteristics_page():
 @app.post("/characteristics")
 async def add_characteristic(char_data: CharacteristicAdd):
     """Додати нову характеристику"""
-    characteristics_db = await load_characteristics()
-    
-    new_char = {
-        "id": str(uuid.uuid4()),
-        "name": char_data.name,
-        "type": char_data.type,
-        "priority": char_data.priority,
-        "unit": char_data.unit,
-        "category_path": char_data.category_path or [],
-        "group_id": char_data.group_id,
-        "photo_url": char_data.photo_url,
-        "choices": char_data.choices or [],
-        "brand_choices": char_data.brand_choices or [],
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat()
-    }
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+    
+        new_char = {
+            "id": str(uuid.uuid4()),
+            "name": char_data.name,
+            "type": char_data.type,
+            "priority": char_data.priority,
+            "unit": char_data.unit,
+            "category_path": char_data.category_path or [],
+            "group_id": char_data.group_id,
+            "photo_url": char_data.photo_url,
+            "choices": char_data.choices or [],
+            "brand_choices": char_data.brand_choices or [],
+            "created_at": datetime.now().isoformat(),
+            "updated_at": datetime.now().isoformat()
+        }
     
-    characteristics_db.setdefault("characteristics", []).append(new_char)
-    await save_characteristics(characteristics_db)
+        characteristics_db.setdefault("characteristics", []).append(new_char)
+        await save_characteristics(characteristics_db)
     
     return {"success": True, "characteristic": new_char}
 
@@ -1542,65 +1789,61 @@ async def add_characteristic(char_data: CharacteristicAdd):
 @app.put("/characteristics/{char_id}")
 async def update_characteristic(char_id: str, char_data: CharacteristicAdd):
     """Оновити характеристику"""
-    characteristics_db = await load_characteristics()
-    characteristics = characteristics_db.get("characteristics", [])
-    
-    char_index = None
-    for i, c in enumerate(characteristics):
-        if c["id"] == char_id:
-            char_index = i
-            break
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+        characteristics = characteristics_db.get("characteristics", [])
+    
+        char_index = None
+        for i, c in enumerate(characteristics):
+            if c["id"] == char_id:
+                char_index = i
+                break
     
-    if char_index is None:
-        raise HTTPException(status_code=404, detail="Характеристику не знайдено")
-    
-    characteristics[char_index].update({
-        "name": char_data.name,
-        "type": char_data.type,
-        "priority": char_data.priority,
-        "unit": char_data.unit,
-        "category_path": char_data.category_path or [],
-        "group_id": char_data.group_id,
-        "photo_url": char_data.photo_url,
-        "choices": char_data.choices or [],
-        "brand_choices": char_data.brand_choices or [],
-        "updated_at": datetime.now().isoformat()
-    })
+        if char_index is None:
+            raise HTTPException(status_code=404, detail="Характеристику не знайдено")
+    
+        characteristics[char_index].update({
+            "name": char_data.name,
+            "type": char_data.type,
+            "priority": char_data.priority,
+            "unit": char_data.unit,
+            "category_path": char_data.category_path or [],
+            "group_id": char_data.group_id,
+            "photo_url": char_data.photo_url,
+            "choices": char_data.choices or [],
+            "brand_choices": char_data.brand_choices or [],
+            "updated_at": datetime.now().isoformat()
+        })
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     return {"success": True, "characteristic": characteristics[char_index]}
 
 
 @app.delete("/characteristics/{char_id}")
 async def delete_characteristic(char_id: str):
     """Видалити характеристику"""
-    characteristics_db = await load_characteristics()
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
     
-    # Видаляємо характеристику
-    characteristics = characteristics_db.get("characteristics", [])
-    characteristics_db["characteristics"] = [c for c in characteristics if c["id"] != char_id]
+        # Видаляємо характеристику
+        characteristics = characteristics_db.get("characteristics", [])
+        characteristics_db["characteristics"] = [c for c in characteristics if c["id"] != char_id]
     
-    # Видаляємо значення характеристик з товарів
-    product_characteristics = characteristics_db.get("product_characteristics", {})
-    for product_id, char_values in product_characteristics.items():
-        characteristics_db["product_characteristics"][product_id] = [
-            cv for cv in char_values if cv.get("characteristic_id") != char_id
-        ]
+        # Видаляємо значення характеристик з товарів
+        product_characteristics = characteristics_db.get("product_characteristics", {})
+        for product_id, char_values in product_characteristics.items():
+            characteristics_db["product_characteristics"][product_id] = [
+                cv for cv in char_values if cv.get("characteristic_id") != char_id
+            ]
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     return {"success": True}
 
 
 @app.get("/products/{product_id}/characteristics")
 async def get_product_characteristics(product_id: str):
     """Отримати характеристики для товару"""
-    db = await load_db()
-    product = None
-    for p in db.get("products", []):
-        if p["id"] == product_id:
-            product = p
-            break
-    
+    product = await get_product_by_id(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Товар не знайдено")
     
@@ -1627,52 +1870,54 @@ async def get_product_characteristics(product_id: str):
 @app.post("/products/{product_id}/characteristics")
 async def add_product_characteristic_value(product_id: str, value_data: CharacteristicValueAdd):
     """Додати значення характеристики до товару"""
-    characteristics_db = await load_characteristics()
-    
-    # Перевіряємо, чи існує характеристика
-    characteristics = characteristics_db.get("characteristics", [])
-    char_exists = any(c["id"] == value_data.characteristic_id for c in characteristics)
-    if not char_exists:
-        raise HTTPException(status_code=404, detail="Характеристику не знайдено")
-    
-    # Додаємо або оновлюємо значення
-    product_characteristics = characteristics_db.setdefault("product_characteristics", {})
-    char_values = product_characteristics.setdefault(product_id, [])
-    
-    # Шукаємо існуюче значення
-    value_index = None
-    for i, cv in enumerate(char_values):
-        if cv.get("characteristic_id") == value_data.characteristic_id:
-            value_index = i
-            break
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+    
+        # Перевіряємо, чи існує характеристика
+        characteristics = characteristics_db.get("characteristics", [])
+        char_exists = any(c["id"] == value_data.characteristic_id for c in characteristics)
+        if not char_exists:
+            raise HTTPException(status_code=404, detail="Характеристику не знайдено")
+    
+        # Додаємо або оновлюємо значення
+        product_characteristics = characteristics_db.setdefault("product_characteristics", {})
+        char_values = product_characteristics.setdefault(product_id, [])
+    
+        # Шукаємо існуюче значення
+        value_index = None
+        for i, cv in enumerate(char_values):
+            if cv.get("characteristic_id") == value_data.characteristic_id:
+                value_index = i
+                break
     
-    new_value = {
-        "characteristic_id": value_data.characteristic_id,
-        "value": value_data.value,
-        "photo_url": value_data.photo_url
-    }
+        new_value = {
+            "characteristic_id": value_data.characteristic_id,
+            "value": value_data.value,
+            "photo_url": value_data.photo_url
+        }
     
-    if value_index is not None:
-        char_values[value_index] = new_value
-    else:
-        char_values.append(new_value)
+        if value_index is not None:
+            char_values[value_index] = new_value
+        else:
+            char_values.append(new_value)
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     return {"success": True, "value": new_value}
 
 
 @app.delete("/products/{product_id}/characteristics/{char_id}")
 async def delete_product_characteristic_value(product_id: str, char_id: str):
     """Видалити значення характеристики з товару"""
-    characteristics_db = await load_characteristics()
-    product_characteristics = characteristics_db.get("product_characteristics", {})
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+        product_characteristics = characteristics_db.get("product_characteristics", {})
     
-    if product_id in product_characteristics:
-        char_values = product_characteristics[product_id]
-        product_characteristics[product_id] = [
-            cv for cv in char_values if cv.get("characteristic_id") != char_id
-        ]
-        await save_characteristics(characteristics_db)
+        if product_id in product_characteristics:
+            char_values = product_characteristics[product_id]
+            product_characteristics[product_id] = [
+                cv for cv in char_values if cv.get("characteristic_id") != char_id
+            ]
+            await save_characteristics(characteristics_db)
     
     return {"success": True}
 
@@ -1680,29 +1925,144 @@ async def delete_product_characteristic_value(product_id: str, char_id: str):
 @app.delete("/products/{product_id}/characteristics/clear-choices")
 async def clear_product_characteristic_choices(product_id: str):
     """Очистити всі значення характеристик типу choice та variation для товару"""
-    characteristics_db = await load_characteristics()
-    product_characteristics = characteristics_db.get("product_characteristics", {})
+    async with get_store_lock(CHARACTERISTICS_FILE):
+        characteristics_db = await load_characteristics()
+        product_characteristics = characteristics_db.get("product_characteristics", {})
     
-    if product_id not in product_characteristics:
-        return {"success": True, "cleared": 0}
+        if product_id not in product_characteristics:
+            return {"success": True, "cleared": 0}
     
-    # Отримуємо всі характеристики
-    all_characteristics = characteristics_db.get("characteristics", [])
+        # Отримуємо всі характеристики
+        all_characteristics = characteristics_db.get("characteristics", [])
     
-    # Знаходимо ID характеристик типу choice та variation
-    choice_char_ids = set()
-    for char in all_characteristics:
-        if char.get("type") in ["choice", "variation"]:
-            choice_char_ids.add(char["id"])
+        # Знаходимо ID характеристик типу choice та variation
+        choice_char_ids = set()
+        for char in all_characteristics:
+            if char.get("type") in ["choice", "variation"]:
+                choice_char_ids.add(char["id"])
     
-    # Видаляємо значення для цих характеристик
-    char_values = product_characteristics[product_id]
-    original_count = len(char_values)
-    product_characteristics[product_id] = [
-        cv for cv in char_values if cv.get("characteristic_id") not in choice_char_ids
-    ]
-    cleared_count = original_count - len(product_characteristics[product_id])
+        # Видаляємо значення для цих характеристик
+        char_values = product_characteristics[product_id]
+        original_count = len(char_values)
+        product_characteristics[product_id] = [
+            cv for cv in char_values if cv.get("characteristic_id") not in choice_char_ids
+        ]
+        cleared_count = original_count - len(product_characteristics[product_id])
     
-    await save_characteristics(characteristics_db)
+        await save_characteristics(characteristics_db)
     
     return {"success": True, "cleared": cleared_count}
+
+
+# ========== ЕКСПОРТ СХОВИЩ ==========
+
+# Сховища, доступні для експорту (settings.json не експортується - містить API ключі)
+EXPORTABLE_STORES = {
+    "products": load_db_view,
+    "competitors": load_competitors_view,
+    "characteristics": load_characteristics_view,
+    "schedules": load_schedules_view,
+    "progress": load_progress_view
+}
+
+
+def _export_response(stream, name: str, export_format: str, compress: bool) -> StreamingResponse:
+    filename = f"{name}.{export_format}" + (".gz" if compress else "")
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip" if compress else EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _check_export_format(export_format: str):
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Невідомий формат. Доступні: {', '.join(EXPORT_FORMATS)}")
+
+
+def _export_boundary(value: Optional[str], name: str, end: bool = False) -> Optional[str]:
+    """Межа періоду експорту у форматі дат журналу історії (дата без часу - весь день)"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некоректна дата {name}: {value}")
+    if end and len(value) == 10:
+        return f"{value}T23:59:59.999999"
+    return parsed.isoformat()
+
+
+@app.get("/export/stream/products")
+async def export_products_stream(format: str = "ndjson", gzip: bool = False,
+                                 competitor_id: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Потоковий експорт товарів у NDJSON або CSV (gzip=true - стиснений файл).
+    fields - колонки через кому (CSV за замовчуванням - PRODUCT_EXPORT_FIELDS, NDJSON - повні записи).
+    """
+    _check_export_format(format)
+    products = await select_filtered_products({"competitor_id": competitor_id})
+    field_list = [field.strip() for field in fields.split(",") if field.strip()] if fields else None
+    return _export_response(export_products(products, format, field_list, gzip), "products", format, gzip)
+
+
+@app.get("/export/stream/history")
+async def export_history_stream(start: Optional[str] = None, end: Optional[str] = None,
+                                format: str = "ndjson", gzip: bool = False, expand: bool = False,
+                                competitor_id: Optional[str] = None):
+    """
+    Потоковий експорт історії цін за період [start, end] (ISO дати) у NDJSON або CSV.
+    За замовчуванням - відрізки незмінних значень, expand=true - ряд спостережень.
+    Журнали історії читаються по одному товару.
+    """
+    _check_export_format(format)
+    start_value = _export_boundary(start, "start")
+    end_value = _export_boundary(end, "end", end=True)
+    products = await select_filtered_products({"competitor_id": competitor_id})
+    return _export_response(
+        export_history(products, start_value, end_value, format, expand, gzip), "price_history", format, gzip
+    )
+
+
+@app.post("/export/parquet")
+async def create_parquet_export_task():
+    """
+    Запустити фонову задачу експорту товарів та історії цін у Parquet
+    (розбиття за конкурентом та місяцем, дописуються тільки нові записи історії).
+    """
+    if not parquet_export_available():
+        raise HTTPException(status_code=501, detail="Експорт у Parquet недоступний: не встановлено pyarrow")
+    
+    task_id = str(uuid.uuid4())
+    signature = make_task_signature("export_parquet")
+    existing_task_id = claim_task(signature, task_id)
+    if existing_task_id:
+        return {"task_id": existing_task_id, "coalesced": True}
+    
+    await register_task(task_id, "export_parquet")
+    asyncio.create_task(run_coalesced_task(signature, task_id, run_parquet_export_task(task_id)))
+    return {"task_id": task_id}
+
+
+@app.get("/export/parquet/status")
+async def parquet_export_status():
+    """Стан експорту в Parquet: час останнього експорту, кількість файлів, каталог"""
+    return await get_parquet_export_state()
+
+
+@app.get("/export/{store_name}")
+async def export_store(store_name: str, pretty: bool = True):
+    """
+    Експорт сховища у JSON-файл.
+    Машинні сховища зберігаються компактно; читабельний формат з відступами формується тут на запит.
+    """
+    loader = EXPORTABLE_STORES.get(store_name)
+    if loader is None:
+        raise HTTPException(status_code=404, detail=f"Невідоме сховище. Доступні: {', '.join(EXPORTABLE_STORES)}")
+    
+    data = await loader()
+    return Response(
+        content=dumps(data, pretty=pretty),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{store_name}.json"'}
+    )
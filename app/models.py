@@ -12,13 +12,11 @@ class Product(BaseModel):
     sku: Optional[str] = None
     price: Optional[float] = None
     availability: Optional[str] = None
-    history: List[dict] = []
     created_at: str
     last_parsed_at: Optional[str] = None
     competitor_name: Optional[str] = None
     category_path: List[str] = []
     parsing_rules: Optional[dict] = None
-    logs: List[dict] = []
 
 
 class ProductAdd(BaseModel):
@@ -26,19 +24,11 @@ class ProductAdd(BaseModel):
     url: str
 
 
-class TokenUsage(BaseModel):
-    """Запис про використання токенів"""
-    timestamp: str  # ISO формат дати
-    prompt_tokens: int = 0
-    completion_tokens: int = 0
-    total_tokens: int = 0
-
 class APIKey(BaseModel):
     id: str
     name: str
     key: str
     active: bool = False
-    token_usage_history: List[TokenUsage] = []  # Історія використання токенів
 
 
 class APIKeyAdd(BaseModel):
@@ -49,6 +39,7 @@ class APIKeyAdd(BaseModel):
 class Settings(BaseModel):
     keys: List[APIKey] = []
     current_key: Optional[str] = None
+    revision: Optional[int] = None  # Ревізія файлу налаштувань (оптимістична перевірка при записі)
 
 
 class ParseResult(BaseModel):
@@ -90,6 +81,20 @@ class CompetitorAdd(BaseModel):
     notes: Optional[str] = ""
 
 
+class RefreshScheduleAdd(BaseModel):
+    """Модель для додавання розкладу регулярного оновлення цін та наявності"""
+    name: str
+    cron: str  # Cron-вираз: "хвилина година день_місяця місяць день_тижня"
+    competitor_id: Optional[str] = None  # Оновлювати товари тільки цього конкурента
+    category_ids: List[str] = []  # Оновлювати товари тільки цих категорій
+    spread_minutes: Optional[int] = None  # Вікно розподілу запитів (None - до наступного запуску)
+    concurrency: int = 1  # Кількість товарів, що парсяться одночасно
+    active: bool = True
+    adaptive: bool = False  # Адаптивний режим: частіше оновлювати товари, що часто змінюються
+    daily_fetch_budget: Optional[int] = None  # Бюджет запитів на добу (для адаптивного режиму)
+    daily_token_budget: Optional[int] = None  # Або бюджет токенів на добу (переводиться в запити)
+
+
 class DiscoverProductsRequest(BaseModel):
     """Модель для запиту на пошук товарів у категоріях"""
     competitor_id: str
@@ -0,0 +1,195 @@
+"""
+Експорт товарів та історії цін у Parquet для аналітики (pandas, DuckDB, Spark).
+
+Структура каталогу PARQUET_EXPORT_DIR:
+- products.parquet - знімок товарів (перезаписується при кожному експорті)
+- history/competitor_id=<id>/month=<YYYY-MM>/part-<export>-<n>.parquet - зміни ціни
+  та наявності (початки відрізків журналу історії), розбиті за конкурентом та місяцем
+  (hive-розбиття, читається pyarrow.dataset / pandas.read_parquet як один набір даних)
+
+Експорт інкрементальний: у PARQUET_STATE_FILE для кожного товару зберігається дата
+останнього експортованого запису, і наступний експорт дописує нові part-файли
+тільки з новішими записами. Стан зберігається після кожної пачки товарів,
+тому перерваний експорт продовжується без дублювання.
+
+pyarrow - необов'язкова залежність: без нього експорт недоступний (is_available).
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow необов'язковий - без нього експорт у Parquet вимкнено
+    pa = None
+    pq = None
+
+from .parser import select_filtered_products, update_task_progress
+from .price_history import load_history
+from .storage import read_json, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+PARQUET_EXPORT_DIR = "app/db/exports/parquet"
+PARQUET_STATE_FILE = "app/db/exports/parquet_state.json"
+# Скільки товарів обробляється між записами part-файлів та стану
+PARQUET_BATCH_PRODUCTS = 2000
+
+_export_lock = asyncio.Lock()
+
+
+def is_available() -> bool:
+    """Чи встановлено pyarrow"""
+    return pa is not None
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def _partition_value(value: Optional[str]) -> str:
+    """Значення для імені каталогу розбиття (без роздільників шляху)"""
+    return (value or "none").replace("/", "_").replace("\\", "_").replace("=", "_")
+
+
+def _products_table(products: List[Dict]):
+    price = [p.get("price") for p in products]
+    return pa.table({
+        "id": pa.array([p.get("id") for p in products], pa.string()),
+        "name": pa.array([p.get("name") for p in products], pa.string()),
+        "name_parsed": pa.array([p.get("name_parsed") for p in products], pa.string()),
+        "sku": pa.array([p.get("sku") for p in products], pa.string()),
+        "url": pa.array([p.get("url") for p in products], pa.string()),
+        "competitor_id": pa.array([p.get("competitor_id") for p in products], pa.string()),
+        "status": pa.array([p.get("status") for p in products], pa.string()),
+        "price": pa.array([float(v) if isinstance(v, (int, float)) else None for v in price], pa.float64()),
+        "availability": pa.array([p.get("availability") for p in products], pa.string()),
+        "category_path": pa.array([list(p.get("category_path") or []) for p in products], pa.list_(pa.string())),
+        "last_parsed_at": pa.array([_timestamp(p.get("last_parsed_at")) for p in products], pa.timestamp("us")),
+        "created_at": pa.array([_timestamp(p.get("created_at")) for p in products], pa.timestamp("us")),
+    })
+
+
+def _history_table(rows: List[Dict]):
+    return pa.table({
+        "product_id": pa.array([row["product_id"] for row in rows], pa.string()),
+        "date": pa.array([row["date"] for row in rows], pa.timestamp("us")),
+        "price": pa.array([row["price"] for row in rows], pa.float64()),
+        "availability": pa.array([row["availability"] for row in rows], pa.string()),
+    })
+
+
+def _write_table(table, path: str):
+    """Атомарний запис Parquet-файлу (тимчасовий файл + os.replace)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    pq.write_table(table, temp_path, compression="zstd")
+    os.replace(temp_path, path)
+
+
+def _write_partitions(partitions: Dict[tuple, List[Dict]], export_id: str, batch_number: int) -> int:
+    written = 0
+    for (competitor_id, month), rows in partitions.items():
+        path = os.path.join(
+            PARQUET_EXPORT_DIR, "history",
+            f"competitor_id={_partition_value(competitor_id)}", f"month={month}",
+            f"part-{export_id}-{batch_number:05d}.parquet"
+        )
+        _write_table(_history_table(rows), path)
+        written += len(rows)
+    return written
+
+
+async def export_parquet(products: List[Dict], progress=None) -> Dict:
+    """
+    Експортує знімок товарів та нові записи історії з часу попереднього експорту.
+    progress - необов'язковий async callback(done, total). Повертає підсумок експорту.
+    """
+    if not is_available():
+        raise RuntimeError("Для експорту в Parquet потрібен pyarrow (pip install pyarrow)")
+
+    async with _export_lock:
+        state = await read_json(PARQUET_STATE_FILE, dict)
+        exported = state.setdefault("exported", {})
+        export_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        total = len(products)
+        rows_written = 0
+        files_before = state.get("files", 0)
+
+        await asyncio.to_thread(_write_table, _products_table(products), os.path.join(PARQUET_EXPORT_DIR, "products.parquet"))
+
+        for batch_number, offset in enumerate(range(0, total, PARQUET_BATCH_PRODUCTS)):
+            partitions: Dict[tuple, List[Dict]] = {}
+            batch_exported = {}
+            for product in products[offset:offset + PARQUET_BATCH_PRODUCTS]:
+                product_id = product["id"]
+                last_date = exported.get(product_id) or ""
+                runs = await load_history(product_id)
+                for run in runs:
+                    date = run.get("date") or ""
+                    timestamp = _timestamp(date)
+                    if date <= last_date or timestamp is None:
+                        continue
+                    price = run.get("price")
+                    partitions.setdefault((product.get("competitor_id"), date[:7]), []).append({
+                        "product_id": product_id,
+                        "date": timestamp,
+                        "price": float(price) if isinstance(price, (int, float)) else None,
+                        "availability": run.get("availability")
+                    })
+                    batch_exported[product_id] = max(batch_exported.get(product_id, ""), date)
+
+            if partitions:
+                rows_written += await asyncio.to_thread(_write_partitions, partitions, export_id, batch_number)
+                state["files"] = state.get("files", 0) + len(partitions)
+                exported.update(batch_exported)
+                await write_json_atomic(PARQUET_STATE_FILE, state)
+            if progress is not None:
+                await progress(min(offset + PARQUET_BATCH_PRODUCTS, total), total)
+
+        state["last_export_at"] = datetime.now().isoformat()
+        await write_json_atomic(PARQUET_STATE_FILE, state)
+
+    summary = {
+        "products": total,
+        "history_rows": rows_written,
+        "history_files": state.get("files", 0) - files_before,
+        "path": PARQUET_EXPORT_DIR
+    }
+    logger.info(f"Експорт у Parquet: {summary}")
+    return summary
+
+
+async def get_export_state() -> Dict:
+    """Час останнього експорту та кількість експортованих товарів"""
+    state = await read_json(PARQUET_STATE_FILE, dict)
+    return {
+        "available": is_available(),
+        "last_export_at": state.get("last_export_at"),
+        "products_with_history": len(state.get("exported", {})),
+        "history_files": state.get("files", 0),
+        "path": PARQUET_EXPORT_DIR
+    }
+
+
+async def run_parquet_export_task(task_id: str):
+    """Фонова задача експорту в Parquet (прогрес - кількість оброблених товарів)"""
+    try:
+        products = await select_filtered_products({})
+
+        async def progress(done: int, total: int):
+            await update_task_progress(task_id, done=done, total=total)
+
+        await export_parquet(products, progress)
+        await update_task_progress(task_id, status="finished")
+    except Exception as e:
+        logger.exception("Помилка експорту в Parquet")
+        await update_task_progress(task_id, status="failed", error=f"Помилка експорту в Parquet: {e}")
@@ -1,12 +1,23 @@
+import csv
+import io
 import json
-import os
+import asyncio
 import logging
-from datetime import datetime
-from typing import Dict, Optional, Tuple, List
-from urllib.parse import urlparse
-import aiofiles
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set, Tuple, List
+from urllib.parse import urlparse, unquote
 from .models import Product, Settings
 from .gpt_client import GPTClient
+from .price_history import append_history, append_history_batch, record_observation, migrate_embedded_history
+from .history_analytics import prune_columns_cache
+from .product_logs import append_log, append_logs, migrate_embedded_logs
+from .product_index import ProductIndex, normalize_url
+from .category_diff import merge_category_trees
+from .competitor_index import CompetitorCategoryIndex, CompetitorDomainIndex, normalize_domain
+from .token_usage import get_usage_totals, record_token_usage, record_token_usage_entries, make_usage_entry
+from .storage import get_store_lock, get_file_signature, read_json, read_json_view, write_json_atomic
+from .write_behind import WriteBehindBuffer
 
 # Налаштування логування
 logger = logging.getLogger(__name__)
@@ -17,64 +28,104 @@ SETTINGS_FILE = "app/settings.json"
 COMPETITORS_FILE = "app/competitors.json"
 PROGRESS_FILE = "app/db/progress.json"
 CHARACTERISTICS_FILE = "app/characteristics.json"
+SCHEDULES_FILE = "app/schedules.json"
+RESULTS_JOURNAL_FILE = "app/db/pending_results.jsonl"
+
+# Вікно оновлення: у масових задачах товар не парситься повторно, якщо його вже
+# отримали протягом цього часу (захист від подвійної витрати токенів)
+REFRESH_WINDOW_MINUTES = 15
+# Відкладений запис результатів масових задач: пакет зберігається при накопиченні
+# WRITE_BEHIND_BATCH_SIZE результатів або через WRITE_BEHIND_MAX_DELAY_SECONDS
+WRITE_BEHIND_BATCH_SIZE = 200
+WRITE_BEHIND_MAX_DELAY_SECONDS = 2.0
+# Проміжний прогрес (done/skipped) задачі записується у файл не частіше ніж раз на цей інтервал
+PROGRESS_WRITE_INTERVAL_SECONDS = 1.0
+# Максимальна кількість товарів в одному масовому імпорті
+MAX_IMPORT_PRODUCTS = 100000
+
+# Блокування read-modify-write циклів для сховищ, які оновлюють паралельні задачі
+_db_lock = get_store_lock(DB_FILE)
+_settings_lock = get_store_lock(SETTINGS_FILE)
+_progress_lock = get_store_lock(PROGRESS_FILE)
+_competitors_lock = get_store_lock(COMPETITORS_FILE)
+
+# Індекси товарів (синхронізуються в save_db)
+_product_index = ProductIndex()
+# Індекс доменів конкурентів (перебудовується після зміни competitors.json)
+_competitor_domain_index = CompetitorDomainIndex()
+# Сплощені дерева категорій конкурентів (скидаються разом з індексом доменів)
+_competitor_category_index = CompetitorCategoryIndex()
 
 
 async def load_db() -> Dict:
     """Завантажує базу даних товарів (асинхронно)"""
-    try:
-        async with aiofiles.open(DB_FILE, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return json.loads(content)
-    except FileNotFoundError:
-        return {"products": []}
-    except Exception as e:
-        # Якщо помилка, повертаємо порожній список
-        return {"products": []}
+    return await read_json(DB_FILE, lambda: {"products": []})
+
+
+async def load_db_view() -> Dict:
+    """Повертає базу товарів з кешу тільки для читання (без повторного розбору незміненого файлу)"""
+    return await read_json_view(DB_FILE, lambda: {"products": []})
+
+
+async def save_db(data: Dict, changed_ids: Optional[List[str]] = None):
+    """
+    Зберігає базу даних товарів (асинхронно).
+    changed_ids - ID змінених товарів: якщо передані, індекси оновлюються інкрементально.
+    """
+    await write_json_atomic(DB_FILE, data)
+    _product_index.apply_saved(data.get("products", []), changed_ids, get_file_signature(DB_FILE))
+    prune_columns_cache(_product_index.by_id)
+
+
+async def get_product_index() -> ProductIndex:
+    """Повертає індекси товарів, перебудовуючи їх, якщо db.json змінено ззовні"""
+    signature = get_file_signature(DB_FILE)
+    if _product_index.signature is None or signature != _product_index.signature:
+        db = await load_db_view()
+        _product_index.rebuild(db.get("products", []), signature)
+        prune_columns_cache(_product_index.by_id)
+    return _product_index
+
 
+async def get_product_by_id(product_id: str) -> Optional[Dict]:
+    """Товар за ID через індекс (O(1)); запис спільний і незмінний (FrozenDict)"""
+    return (await get_product_index()).get(product_id)
 
-async def save_db(data: Dict):
-    """Зберігає базу даних товарів (асинхронно)"""
-    os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-    async with aiofiles.open(DB_FILE, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+
+async def find_product_by_url(url: str) -> Optional[Dict]:
+    """Товар за нормалізованим URL через індекс (O(1)); запис спільний і незмінний (FrozenDict)"""
+    return (await get_product_index()).find_by_url(url)
+
+
+def _find_product(db: Dict, product_id: str) -> Optional[Dict]:
+    """
+    Знаходить товар у свіжій копії бази (load_db) за позицією з індексу;
+    якщо порядок товарів змінився - звичайним перебором.
+    """
+    products = db.get("products", [])
+    position = _product_index.position(product_id)
+    if position is not None and position < len(products) and products[position].get("id") == product_id:
+        return products[position]
+    return next((p for p in products if p.get("id") == product_id), None)
 
 
 async def load_settings() -> Settings:
     """Завантажує налаштування (асинхронно)"""
+    # Документ з кешу незмінний, але Settings створює власну копію даних
+    data = await read_json_view(SETTINGS_FILE, dict)
     try:
-        async with aiofiles.open(SETTINGS_FILE, "r", encoding="utf-8") as f:
-            content = await f.read()
-            data = json.loads(content)
-            # Додаємо token_usage_history для старих ключів, якщо його немає
-            if "keys" in data:
-                for key_data in data["keys"]:
-                    if "token_usage_history" not in key_data:
-                        key_data["token_usage_history"] = []
-            return Settings(**data)
-    except FileNotFoundError:
-        return Settings()
+        return Settings(**data)
     except Exception:
         return Settings()
 
 
 async def save_settings(settings: Settings):
     """Зберігає налаштування (асинхронно)"""
-    os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
     # Конвертуємо в dict з підтримкою моделей Pydantic
     settings_dict = settings.dict()
-    # Переконуємося, що token_usage_history є списком
-    if "keys" in settings_dict:
-        for key_data in settings_dict["keys"]:
-            if "token_usage_history" not in key_data:
-                key_data["token_usage_history"] = []
-            # Конвертуємо TokenUsage об'єкти в dict
-            if key_data["token_usage_history"]:
-                key_data["token_usage_history"] = [
-                    item if isinstance(item, dict) else item.dict()
-                    for item in key_data["token_usage_history"]
-                ]
-    async with aiofiles.open(SETTINGS_FILE, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(settings_dict, ensure_ascii=False, indent=2))
+    if settings_dict.get("revision") is None:
+        settings_dict.pop("revision", None)
+    settings.revision = await write_json_atomic(SETTINGS_FILE, settings_dict)
 
 
 async def get_active_api_key() -> Optional[str]:
@@ -92,42 +143,34 @@ def is_first_parse(product: Product) -> bool:
     return product.name_parsed is None or product.sku is None
 
 
+async def get_competitor_domain_index() -> CompetitorDomainIndex:
+    """Індекс доменів конкурентів, перебудовується після зміни competitors.json"""
+    signature = get_file_signature(COMPETITORS_FILE)
+    if _competitor_domain_index.signature is None or signature != _competitor_domain_index.signature:
+        competitors_db = await load_competitors_view()
+        _competitor_domain_index.rebuild(competitors_db.get("competitors", []), signature)
+    return _competitor_domain_index
+
+
+async def get_competitor_category_index() -> CompetitorCategoryIndex:
+    """Індекс категорій конкурентів, перебудовується після зміни competitors.json"""
+    signature = get_file_signature(COMPETITORS_FILE)
+    if _competitor_category_index.signature is None or signature != _competitor_category_index.signature:
+        competitors_db = await load_competitors_view()
+        _competitor_category_index.rebuild(competitors_db.get("competitors", []), signature)
+    return _competitor_category_index
+
+
 async def find_competitor_by_url(product_url: str) -> Optional[Tuple[str, str]]:
     """
-    Знаходить конкурента за URL товару.
+    Знаходить конкурента за URL товару (через індекс доменів, з урахуванням www та піддоменів).
     Повертає (competitor_id, competitor_name) або None, якщо не знайдено.
     """
     try:
-        # Парсимо URL товару
-        product_parsed = urlparse(product_url)
-        product_domain = product_parsed.netloc.lower()
-        
-        # Завантажуємо конкурентів
-        competitors_db = await load_competitors()
-        
-        # Шукаємо конкурента, чий URL відповідає домену товару
-        for competitor in competitors_db.get("competitors", []):
-            if not competitor.get("active", True):
-                continue
-                
-            competitor_url = competitor.get("url", "")
-            if not competitor_url:
-                continue
-                
-            # Парсимо URL конкурента
-            competitor_parsed = urlparse(competitor_url)
-            competitor_domain = competitor_parsed.netloc.lower()
-            
-            # Порівнюємо домени (з урахуванням www та без)
-            product_domain_clean = product_domain.replace("www.", "")
-            competitor_domain_clean = competitor_domain.replace("www.", "")
-            
-            if product_domain_clean == competitor_domain_clean:
-                competitor_id = competitor.get("id")
-                competitor_name = competitor.get("name")
-                if competitor_id and competitor_name:
-                    logger.info(f"Знайдено конкурента за URL: {competitor_name} (ID: {competitor_id}) для товару {product_url}")
-                    return (competitor_id, competitor_name)
+        found = (await get_competitor_domain_index()).find(product_url)
+        if found:
+            logger.info(f"Знайдено конкурента за URL: {found[1]} (ID: {found[0]}) для товару {product_url}")
+            return found
         
         logger.warning(f"Не знайдено конкурента за URL товару: {product_url}")
         return None
@@ -136,6 +179,116 @@ async def find_competitor_by_url(product_url: str) -> Optional[Tuple[str, str]]:
         return None
 
 
+def product_name_from_url(url: str) -> str:
+    """Проста назва товару за останньою частиною шляху URL (якщо назву не передали)"""
+    try:
+        last_part = (urlparse(url).path or "").rstrip("/").split("/")[-1]
+        last_part = unquote(last_part).replace("-", " ").replace("_", " ").strip()
+        return last_part if last_part else "Новий товар"
+    except Exception:
+        return "Новий товар"
+
+
+def make_new_product(url: str, name: Optional[str] = None) -> Dict:
+    """Запис нового товару (ще не спарсеного)"""
+    return {
+        "id": str(uuid.uuid4()),
+        "name": (name or "").strip() or product_name_from_url(url),
+        "url": url,
+        "status": "pending",
+        "name_parsed": None,
+        "sku": None,
+        "price": None,
+        "availability": None,
+        "created_at": datetime.now().isoformat(),
+        "last_parsed_at": None
+    }
+
+
+def parse_import_text(content: str) -> List[Dict]:
+    """
+    Рядки імпорту з CSV або текстового файлу: [{"url", "name"}].
+    CSV із заголовком, що містить колонку url (та, за бажанням, name), читається за колонками;
+    інакше з кожного рядка береться перше поле, схоже на URL (роздільники - кома, крапка з комою, табуляція, пробіл).
+    """
+    lines = content.lstrip("\ufeff").splitlines()
+    if not lines:
+        return []
+    try:
+        dialect = csv.Sniffer().sniff(lines[0], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    header = [cell.strip().lower() for cell in next(csv.reader([lines[0]], dialect))]
+    if "url" in header:
+        reader = csv.DictReader(io.StringIO("\n".join(lines[1:])), fieldnames=header, dialect=dialect)
+        return [{"url": (row.get("url") or "").strip(), "name": (row.get("name") or "").strip() or None} for row in reader]
+
+    entries = []
+    for line in lines:
+        for field in line.replace(";", " ").replace(",", " ").replace("\t", " ").split():
+            if field.lower().startswith(("http://", "https://")):
+                entries.append({"url": field.strip(), "name": None})
+                break
+    return entries
+
+
+async def import_products(entries: List[Dict]) -> Dict:
+    """
+    Масовий імпорт товарів: entries - [{"url", "name"?}].
+    URL нормалізуються, дублікати (у самому імпорті та вже наявні в базі - через індекс URL)
+    пропускаються, конкурент визначається один раз на домен. Нові товари зберігаються
+    одним записом бази.
+    """
+    invalid_urls = []
+    duplicates = 0
+    candidates = []
+    seen = set()
+    for entry in entries:
+        url = (entry.get("url") or "").strip()
+        parsed = urlparse(url)
+        key = normalize_url(url)
+        if parsed.scheme not in ("http", "https") or not parsed.netloc or not key:
+            invalid_urls.append(url)
+            continue
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        candidates.append((url, normalize_domain(url), entry.get("name")))
+
+    # Конкурент за доменом - один пошук на домен
+    competitors_by_domain: Dict[str, Optional[Tuple[str, str]]] = {}
+    for url, domain, _ in candidates:
+        if domain not in competitors_by_domain:
+            competitors_by_domain[domain] = await find_competitor_by_url(url)
+
+    new_products = []
+    async with _db_lock:
+        db = await load_db()
+        index = await get_product_index()
+        for url, domain, name in candidates:
+            if index.find_by_url(url):
+                duplicates += 1
+                continue
+            product = make_new_product(url, name)
+            competitor_info = competitors_by_domain.get(domain)
+            if competitor_info:
+                product["competitor_id"], product["competitor_name"] = competitor_info
+            new_products.append(product)
+        if new_products:
+            db["products"].extend(new_products)
+            await save_db(db, changed_ids=[product["id"] for product in new_products])
+
+    logger.info(f"Імпорт товарів: додано {len(new_products)}, дублікатів {duplicates}, некоректних URL {len(invalid_urls)}")
+    return {
+        "added": len(new_products),
+        "duplicates": duplicates,
+        "invalid": len(invalid_urls),
+        "invalid_urls": invalid_urls[:20],
+        "product_ids": [product["id"] for product in new_products]
+    }
+
+
 async def parse_product(product: Product) -> Dict:
     """Парсить товар через GPT (асинхронно)"""
     from .gpt_client import ProductNotFoundError
@@ -156,7 +309,7 @@ async def parse_product(product: Product) -> Dict:
     try:
         if is_first_parse(product):
             # Перший парсинг - збираємо всю інформацію
-            parsed_data = client.parse_first_time(product.url)
+            parsed_data = await asyncio.to_thread(client.parse_first_time, product.url)
             # Зберігаємо токени
             if "_token_usage" in parsed_data:
                 await save_token_usage(api_key_obj.id, parsed_data["_token_usage"])
@@ -185,7 +338,7 @@ async def parse_product(product: Product) -> Dict:
             }
         else:
             # Оновлення - тільки ціна та наявність
-            parsed_data = client.parse_update(product.url)
+            parsed_data = await asyncio.to_thread(client.parse_update, product.url)
             # Зберігаємо токени
             if "_token_usage" in parsed_data:
                 await save_token_usage(api_key_obj.id, parsed_data["_token_usage"])
@@ -221,7 +374,7 @@ async def parse_product_full(product: Product) -> Dict:
     
     try:
         # Завжди виконуємо повний парсинг
-        parsed_data = client.parse_first_time(product.url)
+        parsed_data = await asyncio.to_thread(client.parse_first_time, product.url)
         # Зберігаємо токени
         if "_token_usage" in parsed_data:
             await save_token_usage(api_key_obj.id, parsed_data["_token_usage"])
@@ -258,170 +411,288 @@ async def parse_product_full(product: Product) -> Dict:
 
 async def save_result(product_id: str, parsed_data: Dict):
     """Зберігає результат парсингу (асинхронно)"""
+    async with _db_lock:
+        await _save_result_locked(product_id, parsed_data)
+
+
+async def _save_result_locked(product_id: str, parsed_data: Dict):
+    """Застосовує результат парсингу до бази (викликається під _db_lock)"""
     db = await load_db()
     
-    for product in db["products"]:
-        if product["id"] == product_id:
-            now = datetime.now().isoformat()
-            
-            # Перевіряємо, чи це статус "disabled_by_competitor"
-            if "status" in parsed_data and parsed_data["status"] == "disabled_by_competitor":
-                logger.info(f"Встановлюємо статус 'disabled_by_competitor' для товару {product_id}")
-                product["status"] = "disabled_by_competitor"
-                product["last_parsed_at"] = now
-                # Додаємо лог про вимкнення
-                if "logs" not in product:
-                    product["logs"] = []
-                log_entry = {
-                    "date": now,
-                    "operation": "parse",
-                    "status": "error",
-                    "message": "Товар вимкнений конкурентом (404 - товар не знайдено на сайті)"
-                }
-                product["logs"].append(log_entry)
-                await save_db(db)
-                logger.info(f"Статус 'disabled_by_competitor' збережено для товару {product_id}")
-                return
-            
-            if "name" in parsed_data and parsed_data["name"] is not None:
-                product["name_parsed"] = parsed_data["name"]
-            if "sku" in parsed_data and parsed_data["sku"] is not None:
-                product["sku"] = parsed_data["sku"]
-            if "price" in parsed_data:
-                product["price"] = parsed_data["price"]
-            if "availability" in parsed_data and parsed_data["availability"] is not None:
-                product["availability"] = parsed_data["availability"]
-            if "competitor_name" in parsed_data:
-                # Зберігаємо competitor_name навіть якщо він null (щоб очистити старе значення)
-                # Але якщо він не порожній рядок, зберігаємо його
-                if parsed_data["competitor_name"] is not None and parsed_data["competitor_name"] != "":
-                    product["competitor_name"] = parsed_data["competitor_name"]
-            if "category_path" in parsed_data:
-                # Зберігаємо category_path навіть якщо він порожній масив
-                product["category_path"] = parsed_data["category_path"] if parsed_data["category_path"] is not None else []
-            if "competitor_id" in parsed_data:
-                # Зберігаємо competitor_id якщо він є
-                if parsed_data["competitor_id"] is not None and parsed_data["competitor_id"] != "":
-                    product["competitor_id"] = parsed_data["competitor_id"]
-            
-            product["last_parsed_at"] = now
-            product["status"] = "parsed"
-            
-            # Оновлюємо історію
-            await update_history(product_id, parsed_data.get("price"), parsed_data.get("availability"), db)
-            
-            break
+    log_entry = None
+    product = _find_product(db, product_id)
+    if product is not None:
+        history_entry, log_entry = _apply_result(product, parsed_data, datetime.now().isoformat())
+        if history_entry:
+            # Спочатку журнал історії, потім база: повторне застосування не дублює запис
+            await append_history(product_id, [history_entry])
     
-    await save_db(db)
+    await save_db(db, changed_ids=[product_id])
+    if log_entry:
+        await append_log(product_id, log_entry)
 
 
-async def update_history(product_id: str, price: Optional[float], availability: Optional[str], db: Optional[Dict] = None):
-    """Оновлює історію змін товару (асинхронно)"""
-    if db is None:
-        db = await load_db()
-        should_save = True
-    else:
-        should_save = False  # Якщо db переданий, збереження відбувається в батьківській функції
+def _apply_result(product: Dict, parsed_data: Dict, now: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """
+    Застосовує результат парсингу до запису товару; now - час отримання результату.
+    Повертає (рядок для журналу історії цін або None, якщо значення не змінились;
+    запис для логу товару або None).
+    """
+    product_id = product["id"]
     
-    for product in db["products"]:
-        if product["id"] == product_id:
-            history_entry = {
-                "date": datetime.now().isoformat(),
-                "price": price,
-                "availability": availability
-            }
-            
-            if "history" not in product:
-                product["history"] = []
-            
-            product["history"].append(history_entry)
-            break
+    # Перевіряємо, чи це статус "disabled_by_competitor"
+    if "status" in parsed_data and parsed_data["status"] == "disabled_by_competitor":
+        logger.info(f"Встановлюємо статус 'disabled_by_competitor' для товару {product_id}")
+        product["status"] = "disabled_by_competitor"
+        product["last_parsed_at"] = now
+        # Лог про вимкнення (зберігається в лозі товару, не в базі)
+        log_entry = {
+            "date": now,
+            "operation": "parse",
+            "status": "error",
+            "message": "Товар вимкнений конкурентом (404 - товар не знайдено на сайті)"
+        }
+        return None, log_entry
+    
+    if "name" in parsed_data and parsed_data["name"] is not None:
+        product["name_parsed"] = parsed_data["name"]
+    if "sku" in parsed_data and parsed_data["sku"] is not None:
+        product["sku"] = parsed_data["sku"]
+    if "price" in parsed_data:
+        product["price"] = parsed_data["price"]
+    if "availability" in parsed_data and parsed_data["availability"] is not None:
+        product["availability"] = parsed_data["availability"]
+    if "competitor_name" in parsed_data:
+        # Зберігаємо competitor_name навіть якщо він null (щоб очистити старе значення)
+        # Але якщо він не порожній рядок, зберігаємо його
+        if parsed_data["competitor_name"] is not None and parsed_data["competitor_name"] != "":
+            product["competitor_name"] = parsed_data["competitor_name"]
+    if "category_path" in parsed_data:
+        # Зберігаємо category_path навіть якщо він порожній масив
+        product["category_path"] = parsed_data["category_path"] if parsed_data["category_path"] is not None else []
+    if "competitor_id" in parsed_data:
+        # Зберігаємо competitor_id якщо він є
+        if parsed_data["competitor_id"] is not None and parsed_data["competitor_id"] != "":
+            product["competitor_id"] = parsed_data["competitor_id"]
     
-    # Зберігаємо тільки якщо db не був переданий (викликано окремо)
-    if should_save:
-        await save_db(db)
+    product["last_parsed_at"] = now
+    product["status"] = "parsed"
+    
+    # Історія (окремий журнал): новий рядок тільки при зміні ціни або наявності
+    return record_observation(product, now, parsed_data.get("price"), parsed_data.get("availability")), None
 
 
-async def save_token_usage(key_id: str, token_usage: Dict):
-    """Зберігає інформацію про використання токенів для API ключа (асинхронно)"""
-    from .models import TokenUsage
-    
-    settings = await load_settings()
+async def save_results_batch(items: List[Dict]):
+    """
+    Зберігає пакет результатів парсингу одним записом бази.
+    items - записи {"product_id", "parsed_data", "parsed_at"}.
+    Запис, старіший за last_parsed_at товару, вважається вже застосованим і пропускається
+    (повторне застосування журналу після збою не дублює історію).
+    """
+    async with _db_lock:
+        db = await load_db()
+        changed_ids = []
+        history_entries: Dict[str, List[Dict]] = {}
+        log_entries: Dict[str, List[Dict]] = {}
+        
+        for item in items:
+            product = _find_product(db, item["product_id"])
+            if product is None:
+                continue
+            if product.get("last_parsed_at") and product["last_parsed_at"] >= item["parsed_at"]:
+                continue
+            history_entry, log_entry = _apply_result(product, item["parsed_data"], item["parsed_at"])
+            if history_entry:
+                history_entries.setdefault(item["product_id"], []).append(history_entry)
+            if log_entry:
+                log_entries.setdefault(item["product_id"], []).append(log_entry)
+            changed_ids.append(item["product_id"])
+        
+        if changed_ids:
+            await append_history_batch(history_entries)
+            await save_db(db, changed_ids=changed_ids)
     
-    for key_obj in settings.keys:
-        if key_obj.id == key_id:
-            # Створюємо запис про використання токенів
-            usage_entry = TokenUsage(
-                timestamp=datetime.now().isoformat(),
-                prompt_tokens=token_usage.get("prompt_tokens", 0),
-                completion_tokens=token_usage.get("completion_tokens", 0),
-                total_tokens=token_usage.get("total_tokens", 0)
-            )
-            
-            # Додаємо до історії
-            if not hasattr(key_obj, "token_usage_history") or key_obj.token_usage_history is None:
-                key_obj.token_usage_history = []
-            
-            key_obj.token_usage_history.append(usage_entry)
-            break
+    for product_id, entries in log_entries.items():
+        await append_logs(product_id, entries)
+
+
+async def append_product_log(product_id: str, log_entry: Dict, fields: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Додає запис у лог товару (окреме сховище логів) та за потреби оновлює поля
+    товару на свіжій копії бази під блокуванням.
+    Повертає запис товару або None, якщо товар не знайдено.
+    """
+    if fields:
+        async with _db_lock:
+            db = await load_db()
+            product = _find_product(db, product_id)
+            if product is not None:
+                product.update(fields)
+                await save_db(db, changed_ids=[product_id])
+    else:
+        product = await get_product_by_id(product_id)
     
-    await save_settings(settings)
+    if product is None:
+        return None
+    await append_log(product_id, log_entry)
+    return product
+
+
+_result_buffer = WriteBehindBuffer(
+    save_results_batch, RESULTS_JOURNAL_FILE,
+    max_batch=WRITE_BEHIND_BATCH_SIZE, max_delay_seconds=WRITE_BEHIND_MAX_DELAY_SECONDS
+)
+
+
+async def flush_pending_results():
+    """Зберігає всі результати, накопичені буфером відкладеного запису"""
+    await _result_buffer.flush()
+
+
+async def recover_pending_results() -> int:
+    """Застосовує результати з журналу, які не встигли зберегтися до зупинки процесу"""
+    return await _result_buffer.recover()
+
+
+async def close_result_buffer():
+    """Зберігає залишок буфера при зупинці застосунку"""
+    await _result_buffer.close()
+
+
+async def update_history(product_id: str, price: Optional[float], availability: Optional[str], date: Optional[str] = None):
+    """Враховує спостереження ціни та наявності в історії товару (асинхронно)"""
+    async with _db_lock:
+        db = await load_db()
+        product = _find_product(db, product_id)
+        if product is not None:
+            entry = record_observation(product, date or datetime.now().isoformat(), price, availability)
+            if entry:
+                await append_history(product_id, [entry])
+            await save_db(db, changed_ids=[product_id])
+
+
+async def migrate_product_logs() -> int:
+    """
+    Переносить логи, що зберігались у db.json (поле logs товарів), в окремі кільцеві буфери.
+    Виконується при старті застосунку; повертає кількість змінених товарів.
+    """
+    async with _db_lock:
+        db = await load_db()
+        changed_ids = await migrate_embedded_logs(db.get("products", []))
+        if changed_ids:
+            await save_db(db, changed_ids=changed_ids)
+            logger.info(f"Логи {len(changed_ids)} товарів перенесено з db.json в окреме сховище логів")
+        return len(changed_ids)
+
+
+async def migrate_product_history() -> int:
+    """
+    Переносить історію, що зберігалась у db.json (поле history товарів), в окремі журнали
+    та заповнює відкриті відрізки історії товарів.
+    Виконується при старті застосунку; повертає кількість змінених товарів.
+    """
+    async with _db_lock:
+        db = await load_db()
+        changed_ids = await migrate_embedded_history(db.get("products", []))
+        if changed_ids:
+            await save_db(db, changed_ids=changed_ids)
+            logger.info(f"Історію {len(changed_ids)} товарів перенесено в журнали історії")
+        return len(changed_ids)
+
+
+async def save_token_usage(key_id: str, token_usage: Dict):
+    """Зберігає інформацію про використання токенів для API ключа (журнал + погодинні/щоденні агрегати)"""
+    await record_token_usage(key_id, token_usage)
+
+
+async def migrate_token_usage_history() -> int:
+    """
+    Переносить історію використання токенів, що зберігалась у settings.json
+    (token_usage_history ключів), у журнал використання токенів.
+    Виконується при старті застосунку; повертає кількість перенесених записів.
+    """
+    async with _settings_lock:
+        data = await read_json(SETTINGS_FILE, dict)
+        entries = []
+        changed = False
+        for key_data in data.get("keys", []):
+            if "token_usage_history" not in key_data:
+                continue
+            changed = True
+            for item in key_data.pop("token_usage_history") or []:
+                entries.append(make_usage_entry(key_data.get("id"), item, item.get("timestamp")))
+        if changed:
+            # Спочатку журнал, потім налаштування без історії
+            await record_token_usage_entries(entries)
+            await write_json_atomic(SETTINGS_FILE, data)
+            logger.info(f"Перенесено {len(entries)} записів використання токенів з settings.json у журнал")
+        return len(entries)
 
 
 async def load_competitors() -> Dict:
     """Завантажує базу даних конкурентів (асинхронно)"""
-    try:
-        async with aiofiles.open(COMPETITORS_FILE, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return json.loads(content)
-    except FileNotFoundError:
-        return {"competitors": []}
-    except Exception as e:
-        return {"competitors": []}
+    return await read_json(COMPETITORS_FILE, lambda: {"competitors": []})
+
+
+async def load_competitors_view() -> Dict:
+    """Повертає базу конкурентів з кешу тільки для читання"""
+    return await read_json_view(COMPETITORS_FILE, lambda: {"competitors": []})
 
 
 async def save_competitors(data: Dict):
     """Зберігає базу даних конкурентів (асинхронно)"""
-    os.makedirs(os.path.dirname(COMPETITORS_FILE), exist_ok=True)
-    async with aiofiles.open(COMPETITORS_FILE, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    await write_json_atomic(COMPETITORS_FILE, data)
+    _competitor_domain_index.invalidate()
+    _competitor_category_index.invalidate()
+
+
+async def update_competitor_fields(competitor_id: str, fields: Dict) -> bool:
+    """
+    Оновлює поля конкурента на свіжій копії бази під блокуванням.
+    Використовується довгими задачами, щоб не перезаписати зміни, зроблені поки задача працювала.
+    """
+    async with _competitors_lock:
+        competitors_db = await load_competitors()
+        for competitor in competitors_db["competitors"]:
+            if competitor["id"] == competitor_id:
+                competitor.update(fields)
+                await save_competitors(competitors_db)
+                return True
+        return False
+
+
+def _parse_period_boundary(value: Optional[str]) -> Optional[datetime]:
+    """Межа періоду статистики; дати з часовим поясом (toISOString у браузері) переводяться в локальний час"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
 
 
 async def get_token_statistics(key_id: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict:
-    """Отримує статистику використання токенів за період (асинхронно)"""
+    """Отримує статистику використання токенів за період з погодинних/щоденних агрегатів (асинхронно)"""
     settings = await load_settings()
     
     for key_obj in settings.keys:
         if key_obj.id == key_id:
-            history = getattr(key_obj, "token_usage_history", []) or []
-            
-            # Фільтруємо за періодом
-            if start_date or end_date:
-                filtered_history = []
-                for entry in history:
-                    entry_date = entry.get("timestamp", "") if isinstance(entry, dict) else entry.timestamp
-                    if start_date and entry_date < start_date:
-                        continue
-                    if end_date and entry_date > end_date:
-                        continue
-                    filtered_history.append(entry)
-                history = filtered_history
-            
-            # Підраховуємо статистику
-            total_prompt = sum(entry.get("prompt_tokens", 0) if isinstance(entry, dict) else entry.prompt_tokens for entry in history)
-            total_completion = sum(entry.get("completion_tokens", 0) if isinstance(entry, dict) else entry.completion_tokens for entry in history)
-            total_tokens = sum(entry.get("total_tokens", 0) if isinstance(entry, dict) else entry.total_tokens for entry in history)
-            
+            totals = await get_usage_totals(
+                key_id, _parse_period_boundary(start_date), _parse_period_boundary(end_date)
+            )
             return {
                 "key_id": key_id,
                 "key_name": key_obj.name,
                 "period_start": start_date,
                 "period_end": end_date,
-                "total_requests": len(history),
-                "total_prompt_tokens": total_prompt,
-                "total_completion_tokens": total_completion,
-                "total_tokens": total_tokens,
-                "history": history
+                "total_requests": totals["requests"],
+                "total_prompt_tokens": totals["prompt_tokens"],
+                "total_completion_tokens": totals["completion_tokens"],
+                "total_tokens": totals["total_tokens"],
+                "daily": totals["daily"]
             }
     
     return {
@@ -430,34 +701,103 @@ async def get_token_statistics(key_id: str, start_date: Optional[str] = None, en
         "total_prompt_tokens": 0,
         "total_completion_tokens": 0,
         "total_tokens": 0,
-        "history": []
+        "daily": []
     }
 
 
+# ========== ФУНКЦІЇ ДЛЯ РОБОТИ З РОЗКЛАДАМИ ОНОВЛЕНЬ ==========
+
+async def load_schedules() -> Dict:
+    """Завантажує розклади регулярних оновлень (асинхронно)"""
+    return await read_json(SCHEDULES_FILE, lambda: {"schedules": []})
+
+
+async def load_schedules_view() -> Dict:
+    """Повертає розклади з кешу тільки для читання"""
+    return await read_json_view(SCHEDULES_FILE, lambda: {"schedules": []})
+
+
+async def save_schedules(data: Dict):
+    """Зберігає розклади регулярних оновлень (асинхронно)"""
+    await write_json_atomic(SCHEDULES_FILE, data)
+
+
 # ========== ФУНКЦІЇ ДЛЯ РОБОТИ З ПРОГРЕСОМ ЗАДАЧ ==========
 
 async def load_progress() -> Dict:
     """Завантажує прогрес задач (асинхронно)"""
-    try:
-        os.makedirs(os.path.dirname(PROGRESS_FILE), exist_ok=True)
-        async with aiofiles.open(PROGRESS_FILE, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return json.loads(content)
-    except FileNotFoundError:
-        return {"tasks": {}}
-    except Exception as e:
-        return {"tasks": {}}
+    return await read_json(PROGRESS_FILE, lambda: {"tasks": {}})
+
+
+async def load_progress_view() -> Dict:
+    """Повертає прогрес задач з кешу тільки для читання"""
+    return await read_json_view(PROGRESS_FILE, lambda: {"tasks": {}})
 
 
 async def save_progress(data: Dict):
     """Зберігає прогрес задач (асинхронно)"""
-    os.makedirs(os.path.dirname(PROGRESS_FILE), exist_ok=True)
-    async with aiofiles.open(PROGRESS_FILE, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    await write_json_atomic(PROGRESS_FILE, data)
+
+
+async def register_task(task_id: str, task_type: str, total: int = 0, **fields):
+    """Створює запис задачі в прогресі (під блокуванням прогресу)"""
+    async with _progress_lock:
+        progress = await load_progress()
+        progress["tasks"][task_id] = {
+            "type": task_type,
+            **fields,
+            "total": total,
+            "done": 0,
+            "errors": [],
+            "status": "running"
+        }
+        await save_progress(progress)
+
+
+async def set_task_fields(task_id: str, **fields):
+    """Записує додаткові поля задачі (наприклад, кількість знайдених товарів)"""
+    async with _progress_lock:
+        progress = await load_progress()
+        if task_id in progress["tasks"]:
+            progress["tasks"][task_id].update(fields)
+            await save_progress(progress)
 
 
-async def update_task_progress(task_id: str, done: int = None, total: int = None, status: str = None, error: str = None):
-    """Оновлює прогрес задачі"""
+# Проміжний прогрес, ще не записаний у файл: task_id -> {"done", "total", "skipped"}
+_pending_progress: Dict[str, Dict] = {}
+# Час останнього запису прогресу задачі у файл: task_id -> monotonic time
+_progress_written_at: Dict[str, float] = {}
+
+
+async def update_task_progress(task_id: str, done: int = None, total: int = None, status: str = None, error: str = None, skipped: int = None):
+    """
+    Оновлює прогрес задачі.
+    Зміни тільки лічильників записуються не частіше ніж раз на PROGRESS_WRITE_INTERVAL_SECONDS;
+    зміна статусу або помилка записуються одразу разом з накопиченими лічильниками.
+    """
+    async with _progress_lock:
+        pending = _pending_progress.setdefault(task_id, {})
+        for field, value in (("done", done), ("total", total), ("skipped", skipped)):
+            if value is not None:
+                pending[field] = value
+        
+        loop_time = asyncio.get_running_loop().time()
+        if status is None and error is None and \
+                loop_time - _progress_written_at.get(task_id, float("-inf")) < PROGRESS_WRITE_INTERVAL_SECONDS:
+            return
+        
+        pending = _pending_progress.pop(task_id)
+        await _update_task_progress_locked(
+            task_id, pending.get("done"), pending.get("total"), status, error, pending.get("skipped")
+        )
+        if status is not None and status != "running":
+            _progress_written_at.pop(task_id, None)
+        else:
+            _progress_written_at[task_id] = loop_time
+
+
+async def _update_task_progress_locked(task_id: str, done: int, total: int, status: str, error: str, skipped: int):
+    """Оновлює прогрес задачі (викликається під _progress_lock)"""
     progress = await load_progress()
     
     if task_id not in progress["tasks"]:
@@ -483,14 +823,130 @@ async def update_task_progress(task_id: str, done: int = None, total: int = None
         if "errors" not in progress["tasks"][task_id]:
             progress["tasks"][task_id]["errors"] = []
         progress["tasks"][task_id]["errors"].append(error)
+    if skipped is not None:
+        progress["tasks"][task_id]["skipped"] = skipped
     
     await save_progress(progress)
 
 
 async def get_task_status(task_id: str) -> Optional[Dict]:
-    """Отримує статус задачі"""
-    progress = await load_progress()
-    return progress["tasks"].get(task_id)
+    """Отримує статус задачі (з урахуванням ще не записаного проміжного прогресу)"""
+    progress = await load_progress_view()
+    task = progress["tasks"].get(task_id)
+    if task is None:
+        return None
+    return {**task, **_pending_progress.get(task_id, {})}
+
+
+# ========== КООРДИНАЦІЯ ЗАДАЧ ТА БЛОКУВАННЯ ТОВАРІВ ==========
+
+# Активні задачі: сигнатура запиту -> task_id (для об'єднання однакових запитів)
+_active_tasks: Dict[str, str] = {}
+# Блокування товарів, які зараз парсяться: product_id -> asyncio.Lock
+_product_locks: Dict[str, asyncio.Lock] = {}
+# Час останнього отримання даних товару в цьому процесі: product_id -> datetime
+_last_fetched: Dict[str, datetime] = {}
+
+
+def make_task_signature(task_type: str, payload=None) -> str:
+    """Формує сигнатуру задачі: однакові запити дають однакову сигнатуру"""
+    if payload is None:
+        return task_type
+    return f"{task_type}:{json.dumps(payload, ensure_ascii=False, sort_keys=True)}"
+
+
+def claim_task(signature: str, task_id: str) -> Optional[str]:
+    """
+    Реєструє задачу за сигнатурою.
+    Якщо така ж задача вже виконується - повертає її task_id (нова задача не створюється),
+    інакше реєструє task_id та повертає None.
+    Функція синхронна, тому перевірка та реєстрація відбуваються атомарно для event loop.
+    """
+    existing_task_id = _active_tasks.get(signature)
+    if existing_task_id:
+        return existing_task_id
+    _active_tasks[signature] = task_id
+    return None
+
+
+def release_task(signature: str, task_id: str):
+    """Знімає реєстрацію задачі (тільки якщо сигнатура належить саме цій задачі)"""
+    if _active_tasks.get(signature) == task_id:
+        del _active_tasks[signature]
+
+
+async def run_coalesced_task(signature: str, task_id: str, coro):
+    """Виконує фонову задачу та звільняє її сигнатуру після завершення"""
+    try:
+        await coro
+    finally:
+        release_task(signature, task_id)
+
+
+def get_product_lock(product_id: str) -> asyncio.Lock:
+    """Повертає блокування товару (один товар парситься не більше ніж однією задачею одночасно)"""
+    lock = _product_locks.get(product_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _product_locks[product_id] = lock
+    return lock
+
+
+def is_recently_parsed(product_data: Dict, window_minutes: int = REFRESH_WINDOW_MINUTES) -> bool:
+    """Перевіряє, чи товар вже отримували протягом вікна оновлення"""
+    threshold = datetime.now() - timedelta(minutes=window_minutes)
+    
+    fetched_at = _last_fetched.get(product_data.get("id"))
+    if fetched_at and fetched_at >= threshold:
+        return True
+    
+    last_parsed_at = product_data.get("last_parsed_at")
+    if last_parsed_at:
+        try:
+            return datetime.fromisoformat(last_parsed_at) >= threshold
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+async def refresh_product(product_data: Dict, full: bool = False, respect_window: bool = True,
+                          buffered: bool = False) -> Optional[Dict]:
+    """
+    Парсить товар під блокуванням товару та зберігає результат.
+    buffered=True - результат зберігається через буфер відкладеного запису (для масових задач;
+    після завершення задачі потрібно викликати flush_pending_results).
+    Повертає parsed_data або None, якщо товар пропущено:
+    - товар вже парсився іншою задачею (чекаємо її завершення і не парсимо вдруге)
+    - товар отримано протягом вікна оновлення (якщо respect_window=True)
+    """
+    product_id = product_data["id"]
+    lock = get_product_lock(product_id)
+    was_in_flight = lock.locked()
+    
+    async with lock:
+        if was_in_flight:
+            logger.info(f"Товар {product_id} вже парсився іншою задачею - пропускаємо повторний запит")
+            return None
+        if respect_window and is_recently_parsed(product_data):
+            logger.info(f"Товар {product_id} вже оновлено протягом {REFRESH_WINDOW_MINUTES} хв - пропускаємо")
+            return None
+        
+        product = Product(**product_data)
+        if full:
+            parsed_data = await parse_product_full(product)
+        else:
+            # parse_product автоматично визначає, чи це перший парсинг чи оновлення
+            parsed_data = await parse_product(product)
+        if buffered:
+            await _result_buffer.add({
+                "product_id": product_id,
+                "parsed_data": parsed_data,
+                "parsed_at": datetime.now().isoformat()
+            })
+        else:
+            await save_result(product_id, parsed_data)
+        _last_fetched[product_id] = datetime.now()
+        return parsed_data
 
 
 # ========== АСИНХРОННІ ФУНКЦІЇ ФОНОВОГО ПАРСИНГУ ==========
@@ -498,7 +954,7 @@ async def get_task_status(task_id: str) -> Optional[Dict]:
 async def parse_all_products(task_id: str):
     """Асинхронна функція для парсингу всіх товарів у фоновому режимі (тільки ціна та наявність для вже спарсених)"""
     try:
-        db = await load_db()
+        db = await load_db_view()
         total = len(db["products"])
         
         if total == 0:
@@ -509,14 +965,17 @@ async def parse_all_products(task_id: str):
         
         success_count = 0
         error_count = 0
+        skipped_count = 0
         
         for idx, product_data in enumerate(db["products"]):
             try:
-                product = Product(**product_data)
-                # parse_product автоматично визначає, чи це перший парсинг чи оновлення
-                # Для вже спарсених товарів парсить тільки ціну та наявність
-                parsed_data = await parse_product(product)
-                await save_result(product.id, parsed_data)
+                # Для вже спарсених товарів парсить тільки ціну та наявність;
+                # товари, які парсить інша задача або щойно оновлені, пропускаються
+                parsed_data = await refresh_product(product_data, buffered=True)
+                if parsed_data is None:
+                    skipped_count += 1
+                    await update_task_progress(task_id, done=idx + 1, total=total, skipped=skipped_count)
+                    continue
                 # Перевіряємо, чи товар не вимкнений конкурентом (це не помилка)
                 if parsed_data.get("status") == "disabled_by_competitor":
                     success_count += 1  # Вважаємо успішним, бо це очікуваний результат
@@ -528,8 +987,11 @@ async def parse_all_products(task_id: str):
                 error_msg = f"Товар {product_data.get('name', product_data.get('id', 'unknown'))}: {str(e)}"
                 await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
         
+        # Зберігаємо результати, що залишились у буфері відкладеного запису
+        await flush_pending_results()
+        
         # Перевіряємо, чи є помилки
-        progress = await load_progress()
+        progress = await load_progress_view()
         task = progress["tasks"].get(task_id, {})
         errors = task.get("errors", [])
         
@@ -548,24 +1010,90 @@ async def parse_all_products(task_id: str):
         await update_task_progress(task_id, status="failed", error=f"Критична помилка: {str(e)}\n{error_details}")
 
 
+async def select_stale_products(max_age_minutes: int, disabled_recheck_minutes: Optional[int] = None) -> List[Dict]:
+    """
+    Вибирає товари, у яких last_parsed_at старіший за max_age_minutes (та товари без парсингу).
+    Товари зі статусом disabled_by_competitor включаються тільки якщо задано disabled_recheck_minutes
+    і з останньої перевірки минуло більше цього часу.
+    Вибірка йде за індексом last_parsed_at, без повного перегляду бази.
+    """
+    index = await get_product_index()
+    now = datetime.now()
+    stale_before = (now - timedelta(minutes=max_age_minutes)).isoformat()
+    disabled_before = (
+        (now - timedelta(minutes=disabled_recheck_minutes)).isoformat()
+        if disabled_recheck_minutes is not None else None
+    )
+    
+    selected = []
+    for product_id in index.stale_ids(stale_before):
+        product_data = index.by_id[product_id]
+        if product_data.get("status") == "disabled_by_competitor":
+            if disabled_before is None or (product_data.get("last_parsed_at") or "") >= disabled_before:
+                continue
+        selected.append(product_data)
+    return selected
+
+
+async def parse_stale_products(task_id: str, max_age_minutes: int, disabled_recheck_minutes: Optional[int] = None):
+    """Асинхронна функція для інкрементального парсингу тільки застарілих товарів у фоновому режимі"""
+    try:
+        products_to_parse = await select_stale_products(max_age_minutes, disabled_recheck_minutes)
+        total = len(products_to_parse)
+        
+        if total == 0:
+            await update_task_progress(task_id, done=0, total=0, status="finished")
+            return
+        
+        await update_task_progress(task_id, done=0, total=total, status="running")
+        
+        success_count = 0
+        error_count = 0
+        skipped_count = 0
+        
+        for idx, product_data in enumerate(products_to_parse):
+            try:
+                # Застарілість вже визначено за max_age_minutes - вікно оновлення не застосовується
+                parsed_data = await refresh_product(product_data, respect_window=False, buffered=True)
+                if parsed_data is None:
+                    skipped_count += 1
+                    await update_task_progress(task_id, done=idx + 1, total=total, skipped=skipped_count)
+                    continue
+                success_count += 1
+                await update_task_progress(task_id, done=idx + 1, total=total)
+            except Exception as e:
+                error_count += 1
+                error_msg = f"Товар {product_data.get('name', product_data.get('id', 'unknown'))}: {str(e)}"
+                await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
+        
+        # Зберігаємо результати, що залишились у буфері відкладеного запису
+        await flush_pending_results()
+        
+        if error_count > 0 and success_count == 0:
+            await update_task_progress(task_id, status="failed")
+        else:
+            await update_task_progress(task_id, status="finished")
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        await update_task_progress(task_id, status="failed", error=f"Критична помилка: {str(e)}\n{error_details}")
+
+
 async def parse_single_product(task_id: str, product_id: str):
     """Асинхронна функція для парсингу одного товару у фоновому режимі"""
     try:
         await update_task_progress(task_id, done=0, total=1, status="running", error=None)
         
-        db = await load_db()
-        product_data = None
-        for p in db["products"]:
-            if p["id"] == product_id:
-                product_data = p
-                break
-        
+        product_data = await get_product_by_id(product_id)
         if not product_data:
             raise Exception("Товар не знайдено")
         
-        product = Product(**product_data)
-        parsed_data = await parse_product(product)
-        await save_result(product_id, parsed_data)
+        # Явний запит користувача не обмежується вікном оновлення,
+        # але якщо товар вже парситься іншою задачею - повторно не парсимо
+        parsed_data = await refresh_product(product_data, respect_window=False)
+        if parsed_data is None:
+            await update_task_progress(task_id, done=1, total=1, status="finished", skipped=1)
+            return
         
         # Перевіряємо, чи товар не вимкнений конкурентом
         if parsed_data.get("status") == "disabled_by_competitor":
@@ -581,87 +1109,126 @@ async def parse_single_product_full(task_id: str, product_id: str):
     try:
         await update_task_progress(task_id, done=0, total=1, status="running", error=None)
         
-        db = await load_db()
-        product_data = None
-        for p in db["products"]:
-            if p["id"] == product_id:
-                product_data = p
-                break
-        
+        product_data = await get_product_by_id(product_id)
         if not product_data:
             raise Exception("Товар не знайдено")
         
-        product = Product(**product_data)
-        parsed_data = await parse_product_full(product)
-        await save_result(product_id, parsed_data)
+        parsed_data = await refresh_product(product_data, full=True, respect_window=False)
+        if parsed_data is None:
+            await update_task_progress(task_id, done=1, total=1, status="finished", skipped=1)
+            return
         
         await update_task_progress(task_id, done=1, total=1, status="finished")
     except Exception as e:
         await update_task_progress(task_id, done=1, total=1, status="failed", error=str(e))
 
 
+async def resolve_category_names(category_ids: List[str]) -> List[str]:
+    """Назви категорій (як у category_path товарів) за їх ID у деревах категорій конкурентів"""
+    category_index = await get_competitor_category_index()
+    category_names = []
+    for competitor_id in category_index.competitors:
+        tree = category_index.tree(competitor_id)
+        for cat_id in category_ids:
+            category = tree.by_id.get(cat_id)
+            if category is not None and category.get("name"):
+                category_names.append(category["name"])
+    return category_names
+
+
+async def get_category_product_ids(category_ids: List[str]) -> Set[str]:
+    """ID товарів вибраних категорій конкурентів разом з їх підкатегоріями (через індекси)"""
+    category_index = await get_competitor_category_index()
+    product_index = await get_product_index()
+    product_ids: Set[str] = set()
+    for competitor_id in category_index.competitors:
+        tree = category_index.tree(competitor_id)
+        category_paths = product_index.category_paths(competitor_id)
+        for cat_id in category_ids:
+            if cat_id in tree.by_id:
+                product_ids |= tree.product_ids(cat_id, category_paths)
+    return product_ids
+
+
+async def get_category_product_counts(competitor_id: str) -> Optional[Dict[str, int]]:
+    """Кількість товарів кожної категорії конкурента разом з підкатегоріями (None - конкурента немає)"""
+    tree = (await get_competitor_category_index()).tree(competitor_id)
+    if tree is None:
+        return None
+    return tree.product_counts((await get_product_index()).category_paths(competitor_id))
+
+
+def _is_problematic(product: Dict) -> bool:
+    """Товар з помилкою парсингу або спарсений без ціни/наявності"""
+    return product.get("status") == "error" or (
+        product.get("status") == "parsed" and (product.get("price") is None or product.get("availability") is None)
+    )
+
+
+async def select_filtered_products(filters: Dict, category_names: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Вибирає товари за фільтрами (ті ж фільтри, що і в endpoint /products/list).
+    Індексовані умови (конкурент, категорії, статус, наявність, діапазон цін) вибираються
+    через вторинні індекси, починаючи з найвибірковішої; назва шукається в повнотекстовому
+    індексі (за основами слів та префіксами, результат - за релевантністю), ознака
+    проблемного товару перевіряється тільки для отриманих кандидатів.
+    category_names - вже знайдені назви категорій (інакше шукаються за filters["category_ids"]).
+    Записи спільні з індексом і незмінні (FrozenDict).
+    """
+    index = await get_product_index()
+    equals: Dict[str, List] = {}
+    id_sets = None
+
+    competitor_id = filters.get("competitor_id")
+    if competitor_id and competitor_id != "all":
+        equals["competitor_id"] = [competitor_id]
+
+    # Товари вибраних категорій (з підкатегоріями) за індексом категорій, а також
+    # товари, у яких category_path містить назву однієї з категорій
+    category_ids = filters.get("category_ids")
+    if isinstance(category_ids, str):
+        category_ids = [category_ids]
+    if category_names is None and category_ids:
+        category_names = await resolve_category_names(category_ids)
+    if category_names:
+        id_sets = [await get_category_product_ids(category_ids)] if category_ids else []
+        id_sets += [index.category_ids(name) for name in dict.fromkeys(category_names)]
+
+    if filters.get("status"):
+        equals["status"] = [filters["status"]]
+    if filters.get("availability"):
+        equals["availability"] = [filters["availability"].lower()]
+    if filters.get("problematic"):
+        equals.setdefault("status", ["error", "parsed"])
+
+    predicates = []
+    ranked_ids = None
+    if filters.get("name"):
+        matches = index.search(filters["name"])
+        if matches is not None:
+            ranked_ids = [product_id for product_id, _ in matches]
+        else:
+            # Запит без слів (тільки розділові знаки) - пошук підрядка
+            name_lower = filters["name"].lower()
+            predicates.append(lambda p: name_lower in (p.get("name", "") or "").lower() or
+                              name_lower in (p.get("name_parsed", "") or "").lower())
+    if filters.get("problematic"):
+        predicates.append(_is_problematic)
+
+    return index.select(
+        equals,
+        price_from=filters.get("price_from"),
+        price_to=filters.get("price_to"),
+        predicate=(lambda p: all(check(p) for check in predicates)) if predicates else None,
+        ranked_ids=ranked_ids,
+        id_sets=id_sets
+    )
+
+
 async def parse_filtered_products(task_id: str, filters: Dict):
     """Асинхронна функція для парсингу відфільтрованих товарів у фоновому режимі"""
     try:
-        db = await load_db()
-        products = db["products"]
-        
-        # Застосовуємо ті ж фільтри, що і в endpoint
-        filtered = products
-        
-        if filters.get("name"):
-            name_lower = filters["name"].lower()
-            filtered = [p for p in filtered if name_lower in (p.get("name", "") or "").lower() or 
-                      name_lower in (p.get("name_parsed", "") or "").lower()]
-        
-        if filters.get("competitor_id"):
-            filtered = [p for p in filtered if p.get("competitor_id") == filters["competitor_id"]]
-        
-        # Фільтр по категоріях (category_ids)
-        if filters.get("category_ids") and len(filters["category_ids"]) > 0:
-            # Шукаємо товари, у яких category_path містить хоча б одну з вибраних категорій
-            competitors_db = await load_competitors()
-            
-            # Збираємо всі назви категорій за ID
-            category_names = []
-            def find_category_by_id(categories, cat_id):
-                for cat in categories:
-                    if cat.get("id") == cat_id:
-                        return cat.get("name")
-                    if cat.get("children"):
-                        found = find_category_by_id(cat["children"], cat_id)
-                        if found:
-                            return found
-                return None
-            
-            for competitor in competitors_db.get("competitors", []):
-                for cat_id in filters["category_ids"]:
-                    cat_name = find_category_by_id(competitor.get("categories", []), cat_id)
-                    if cat_name:
-                        category_names.append(cat_name)
-            
-            if category_names:
-                filtered = [p for p in filtered if any(
-                    cat_name in (p.get("category_path", []) or []) for cat_name in category_names
-                )]
-        
-        if filters.get("status"):
-            filtered = [p for p in filtered if p.get("status") == filters["status"]]
-        
-        if filters.get("availability"):
-            filtered = [p for p in filtered if (p.get("availability") or "").lower() == filters["availability"].lower()]
-        
-        if filters.get("price_from") is not None:
-            filtered = [p for p in filtered if p.get("price") is not None and p.get("price", 0) >= filters["price_from"]]
-        
-        if filters.get("price_to") is not None:
-            filtered = [p for p in filtered if p.get("price") is not None and p.get("price", 0) <= filters["price_to"]]
-        
-        if filters.get("problematic"):
-            filtered = [p for p in filtered if (
-                p.get("status") == "error" or
-                (p.get("status") == "parsed" and (p.get("price") is None or p.get("availability") is None))
-            )]
+        filtered = await select_filtered_products(filters)
         
         total = len(filtered)
         
@@ -673,12 +1240,16 @@ async def parse_filtered_products(task_id: str, filters: Dict):
         
         success_count = 0
         error_count = 0
+        skipped_count = 0
         
         for idx, product_data in enumerate(filtered):
             try:
-                product = Product(**product_data)
-                parsed_data = await parse_product(product)
-                await save_result(product.id, parsed_data)
+                # Товари відібрано явним запитом користувача - вікно оновлення не застосовується
+                parsed_data = await refresh_product(product_data, respect_window=False, buffered=True)
+                if parsed_data is None:
+                    skipped_count += 1
+                    await update_task_progress(task_id, done=idx + 1, total=total, skipped=skipped_count)
+                    continue
                 # Перевіряємо, чи товар не вимкнений конкурентом (це не помилка)
                 if parsed_data.get("status") == "disabled_by_competitor":
                     success_count += 1  # Вважаємо успішним, бо це очікуваний результат
@@ -690,6 +1261,9 @@ async def parse_filtered_products(task_id: str, filters: Dict):
                 error_msg = f"Товар {product_data.get('name', product_data.get('id', 'unknown'))}: {str(e)}"
                 await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
         
+        # Зберігаємо результати, що залишились у буфері відкладеного запису
+        await flush_pending_results()
+        
         # Перевіряємо, чи є помилки
         progress = await load_progress()
         task = progress["tasks"].get(task_id, {})
@@ -710,7 +1284,9 @@ async def parse_filtered_products(task_id: str, filters: Dict):
 async def parse_selected_products(task_id: str, product_ids: list):
     """Асинхронна функція для парсингу вибраних товарів у фоновому режимі"""
     try:
-        db = await load_db()
+        index = await get_product_index()
+        # Прибираємо дублікати ID, зберігаючи порядок
+        product_ids = list(dict.fromkeys(product_ids))
         total = len(product_ids)
         
         if total == 0:
@@ -721,25 +1297,24 @@ async def parse_selected_products(task_id: str, product_ids: list):
         
         success_count = 0
         error_count = 0
+        skipped_count = 0
         
         for idx, product_id in enumerate(product_ids):
             try:
-                product_data = None
-                for p in db["products"]:
-                    if p["id"] == product_id:
-                        product_data = p
-                        break
-                
+                product_data = index.get(product_id)
                 if not product_data:
                     error_count += 1
                     error_msg = f"Товар з ID {product_id} не знайдено"
                     await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
                     continue
                 
-                product = Product(**product_data)
-                parsed_data = await parse_product(product)
+                # Товари вибрано явно - вікно оновлення не застосовується
+                parsed_data = await refresh_product(product_data, respect_window=False, buffered=True)
+                if parsed_data is None:
+                    skipped_count += 1
+                    await update_task_progress(task_id, done=idx + 1, total=total, skipped=skipped_count)
+                    continue
                 logger.info(f"Товар {product_id}: parsed_data = {parsed_data}")
-                await save_result(product_id, parsed_data)
                 # Перевіряємо, чи товар не вимкнений конкурентом (це не помилка)
                 if parsed_data.get("status") == "disabled_by_competitor":
                     logger.info(f"Товар {product_id} вимкнений конкурентом - вважаємо успішним")
@@ -752,8 +1327,11 @@ async def parse_selected_products(task_id: str, product_ids: list):
                 error_msg = f"Товар {product_id}: {str(e)}"
                 await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
         
+        # Зберігаємо результати, що залишились у буфері відкладеного запису
+        await flush_pending_results()
+        
         # Перевіряємо, чи є помилки
-        progress = await load_progress()
+        progress = await load_progress_view()
         task = progress["tasks"].get(task_id, {})
         errors = task.get("errors", [])
         
@@ -806,11 +1384,15 @@ async def parse_competitor_categories(task_id: str, competitor_id: str):
         else:
             categories = categories_result
 
-        # Оновлюємо категорії конкурента
+        # Оновлюємо категорії конкурента (на свіжій копії бази - парсинг міг тривати довго)
         competitor_data["categories"] = categories
         competitor_data["last_parsed"] = datetime.now().isoformat()
         
-        await save_competitors(competitors_db)
+        await update_competitor_fields(competitor_id, {
+            "categories": competitor_data["categories"],
+            "last_parsed": competitor_data["last_parsed"],
+            "site_profile": competitor_data.get("site_profile")
+        })
         await update_task_progress(task_id, done=1, total=1, status="finished")
     except Exception as e:
         import traceback
@@ -874,7 +1456,11 @@ async def update_competitor_categories(task_id: str, competitor_id: str):
         if not old_categories or len(old_categories) == 0:
             competitor_data["categories"] = new_categories
             competitor_data["last_parsed"] = datetime.now().isoformat()
-            await save_competitors(competitors_db)
+            await update_competitor_fields(competitor_id, {
+                "categories": competitor_data["categories"],
+                "last_parsed": competitor_data["last_parsed"],
+                "site_profile": competitor_data.get("site_profile")
+            })
             
             stats_message = f"Парсинг завершено:\n"
             stats_message += f"➕ Додано: {len(new_categories)} категорій"
@@ -883,182 +1469,41 @@ async def update_competitor_categories(task_id: str, competitor_id: str):
             logger.info(f"Перший парсинг категорій завершено: додано {len(new_categories)} категорій")
             return
         
-        # Порівнюємо та оновлюємо категорії
-        def get_all_categories_flat(categories_list, parent_path=""):
-            """Рекурсивно збирає всі категорії у плоский список з шляхом"""
-            result = []
-            for cat in categories_list:
-                current_path = f"{parent_path}/{cat.get('id', '')}" if parent_path else cat.get('id', '')
-                result.append({
-                    'id': cat.get('id'),
-                    'name': cat.get('name'),
-                    'url': cat.get('url'),
-                    'path': current_path,
-                    'full_data': cat
-                })
-                if cat.get('children'):
-                    result.extend(get_all_categories_flat(cat['children'], current_path))
-            return result
-        
-        old_categories_flat = get_all_categories_flat(old_categories)
-        new_categories_flat = get_all_categories_flat(new_categories)
-        
-        # Створюємо словники для швидкого пошуку
-        old_by_id = {cat['id']: cat for cat in old_categories_flat if cat['id']}
-        old_by_url = {cat['url']: cat for cat in old_categories_flat if cat.get('url')}
-        old_by_name = {cat['name'].lower(): cat for cat in old_categories_flat if cat.get('name')}
-        
-        # Статистика змін
-        stats = {
-            'found': 0,  # Категорії знайдені (без змін)
-            'not_found': 0,  # Категорії не знайдені (потрібна ручна перевірка)
-            'new': 0,  # Нові категорії
-            'not_found_list': []  # Список незнайдених категорій
-        }
-        
-        def merge_categories(old_list, new_list):
-            """Рекурсивно об'єднує старі та нові категорії"""
-            result = []
-            
-            # Створюємо словник нових категорій для швидкого пошуку
-            new_by_id = {cat.get('id'): cat for cat in new_list if cat.get('id')}
-            
-            # Спочатку обробляємо старі категорії
-            for old_cat in old_list:
-                old_id = old_cat.get('id')
-                old_name = old_cat.get('name', '').lower()
-                old_url = old_cat.get('url', '')
-                
-                # Шукаємо відповідну нову категорію
-                found = False
-                if old_id and old_id in new_by_id:
-                    # Знайдено за ID
-                    new_cat = new_by_id[old_id]
-                    merged_cat = new_cat.copy()
-                    # Обробляємо дочірні категорії рекурсивно
-                    if old_cat.get('children') and new_cat.get('children'):
-                        merged_cat['children'] = merge_categories(old_cat['children'], new_cat['children'])
-                    elif old_cat.get('children'):
-                        # Старі дочірні категорії, але нових немає - позначаємо як незнайдені
-                        merged_cat['children'] = mark_not_found(old_cat['children'])
-                    else:
-                        merged_cat['children'] = new_cat.get('children', [])
-                    result.append(merged_cat)
-                    stats['found'] += 1
-                    found = True
-                elif old_url and old_url in old_by_url:
-                    # Шукаємо за URL
-                    for new_cat in new_list:
-                        if new_cat.get('url') == old_url:
-                            merged_cat = new_cat.copy()
-                            if old_cat.get('children') and new_cat.get('children'):
-                                merged_cat['children'] = merge_categories(old_cat['children'], new_cat['children'])
-                            elif old_cat.get('children'):
-                                merged_cat['children'] = mark_not_found(old_cat['children'])
-                            else:
-                                merged_cat['children'] = new_cat.get('children', [])
-                            result.append(merged_cat)
-                            stats['found'] += 1
-                            found = True
-                            break
-                elif old_name and old_name in old_by_name:
-                    # Шукаємо за назвою (менш надійно)
-                    for new_cat in new_list:
-                        if new_cat.get('name', '').lower() == old_name:
-                            merged_cat = new_cat.copy()
-                            if old_cat.get('children') and new_cat.get('children'):
-                                merged_cat['children'] = merge_categories(old_cat['children'], new_cat['children'])
-                            elif old_cat.get('children'):
-                                merged_cat['children'] = mark_not_found(old_cat['children'])
-                            else:
-                                merged_cat['children'] = new_cat.get('children', [])
-                            result.append(merged_cat)
-                            stats['found'] += 1
-                            found = True
-                            break
-                
-                if not found:
-                    # Категорія не знайдена - позначаємо для ручної перевірки
-                    not_found_cat = old_cat.copy()
-                    not_found_cat['needs_manual_check'] = True
-                    if old_cat.get('children'):
-                        not_found_cat['children'] = mark_not_found(old_cat['children'])
-                    result.append(not_found_cat)
-                    stats['not_found'] += 1
-                    stats['not_found_list'].append({
-                        'id': old_id,
-                        'name': old_cat.get('name'),
-                        'url': old_url
-                    })
-            
-            # Додаємо нові категорії, яких не було в старих
-            old_ids = {cat.get('id') for cat in old_list if cat.get('id')}
-            old_urls = {cat.get('url') for cat in old_list if cat.get('url')}
-            old_names = {cat.get('name', '').lower() for cat in old_list if cat.get('name')}
-            
-            for new_cat in new_list:
-                new_id = new_cat.get('id')
-                new_url = new_cat.get('url', '')
-                new_name = new_cat.get('name', '').lower()
-                
-                is_new = (
-                    (not new_id or new_id not in old_ids) and
-                    (not new_url or new_url not in old_urls) and
-                    (not new_name or new_name not in old_names)
-                )
-                
-                if is_new:
-                    # Це нова категорія
-                    merged_cat = new_cat.copy()
-                    if new_cat.get('children'):
-                        merged_cat['children'] = merge_categories([], new_cat['children'])
-                    result.append(merged_cat)
-                    stats['new'] += 1
-            
-            return result
-        
-        def mark_not_found(categories_list):
-            """Позначає категорії як незнайдені"""
-            result = []
-            for cat in categories_list:
-                not_found_cat = cat.copy()
-                not_found_cat['needs_manual_check'] = True
-                if cat.get('children'):
-                    not_found_cat['children'] = mark_not_found(cat['children'])
-                result.append(not_found_cat)
-                stats['not_found'] += 1
-                stats['not_found_list'].append({
-                    'id': cat.get('id'),
-                    'name': cat.get('name'),
-                    'url': cat.get('url')
-                })
-            return result
-        
-        # Об'єднуємо категорії
-        merged_categories = merge_categories(old_categories, new_categories)
+        # Порівнюємо та об'єднуємо дерева категорій (набір змін - для звіту користувачу)
+        merged_categories, changes = merge_category_trees(old_categories, new_categories)
         
         # Оновлюємо категорії конкурента
         competitor_data["categories"] = merged_categories
         competitor_data["last_parsed"] = datetime.now().isoformat()
         
-        await save_competitors(competitors_db)
+        await update_competitor_fields(competitor_id, {
+            "categories": competitor_data["categories"],
+            "last_parsed": competitor_data["last_parsed"],
+            "site_profile": competitor_data.get("site_profile")
+        })
         
         # Зберігаємо статистику в прогрес для відображення користувачу
+        missing = changes["missing"]
         stats_message = f"Оновлення завершено:\n"
-        stats_message += f"✓ Знайдено: {stats['found']} категорій\n"
-        stats_message += f"✗ Не знайдено (потрібна перевірка): {stats['not_found']} категорій\n"
-        stats_message += f"➕ Додано нових: {stats['new']} категорій"
+        stats_message += f"✓ Знайдено: {changes['matched']} категорій\n"
+        stats_message += f"✗ Не знайдено (потрібна перевірка): {len(missing)} категорій\n"
+        stats_message += f"➕ Додано нових: {len(changes['added'])} категорій\n"
+        stats_message += f"↪ Переміщено: {len(changes['moved'])} категорій\n"
+        stats_message += f"✎ Перейменовано: {len(changes['renamed'])} категорій"
         
-        if stats['not_found'] > 0:
+        if missing:
             stats_message += f"\n\nНезнайдені категорії (позначені для ручної перевірки):"
-            for nf in stats['not_found_list'][:10]:  # Показуємо перші 10
-                stats_message += f"\n- {nf.get('name', 'Без назви')} (ID: {nf.get('id', 'N/A')})"
-            if len(stats['not_found_list']) > 10:
-                stats_message += f"\n... та ще {len(stats['not_found_list']) - 10} категорій"
+            for nf in missing[:10]:  # Показуємо перші 10
+                stats_message += f"\n- {nf.get('name') or 'Без назви'} (ID: {nf.get('id') or 'N/A'})"
+            if len(missing) > 10:
+                stats_message += f"\n... та ще {len(missing) - 10} категорій"
         
         await update_task_progress(task_id, done=1, total=1, status="finished", error=stats_message)
         
-        logger.info(f"Оновлення категорій завершено: знайдено={stats['found']}, не знайдено={stats['not_found']}, нових={stats['new']}")
+        logger.info(
+            f"Оновлення категорій завершено: знайдено={changes['matched']}, не знайдено={len(missing)}, "
+            f"нових={len(changes['added'])}, переміщено={len(changes['moved'])}, перейменовано={len(changes['renamed'])}"
+        )
         
     except Exception as e:
         import traceback
@@ -1070,7 +1515,7 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
     """Асинхронна функція для пошуку товарів у вибраних категоріях"""
     from .gpt_client import GPTClient
     import uuid
-    from urllib.parse import urlsplit, urlunsplit
+    from urllib.parse import urlsplit
     
     logger.info(f"Початок discover_products: task_id={task_id}, competitor_id={competitor_id}, category_ids={category_ids}")
     
@@ -1100,21 +1545,6 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
         
         client = GPTClient(api_key_obj.key)
 
-        def normalize_url(url: Optional[str]) -> Optional[str]:
-            """Нормалізує URL: прибирає query/fragment та завершує без '/'."""
-            if not url:
-                return None
-            try:
-                url_str = str(url).strip()
-                if not url_str:
-                    return None
-                parts = urlsplit(url_str)
-                normalized = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
-                return normalized.rstrip("/") if normalized else None
-            except Exception:
-                # У випадку некоректного URL не валимо задачу, просто пропускаємо
-                return None
-
         # Збираємо всі URL категорій конкурента, щоб відфільтрувати випадки,
         # коли GPT повертає категорії замість товарів.
         category_urls: set = set()
@@ -1148,17 +1578,9 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
         total_categories = len(selected_categories)
         
         # Переконуємося, що задача ініціалізована в progress.json
-        progress = await load_progress()
-        if task_id not in progress["tasks"]:
+        if await get_task_status(task_id) is None:
             logger.warning(f"Задача {task_id} не знайдена в progress.json, створюємо...")
-            progress["tasks"][task_id] = {
-                "type": "discover_products",
-                "total": total_categories,
-                "done": 0,
-                "errors": [],
-                "status": "running"
-            }
-            await save_progress(progress)
+            await register_task(task_id, "discover_products", total=total_categories)
             logger.info(f"Задача {task_id} створена в progress.json")
         
         await update_task_progress(task_id, done=0, total=total_categories, status="running")
@@ -1189,8 +1611,18 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
                     continue
                 cleaned_products.append(p)
             if removed_category_like > 0:
-                db["products"] = cleaned_products
-                await save_db(db)
+                # Видаляємо на свіжій копії бази під блокуванням
+                async with _db_lock:
+                    db = await load_db()
+                    db["products"] = [
+                        p for p in db["products"]
+                        if not (
+                            p.get("from_category_discovery") is True
+                            and p.get("competitor_id") == competitor_id
+                            and normalize_url(p.get("url")) in category_urls
+                        )
+                    ]
+                    await save_db(db)
                 existing_urls = set()
                 for p in db.get("products", []):
                     u = normalize_url(p.get("url"))
@@ -1463,7 +1895,6 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
                             "competitor_id": competitor_id,
                             "category_path": category_path,
                             "from_category_discovery": True,
-                            "history": [],
                             "created_at": datetime.now().isoformat(),
                             "last_parsed_at": None
                         }
@@ -1497,9 +1928,15 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
         # Зберігаємо всі знайдені товари
         logger.info(f"Всього знайдено товарів для збереження: {len(all_products)}")
         if all_products:
-            initial_count = len(db["products"])
-            db["products"].extend(all_products)
-            await save_db(db)
+            # Пошук товарів тривав довго - додаємо їх до свіжої копії бази під блокуванням,
+            # щоб не перезаписати результати парсингу, збережені за цей час
+            async with _db_lock:
+                db = await load_db()
+                initial_count = len(db["products"])
+                saved_urls = {normalize_url(p.get("url")) for p in db["products"]}
+                all_products = [p for p in all_products if normalize_url(p.get("url")) not in saved_urls]
+                db["products"].extend(all_products)
+                await save_db(db)
             logger.info(f"Збережено {len(all_products)} нових товарів у базу даних (було: {initial_count}, стало: {len(db['products'])})")
             
             # Перевіряємо, чи товари дійсно збережені
@@ -1530,19 +1967,13 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
             error_summary = f"Оброблено {success_count} з {total_categories} категорій. Знайдено товарів: {products_count}"
             logger.warning(f"discover_products завершено з частковими помилками: {error_summary}")
             # Додаємо інформацію про кількість товарів у прогрес
-            progress = await load_progress()
-            if task_id in progress["tasks"]:
-                progress["tasks"][task_id]["products_found"] = products_count
-                await save_progress(progress)
+            await set_task_fields(task_id, products_found=products_count)
             await update_task_progress(task_id, status="finished")
         else:
             # Всі успішні
             logger.info(f"discover_products успішно завершено: знайдено {products_count} товарів")
             # Додаємо інформацію про кількість товарів у прогрес
-            progress = await load_progress()
-            if task_id in progress["tasks"]:
-                progress["tasks"][task_id]["products_found"] = products_count
-                await save_progress(progress)
+            await set_task_fields(task_id, products_found=products_count)
             await update_task_progress(task_id, status="finished")
         
         # Автоматично запускаємо парсинг нових товарів (якщо є товари)
@@ -1550,15 +1981,7 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
             try:
                 parse_task_id = str(uuid.uuid4())
                 # Ініціалізуємо прогрес для нової задачі
-                progress = await load_progress()
-                progress["tasks"][parse_task_id] = {
-                    "type": "parse_newly_discovered_products",
-                    "total": len(all_products),
-                    "done": 0,
-                    "errors": [],
-                    "status": "running"
-                }
-                await save_progress(progress)
+                await register_task(parse_task_id, "parse_newly_discovered_products", total=len(all_products))
                 
                 # Запускаємо фонову задачу
                 import asyncio
@@ -1577,7 +2000,7 @@ async def discover_products(task_id: str, competitor_id: str, category_ids: list
 async def parse_newly_discovered_products(task_id: str):
     """Асинхронна функція для парсингу нових знайдених товарів"""
     try:
-        db = await load_db()
+        db = await load_db_view()
         
         # Знаходимо всі товари, у яких name або price = null та from_category_discovery = true
         products_to_parse = [
@@ -1598,10 +2021,9 @@ async def parse_newly_discovered_products(task_id: str):
         
         for idx, product_data in enumerate(products_to_parse):
             try:
-                product = Product(**product_data)
-                # Виконуємо повний парсинг
-                parsed_data = await parse_product_full(product)
-                await save_result(product.id, parsed_data)
+                # Виконуємо повний парсинг (нові товари ще не парсились, вікно оновлення не потрібне)
+                # Якщо товар вже парсить інша задача, повторно його не отримуємо
+                await refresh_product(product_data, full=True, respect_window=False, buffered=True)
                 success_count += 1
                 await update_task_progress(task_id, done=idx + 1, total=total)
             except Exception as e:
@@ -1609,6 +2031,9 @@ async def parse_newly_discovered_products(task_id: str):
                 error_msg = f"Товар {product_data.get('name', product_data.get('id', 'unknown'))}: {str(e)}"
                 await update_task_progress(task_id, done=idx + 1, total=total, error=error_msg)
         
+        # Зберігаємо результати, що залишились у буфері відкладеного запису
+        await flush_pending_results()
+        
         # Визначаємо фінальний статус
         if error_count > 0 and success_count == 0:
             await update_task_progress(task_id, status="failed")
@@ -1625,30 +2050,25 @@ async def parse_newly_discovered_products(task_id: str):
 
 async def load_characteristics() -> Dict:
     """Завантажує базу даних характеристик (асинхронно)"""
-    try:
-        async with aiofiles.open(CHARACTERISTICS_FILE, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return json.loads(content)
-    except FileNotFoundError:
-        return {
-            "groups": [],
-            "characteristics": [],
-            "product_characteristics": {}  # {product_id: [CharacteristicValue]}
-        }
-    except Exception as e:
-        logger.error(f"Помилка завантаження характеристик: {e}")
-        return {
-            "groups": [],
-            "characteristics": [],
-            "product_characteristics": {}
-        }
+    return await read_json(CHARACTERISTICS_FILE, lambda: {
+        "groups": [],
+        "characteristics": [],
+        "product_characteristics": {}  # {product_id: [CharacteristicValue]}
+    })
+
+
+async def load_characteristics_view() -> Dict:
+    """Повертає базу характеристик з кешу тільки для читання"""
+    return await read_json_view(CHARACTERISTICS_FILE, lambda: {
+        "groups": [],
+        "characteristics": [],
+        "product_characteristics": {}
+    })
 
 
 async def save_characteristics(data: Dict):
     """Зберігає базу даних характеристик (асинхронно)"""
-    os.makedirs(os.path.dirname(CHARACTERISTICS_FILE), exist_ok=True)
-    async with aiofiles.open(CHARACTERISTICS_FILE, "w", encoding="utf-8") as f:
-        await f.write(json.dumps(data, ensure_ascii=False, indent=2))
+    await write_json_atomic(CHARACTERISTICS_FILE, data)
 
 
 async def get_characteristics_for_product(product_id: str, category_path: List[str] = None) -> List[Dict]:
@@ -1659,7 +2079,7 @@ async def get_characteristics_for_product(product_id: str, category_path: List[s
     2. Знаходимо характеристики, які належать до цих груп
     3. Також додаємо характеристики без груп, якщо вони відповідають категоріям товару
     """
-    characteristics_db = await load_characteristics()
+    characteristics_db = await load_characteristics_view()
     
     # Отримуємо всі характеристики та групи
     all_characteristics = characteristics_db.get("characteristics", [])
@@ -1838,7 +2258,8 @@ async def get_characteristics_for_product(product_id: str, category_path: List[s
     groups = characteristics_db.get("groups", [])
     groups_dict = {g["id"]: g for g in groups}
     
-    # Додаємо інформацію про групу до кожної характеристики
+    # Додаємо інформацію про групу до кожної характеристики (на копіях - документ з кешу незмінний)
+    all_characteristics = [dict(char) for char in all_characteristics]
     for char in all_characteristics:
         group_id = char.get("group_id")
         if group_id and group_id in groups_dict:
@@ -1858,7 +2279,7 @@ async def get_characteristics_for_product(product_id: str, category_path: List[s
 
 async def get_product_characteristic_values(product_id: str) -> Dict[str, Dict]:
     """Отримує значення характеристик для товару"""
-    characteristics_db = await load_characteristics()
+    characteristics_db = await load_characteristics_view()
     product_chars = characteristics_db.get("product_characteristics", {}).get(product_id, [])
     
     # Конвертуємо список у словник для зручності
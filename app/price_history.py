@@ -0,0 +1,283 @@
+"""
+Журнал історії цін та наявності.
+
+Спостереження (дата, ціна, наявність) зберігаються окремо від db.json:
+кожен товар має власний append-only файл NDJSON у HISTORY_DIR, а в записі
+товару залишаються тільки останні значення (price, availability, last_parsed_at).
+Завдяки цьому читання всього каталогу (список, фільтри, масові задачі) не
+розбирає та не переписує історію, а історія товару читається лише тоді,
+коли її запитують (сторінка товару, планувальник адаптивних оновлень).
+
+Журнал зберігає тільки зміни (run-length): незмінні спостереження підряд
+утворюють відрізок (run) - дата першого спостереження, ціна, наявність,
+час останнього підтвердження (last_confirmed_at), кількість спостережень (count)
+та зсуви повторних спостережень від дати відрізка (offsets, цілі секунди).
+- Новий рядок дописується в журнал лише тоді, коли ціна або наявність змінились.
+  Рядок відкриває новий відрізок і закриває попередній: у ньому зберігаються
+  previous_confirmed_at, previous_count та previous_offsets попереднього відрізка.
+- Поточний (відкритий) відрізок ведеться в записі товару (поле history_run);
+  повторне спостереження тих самих значень змінює тільки його. Щоб запис товару
+  не зростав, після MAX_RUN_OFFSETS повторів відкривається новий відрізок з тими
+  самими значеннями (один рядок журналу на MAX_RUN_OFFSETS спостережень).
+- load_history повертає відрізки, expand_history розгортає їх у повний ряд
+  спостережень. Для відрізків, записаних до появи offsets, відомі тільки
+  перше спостереження та останнє підтвердження.
+
+Повторний запис з датою, не новішою за останній рядок журналу (повторне
+застосування журналу відкладеного запису після збою), пропускається.
+"""
+import hashlib
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+import aiofiles
+
+from .storage import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+HISTORY_DIR = "app/db/history"
+# Скільки байтів з кінця файлу читається для пошуку останнього рядка
+_TAIL_READ_BYTES = 4096
+
+_SAFE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+# Найбільша кількість повторних спостережень у відкритому відрізку товару
+MAX_RUN_OFFSETS = 100
+
+
+def get_history_path(product_id: str) -> str:
+    """Шлях до журналу історії товару (небезпечні для імені файлу ID хешуються)"""
+    if _SAFE_ID_PATTERN.match(product_id):
+        name = product_id
+    else:
+        name = hashlib.sha1(product_id.encode("utf-8")).hexdigest()
+    return os.path.join(HISTORY_DIR, f"{name}.jsonl")
+
+
+def make_history_entry(date: str, price, availability) -> Dict:
+    """Запис історії: одне спостереження ціни та наявності"""
+    return {"date": date, "price": price, "availability": availability}
+
+
+def _same_values(left: Dict, right: Dict) -> bool:
+    return left.get("price") == right.get("price") and left.get("availability") == right.get("availability")
+
+
+def _offset_seconds(start: Optional[str], date: Optional[str]) -> Optional[int]:
+    """Зсув date від start у цілих секундах (None - дату не вдалося розібрати)"""
+    try:
+        return int((datetime.fromisoformat(date) - datetime.fromisoformat(start)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _add_confirmation(run: Dict, date: str):
+    """Враховує повторне спостереження у відрізку (час підтвердження, count, offsets)"""
+    offset = _offset_seconds(run.get("date"), date)
+    offsets = run.get("offsets")
+    if offset is not None and isinstance(offsets, list) and len(offsets) == run.get("count", 1) - 1:
+        run["offsets"] = offsets + [offset]
+    else:
+        # Зсуви неповні (відрізок старого формату) - ряд розгортається без них
+        run.pop("offsets", None)
+    run["last_confirmed_at"] = date
+    run["count"] = run.get("count", 1) + 1
+
+
+def record_observation(product: Dict, date: str, price, availability) -> Optional[Dict]:
+    """
+    Враховує спостереження у відкритому відрізку товару (поле history_run).
+    Якщо значення не змінились - оновлює тільки час підтвердження та лічильник і повертає None.
+    Інакше відкриває новий відрізок і повертає рядок, який потрібно дописати в журнал.
+    """
+    run = product.get("history_run")
+    observation = make_history_entry(date, price, availability)
+    if run and _same_values(run, observation):
+        if date <= (run.get("last_confirmed_at") or ""):
+            return None
+        if len(run.get("offsets") or ()) < MAX_RUN_OFFSETS:
+            _add_confirmation(run, date)
+            return None
+        # Відрізок досяг MAX_RUN_OFFSETS повторів - закриваємо його і відкриваємо новий з тими самими значеннями
+
+    entry = dict(observation)
+    if run:
+        entry["previous_confirmed_at"] = run.get("last_confirmed_at") or run.get("date")
+        entry["previous_count"] = run.get("count", 1)
+        if "offsets" in run:
+            entry["previous_offsets"] = list(run["offsets"])
+    product["history_run"] = {**observation, "last_confirmed_at": date, "count": 1, "offsets": []}
+    return entry
+
+
+async def _read_last_entry(path: str) -> Dict:
+    """Останній повний запис журналу (або {}, якщо журналу немає)"""
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            await f.seek(max(0, size - _TAIL_READ_BYTES))
+            tail = await f.read()
+    except FileNotFoundError:
+        return {}
+    for line in reversed(tail.splitlines()):
+        if not line.strip():
+            continue
+        try:
+            return loads(line)
+        except ValueError:
+            # Останній рядок міг бути записаний не повністю
+            continue
+    return {}
+
+
+async def append_history(product_id: str, entries: List[Dict]) -> int:
+    """
+    Дописує записи в журнал товару. Записи, не новіші за останній запис журналу,
+    пропускаються. Повертає кількість дописаних записів.
+    """
+    if not entries:
+        return 0
+    path = get_history_path(product_id)
+    last_date = (await _read_last_entry(path)).get("date") or ""
+    new_entries = [entry for entry in entries if (entry.get("date") or "") > last_date]
+    if not new_entries:
+        return 0
+
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    async with aiofiles.open(path, "ab") as f:
+        await f.write(b"".join(dumps(entry) + b"\n" for entry in new_entries))
+    return len(new_entries)
+
+
+async def append_history_batch(entries_by_product: Dict[str, List[Dict]]) -> int:
+    """Дописує записи історії кількох товарів (пакет відкладеного запису)"""
+    appended = 0
+    for product_id, entries in entries_by_product.items():
+        appended += await append_history(product_id, entries)
+    return appended
+
+
+def build_runs(entries: Iterable[Dict], open_run: Optional[Dict] = None) -> List[Dict]:
+    """
+    Будує відрізки з рядків журналу. open_run - відкритий відрізок із запису товару
+    (містить актуальні last_confirmed_at та count останнього відрізка).
+    Рядки старого формату (кожне спостереження окремо) з однаковими значеннями підряд
+    зливаються в один відрізок.
+    """
+    runs: List[Dict] = []
+    for entry in entries:
+        previous = runs[-1] if runs else None
+        if previous is not None and "previous_count" in entry:
+            previous["last_confirmed_at"] = entry.get("previous_confirmed_at") or previous["last_confirmed_at"]
+            previous["count"] = entry["previous_count"]
+            if "previous_offsets" in entry:
+                previous["offsets"] = list(entry["previous_offsets"])
+            else:
+                previous.pop("offsets", None)
+        elif previous is not None and _same_values(previous, entry):
+            _add_confirmation(previous, entry.get("date"))
+            continue
+        runs.append({
+            **make_history_entry(entry.get("date"), entry.get("price"), entry.get("availability")),
+            "last_confirmed_at": entry.get("date"),
+            "count": 1,
+            "offsets": []
+        })
+
+    if open_run and runs and runs[-1]["date"] == open_run.get("date"):
+        runs[-1]["last_confirmed_at"] = open_run.get("last_confirmed_at") or runs[-1]["last_confirmed_at"]
+        runs[-1]["count"] = open_run.get("count", runs[-1]["count"])
+        if isinstance(open_run.get("offsets"), list):
+            runs[-1]["offsets"] = list(open_run["offsets"])
+        else:
+            runs[-1].pop("offsets", None)
+    return runs
+
+
+def expand_history(runs: List[Dict]) -> List[Dict]:
+    """
+    Розгортає відрізки в повний ряд спостережень: перше спостереження відрізка
+    та кожне повторне (дата відрізка + offsets, останнє - точний last_confirmed_at).
+    Відрізки без повних offsets (старий формат) дають перше спостереження
+    та останнє підтвердження.
+    """
+    series = []
+    for run in runs:
+        series.append(make_history_entry(run["date"], run["price"], run["availability"]))
+        count = run.get("count", 1)
+        offsets = run.get("offsets")
+        last_confirmed_at = run.get("last_confirmed_at")
+        if isinstance(offsets, list) and offsets and len(offsets) == count - 1:
+            start = datetime.fromisoformat(run["date"])
+            for offset in offsets[:-1]:
+                date = (start + timedelta(seconds=offset)).isoformat()
+                series.append(make_history_entry(date, run["price"], run["availability"]))
+            series.append(make_history_entry(last_confirmed_at, run["price"], run["availability"]))
+        elif count > 1 and last_confirmed_at and last_confirmed_at != run["date"]:
+            series.append(make_history_entry(last_confirmed_at, run["price"], run["availability"]))
+    return series
+
+
+async def _read_entries(product_id: str) -> List[Dict]:
+    try:
+        async with aiofiles.open(get_history_path(product_id), "rb") as f:
+            content = await f.read()
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(loads(line))
+        except ValueError:
+            logger.warning(f"Пропущено пошкоджений запис історії товару {product_id}")
+    return entries
+
+
+async def load_history(product_id: str, open_run: Optional[Dict] = None) -> List[Dict]:
+    """Історія товару у вигляді відрізків незмінних значень (хронологічно)"""
+    return build_runs(await _read_entries(product_id), open_run)
+
+
+async def load_histories(products: Iterable[Dict]) -> Dict[str, List[Dict]]:
+    """Історія (відрізки) кількох товарів: product_id -> відрізки"""
+    return {
+        product["id"]: await load_history(product["id"], product.get("history_run"))
+        for product in products
+    }
+
+
+async def migrate_embedded_history(products: List[Dict]) -> List[str]:
+    """
+    Переносить історію, що зберігалась у записах товарів (поле history), у журнали
+    та заповнює відкритий відрізок (history_run) товарів, для яких він ще не ведеться.
+    Поле history видаляється із записів. Повертає ID змінених товарів
+    (збереження бази - у викликаючій функції).
+    """
+    changed_ids = []
+    for product in products:
+        product_id = product.get("id")
+        if "history" in product:
+            embedded = sorted(product.pop("history") or [], key=lambda entry: entry.get("date") or "")
+            entries = []
+            for entry in embedded:
+                if entry.get("date"):
+                    line = record_observation(product, entry["date"], entry.get("price"), entry.get("availability"))
+                    if line:
+                        entries.append(line)
+            if product_id and entries:
+                await append_history(product_id, entries)
+            changed_ids.append(product_id)
+        elif product_id and "history_run" not in product and product.get("last_parsed_at"):
+            # Журнал без відкритого відрізка (записаний до стиснення історії)
+            runs = await load_history(product_id)
+            if runs:
+                product["history_run"] = runs[-1]
+                changed_ids.append(product_id)
+    return changed_ids
@@ -0,0 +1,178 @@
+"""
+Адаптивна частота оновлення товарів.
+
+Для кожного товару за історією (журнал історії цін) оцінюється частота змін (ціна або наявність)
+на добу. Зміни моделюються як пуассонівський потік: якщо товар з частотою змін
+rate перевіряти fetches разів за горизонт планування, очікувана кількість
+виявлених змін дорівнює fetches * (1 - exp(-rate * horizon / fetches)).
+Функція увігнута за fetches, тому жадібний розподіл бюджету запитів
+(кожен наступний запит - товару з найбільшим приростом) максимізує кількість
+виявлених змін на витрачений запит/токен.
+"""
+import heapq
+import logging
+import math
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Горизонт планування (діб): бюджет розподіляється на цей період
+PLANNING_HORIZON_DAYS = 7
+# Кожен товар перевіряється не рідше ніж раз на стільки діб
+MAX_REFRESH_INTERVAL_DAYS = 7
+# І не частіше ніж раз на стільки хвилин
+MIN_REFRESH_INTERVAL_MINUTES = 60
+# Апріорна оцінка: PRIOR_CHANGES змін за PRIOR_DAYS діб (згладжує оцінку для товарів з короткою історією)
+PRIOR_CHANGES = 1.0
+PRIOR_DAYS = 7.0
+# Орієнтовна кількість токенів на один запит, якщо статистики ще немає
+DEFAULT_TOKENS_PER_FETCH = 3000
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def compute_change_stats(history: List[Dict]) -> Dict:
+    """
+    Рахує статистику змін за історією товару.
+    Зміна - це запис, у якому ціна або наявність відрізняються від попереднього
+    (зміна ціни та наявності в одному записі рахується як одна виявлена зміна).
+    """
+    observations = 0
+    changes = 0
+    price_changes = 0
+    availability_flips = 0
+    first_date = None
+    last_date = None
+    previous = None
+
+    for entry in history or []:
+        entry_date = _parse_date(entry.get("date"))
+        if entry_date is None:
+            continue
+        # Відрізок незмінних значень (журнал історії) враховує count спостережень до last_confirmed_at
+        observations += entry.get("count", 1)
+        confirmed_date = _parse_date(entry.get("last_confirmed_at")) or entry_date
+        if first_date is None or entry_date < first_date:
+            first_date = entry_date
+        if last_date is None or confirmed_date > last_date:
+            last_date = confirmed_date
+        if previous is not None:
+            price_changed = entry.get("price") != previous.get("price")
+            availability_changed = (entry.get("availability") or "").lower() != (previous.get("availability") or "").lower()
+            price_changes += price_changed
+            availability_flips += availability_changed
+            changes += price_changed or availability_changed
+        previous = entry
+
+    span_days = (last_date - first_date).total_seconds() / 86400 if first_date and last_date else 0.0
+    change_rate = (changes + PRIOR_CHANGES) / (span_days + PRIOR_DAYS)
+
+    return {
+        "observations": observations,
+        "changes": changes,
+        "price_changes": price_changes,
+        "availability_flips": availability_flips,
+        "span_days": round(span_days, 3),
+        "change_rate_per_day": change_rate
+    }
+
+
+def expected_detected_changes(change_rate_per_day: float, fetches: int, horizon_days: float = PLANNING_HORIZON_DAYS) -> float:
+    """Очікувана кількість виявлених змін за горизонт при fetches рівномірних перевірках"""
+    if fetches <= 0:
+        return 0.0
+    return fetches * (1 - math.exp(-change_rate_per_day * horizon_days / fetches))
+
+
+def allocate_refresh_intervals(change_rates: Dict[str, float], daily_fetch_budget: float,
+                               horizon_days: float = PLANNING_HORIZON_DAYS) -> Dict[str, float]:
+    """
+    Розподіляє бюджет запитів між товарами.
+    Повертає інтервал оновлення кожного товару в годинах.
+    """
+    if not change_rates:
+        return {}
+
+    horizon_hours = horizon_days * 24
+    min_fetches = max(1, math.ceil(horizon_days / MAX_REFRESH_INTERVAL_DAYS))
+    max_fetches = max(min_fetches, int(horizon_hours * 60 / MIN_REFRESH_INTERVAL_MINUTES))
+
+    fetches = {product_id: min_fetches for product_id in change_rates}
+    remaining = int(daily_fetch_budget * horizon_days) - min_fetches * len(change_rates)
+
+    # Купа з приростом очікуваних виявлених змін від ще одного запиту
+    heap = []
+    for product_id, rate in change_rates.items():
+        gain = expected_detected_changes(rate, min_fetches + 1, horizon_days) - expected_detected_changes(rate, min_fetches, horizon_days)
+        heapq.heappush(heap, (-gain, product_id))
+
+    while remaining > 0 and heap:
+        neg_gain, product_id = heapq.heappop(heap)
+        if -neg_gain <= 1e-9:
+            break
+        fetches[product_id] += 1
+        remaining -= 1
+        current = fetches[product_id]
+        if current < max_fetches:
+            rate = change_rates[product_id]
+            gain = expected_detected_changes(rate, current + 1, horizon_days) - expected_detected_changes(rate, current, horizon_days)
+            heapq.heappush(heap, (-gain, product_id))
+
+    return {product_id: horizon_hours / count for product_id, count in fetches.items()}
+
+
+def build_refresh_plan(products: List[Dict], daily_fetch_budget: float, now: Optional[datetime] = None,
+                       histories: Optional[Dict[str, List[Dict]]] = None) -> List[Dict]:
+    """
+    Будує план оновлення: для кожного товару - частота змін, інтервал та пріоритет.
+    Пріоритет - відношення часу з останнього парсингу до інтервалу (>= 1 - товар пора оновлювати).
+    histories - історія товарів з журналу історії (product_id -> записи).
+    Повертає список, відсортований за спаданням пріоритету.
+    """
+    now = now or datetime.now()
+    histories = histories or {}
+    stats_by_id = {p["id"]: compute_change_stats(histories.get(p["id"], [])) for p in products}
+    intervals = allocate_refresh_intervals(
+        {product_id: stats["change_rate_per_day"] for product_id, stats in stats_by_id.items()},
+        daily_fetch_budget
+    )
+
+    plan = []
+    for product in products:
+        product_id = product["id"]
+        interval_hours = intervals.get(product_id, PLANNING_HORIZON_DAYS * 24)
+        last_parsed = _parse_date(product.get("last_parsed_at"))
+        if last_parsed is None:
+            # Товари, які ще не парсились, оновлюємо першими
+            priority = float("inf")
+        else:
+            elapsed_hours = (now - last_parsed).total_seconds() / 3600
+            priority = elapsed_hours / interval_hours if interval_hours > 0 else float("inf")
+        plan.append({
+            "product_id": product_id,
+            "interval_hours": round(interval_hours, 3),
+            "priority": priority,
+            "due": priority >= 1,
+            **stats_by_id[product_id]
+        })
+
+    plan.sort(key=lambda item: item["priority"], reverse=True)
+    return plan
+
+
+def select_due_products(products: List[Dict], daily_fetch_budget: float, limit: int,
+                        now: Optional[datetime] = None,
+                        histories: Optional[Dict[str, List[Dict]]] = None) -> List[Dict]:
+    """Вибирає товари, яких пора оновлювати, у порядку пріоритету (не більше limit)"""
+    plan = build_refresh_plan(products, daily_fetch_budget, now, histories)
+    products_by_id = {p["id"]: p for p in products}
+    return [products_by_id[item["product_id"]] for item in plan if item["due"]][:max(0, limit)]
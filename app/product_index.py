@@ -0,0 +1,366 @@
+"""
+In-memory індекси товарів.
+
+Індекс будується з db.json один раз і далі оновлюється при кожному save_db:
+інкрементально, якщо відомо, які товари змінились, або повною перебудовою.
+Якщо файл змінено ззовні (сигнатура mtime/розмір не збігається), індекс
+перебудовується при наступному зверненні.
+
+Вторинні індекси (конкурент, статус, наявність, категорія, відсортована ціна)
+використовуються планувальником запитів select: спочатку береться найвибірковіша
+умова (найменша множина кандидатів), решта умов перевіряється тільки для неї.
+Повнотекстовий індекс назв та артикулів (search_index.SearchIndex) оновлюється
+разом з ними.
+
+Записи товарів в індексі спільні для всіх викликів, тому при додаванні в індекс
+вони заморожуються (storage.freeze, як документи read_json_view) - незалежно від
+того, чи індекс побудовано з кешу бази, чи оновлено після save_db. Для змін
+потрібна свіжа копія бази (load_db).
+"""
+import bisect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+from .search_index import SearchIndex
+from .storage import freeze
+
+
+def normalize_url(url: Optional[str]) -> Optional[str]:
+    """Нормалізує URL: прибирає query/fragment, приводить схему та домен до нижнього регістру, без завершального '/'"""
+    if not url:
+        return None
+    try:
+        url_str = str(url).strip()
+        if not url_str:
+            return None
+        parts = urlsplit(url_str)
+        normalized = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, "", ""))
+        return normalized.rstrip("/") if normalized else None
+    except Exception:
+        # Некоректний URL не індексується
+        return None
+
+
+# Поля вторинних індексів (рівність значення)
+SECONDARY_FIELDS = ("competitor_id", "status", "availability", "category")
+# Верхня межа для id у ключах (price, id) при пошуку діапазону цін
+_MAX_ID = "\U0010ffff"
+# Межі цінових інтервалів для підрахунку фасетів за замовчуванням
+DEFAULT_PRICE_EDGES = (100, 500, 1000, 5000, 10000, 50000)
+
+
+def _secondary_keys(product: Dict) -> Dict[str, Tuple]:
+    """Значення товару для кожного вторинного індексу"""
+    price = product.get("price")
+    return {
+        "competitor_id": (product.get("competitor_id"),),
+        "status": (product.get("status"),),
+        "availability": ((product.get("availability") or "").lower(),),
+        "category": tuple(set(product.get("category_path") or [])),
+        "price": (price,) if isinstance(price, (int, float)) and not isinstance(price, bool) else (),
+        "category_path": tuple(product.get("category_path") or ()),
+    }
+
+
+class ProductIndex:
+    """Індекси товарів за id, нормалізованим URL та last_parsed_at"""
+
+    def __init__(self):
+        self.signature: Optional[Tuple[int, int]] = None
+        self.by_id: Dict[str, Dict] = {}
+        # Нормалізований URL -> id товару (перший товар з таким URL)
+        self.by_url: Dict[str, str] = {}
+        # Позиція товару в списку db["products"] - для пошуку в свіжій копії бази без перебору
+        self._positions: Dict[str, int] = {}
+        # Відсортовані ключі (last_parsed_at, id); товари без парсингу мають "" і йдуть першими
+        self._last_parsed_keys: List[Tuple[str, str]] = []
+        self._last_parsed_by_id: Dict[str, str] = {}
+        # Вторинні індекси: поле -> значення -> множина id
+        self._secondary: Dict[str, Dict[Any, Set[str]]] = {field: {} for field in SECONDARY_FIELDS}
+        self._secondary_by_id: Dict[str, Dict[str, Tuple]] = {}
+        # Відсортовані ключі (price, id) товарів з числовою ціною
+        self._price_keys: List[Tuple[float, str]] = []
+        # Шляхи категорій товарів за конкурентом: competitor_id -> tuple(category_path) -> множина id
+        self._category_paths: Dict[Any, Dict[Tuple[str, ...], Set[str]]] = {}
+        # id у порядку db["products"] (None - потрібно перерахувати)
+        self._ordered_ids: Optional[List[str]] = None
+        # Повнотекстовий індекс назв та артикулів
+        self.text = SearchIndex()
+
+    def rebuild(self, products: List[Dict], signature: Optional[Tuple[int, int]] = None):
+        """Повністю перебудовує індекси за списком товарів"""
+        self.by_id = {}
+        self.by_url = {}
+        self._positions = {}
+        self._last_parsed_by_id = {}
+        self._secondary = {field: {} for field in SECONDARY_FIELDS}
+        self._secondary_by_id = {}
+        self._price_keys = []
+        self._category_paths = {}
+        self._ordered_ids = None
+        for position, product in enumerate(products):
+            product_id = product.get("id")
+            if not product_id:
+                continue
+            product = freeze(product)
+            self.by_id[product_id] = product
+            self._positions[product_id] = position
+            url = normalize_url(product.get("url"))
+            if url and url not in self.by_url:
+                self.by_url[url] = product_id
+            self._last_parsed_by_id[product_id] = product.get("last_parsed_at") or ""
+            self._index_secondary(product_id, product, sort_prices=False)
+        self._last_parsed_keys = sorted((key, product_id) for product_id, key in self._last_parsed_by_id.items())
+        self._price_keys.sort()
+        self.text.rebuild(self.by_id.values())
+        self.signature = signature
+
+    def update_product(self, product: Dict, position: Optional[int] = None):
+        """Оновлює індекси для одного товару (додавання або зміна); position - позиція в списку товарів"""
+        product_id = product.get("id")
+        if not product_id:
+            return
+        product = freeze(product)
+        previous = self.by_id.get(product_id)
+        self.by_id[product_id] = product
+        if previous is None:
+            self._ordered_ids = None
+        if position is not None:
+            self._positions[product_id] = position
+        self._update_url(product_id, previous.get("url") if previous else None, product.get("url"))
+        self._unindex_secondary(product_id)
+        self._index_secondary(product_id, product)
+        self.text.update(product_id, product)
+        new_key = product.get("last_parsed_at") or ""
+        old_key = self._last_parsed_by_id.get(product_id)
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            self._remove_key(old_key, product_id)
+        bisect.insort(self._last_parsed_keys, (new_key, product_id))
+        self._last_parsed_by_id[product_id] = new_key
+
+    def remove_product(self, product_id: str):
+        """Видаляє товар з індексів"""
+        previous = self.by_id.pop(product_id, None)
+        self._positions.pop(product_id, None)
+        self._ordered_ids = None
+        if previous:
+            self._update_url(product_id, previous.get("url"), None)
+        self._unindex_secondary(product_id)
+        self.text.remove(product_id)
+        old_key = self._last_parsed_by_id.pop(product_id, None)
+        if old_key is not None:
+            self._remove_key(old_key, product_id)
+
+    def _update_url(self, product_id: str, old_url: Optional[str], new_url: Optional[str]):
+        old_url, new_url = normalize_url(old_url), normalize_url(new_url)
+        if old_url == new_url:
+            if new_url and new_url not in self.by_url:
+                self.by_url[new_url] = product_id
+            return
+        if old_url and self.by_url.get(old_url) == product_id:
+            del self.by_url[old_url]
+        if new_url and new_url not in self.by_url:
+            self.by_url[new_url] = product_id
+
+    def _index_secondary(self, product_id: str, product: Dict, sort_prices: bool = True):
+        keys = _secondary_keys(product)
+        self._secondary_by_id[product_id] = keys
+        for field in SECONDARY_FIELDS:
+            for value in keys[field]:
+                self._secondary[field].setdefault(value, set()).add(product_id)
+        for price in keys["price"]:
+            if sort_prices:
+                bisect.insort(self._price_keys, (price, product_id))
+            else:
+                self._price_keys.append((price, product_id))
+        if keys["category_path"]:
+            paths = self._category_paths.setdefault(keys["competitor_id"][0], {})
+            paths.setdefault(keys["category_path"], set()).add(product_id)
+
+    def _unindex_secondary(self, product_id: str):
+        keys = self._secondary_by_id.pop(product_id, None)
+        if not keys:
+            return
+        for field in SECONDARY_FIELDS:
+            for value in keys[field]:
+                ids = self._secondary[field].get(value)
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del self._secondary[field][value]
+        for price in keys["price"]:
+            position = bisect.bisect_left(self._price_keys, (price, product_id))
+            if position < len(self._price_keys) and self._price_keys[position] == (price, product_id):
+                del self._price_keys[position]
+        if keys["category_path"]:
+            paths = self._category_paths.get(keys["competitor_id"][0], {})
+            ids = paths.get(keys["category_path"])
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del paths[keys["category_path"]]
+
+    def _ordered(self) -> List[str]:
+        if self._ordered_ids is None:
+            self._ordered_ids = sorted(self.by_id, key=lambda product_id: self._positions.get(product_id, 0))
+        return self._ordered_ids
+
+    def select(self, equals: Optional[Dict[str, Iterable]] = None, price_from: Optional[float] = None,
+               price_to: Optional[float] = None, predicate: Optional[Callable[[Dict], bool]] = None,
+               ranked_ids: Optional[List[str]] = None,
+               id_sets: Optional[List[Set[str]]] = None) -> List[Dict]:
+        """
+        Вибирає товари за умовами (у порядку db["products"]).
+        equals - поле вторинного індексу -> допустимі значення (будь-яке з них),
+        price_from / price_to - діапазон цін (включно), predicate - довільна перевірка
+        (застосовується тільки до кандидатів, що пройшли індексовані умови),
+        ranked_ids - допустимі ID у потрібному порядку (результат повнотекстового
+        пошуку); якщо задані, результат впорядковується за ними,
+        id_sets - множини id, товар має входити хоча б в одну з них.
+        Планувальник оцінює кількість кандидатів кожної умови та починає з найменшої.
+        """
+        conditions = []
+        if ranked_ids is not None:
+            conditions.append((len(ranked_ids), "set", [set(ranked_ids)]))
+        if id_sets is not None:
+            conditions.append((sum(len(ids) for ids in id_sets), "set", id_sets))
+        for field, values in (equals or {}).items():
+            value_sets = [self._secondary[field].get(value, set()) for value in dict.fromkeys(values)]
+            conditions.append((sum(len(ids) for ids in value_sets), "set", value_sets))
+        if price_from is not None or price_to is not None:
+            low = bisect.bisect_left(self._price_keys, (price_from, "")) if price_from is not None else 0
+            high = (bisect.bisect_right(self._price_keys, (price_to, _MAX_ID))
+                    if price_to is not None else len(self._price_keys))
+            conditions.append((max(0, high - low), "price", (low, high)))
+
+        if not conditions:
+            candidate_ids: Iterable[str] = self._ordered()
+        else:
+            conditions.sort(key=lambda condition: condition[0])
+            _, kind, data = conditions[0]
+            if kind == "set":
+                candidates = set().union(*data) if len(data) > 1 else set(data[0]) if data else set()
+            else:
+                candidates = {product_id for _, product_id in self._price_keys[data[0]:data[1]]}
+            for _, kind, data in conditions[1:]:
+                if not candidates:
+                    break
+                if kind == "set":
+                    candidates = {product_id for product_id in candidates if any(product_id in ids for ids in data)}
+                else:
+                    candidates = {product_id for product_id in candidates if self._in_price_range(product_id, price_from, price_to)}
+            if ranked_ids is not None:
+                candidate_ids = [product_id for product_id in ranked_ids if product_id in candidates]
+            else:
+                candidate_ids = sorted(candidates, key=lambda product_id: self._positions.get(product_id, 0))
+
+        products = (self.by_id[product_id] for product_id in candidate_ids)
+        if predicate is None:
+            return list(products)
+        return [product for product in products if predicate(product)]
+
+    def facet_counts(self, products: Optional[List[Dict]] = None,
+                     price_edges: Iterable[float] = DEFAULT_PRICE_EDGES) -> Dict[str, Any]:
+        """
+        Кількість товарів за значеннями вторинних індексів та за ціновими інтервалами.
+        products - вибірка (None - весь каталог: лічильники беруться з розмірів множин індексу);
+        інакше вибірка проходиться один раз з уже проіндексованими значеннями кожного товару.
+        Цінові інтервали - [edge_i, edge_i+1), перший - до найменшої межі, останній - без верхньої межі.
+        """
+        edges = sorted(set(price_edges))
+        price_counts = [0] * (len(edges) + 1)
+        if products is None:
+            counts = {field: {value: len(ids) for value, ids in values.items()} for field, values in self._secondary.items()}
+            low = 0
+            for position, edge in enumerate(edges):
+                high = bisect.bisect_left(self._price_keys, (edge, ""))
+                price_counts[position] = high - low
+                low = high
+            price_counts[-1] = len(self._price_keys) - low
+        else:
+            counts = {field: {} for field in SECONDARY_FIELDS}
+            for product in products:
+                keys = self._secondary_by_id.get(product.get("id"))
+                if keys is None:
+                    continue
+                for field in SECONDARY_FIELDS:
+                    field_counts = counts[field]
+                    for value in keys[field]:
+                        field_counts[value] = field_counts.get(value, 0) + 1
+                for price in keys["price"]:
+                    price_counts[bisect.bisect_right(edges, price)] += 1
+
+        bounds = [None] + edges + [None]
+        counts["price"] = [
+            {"from": bounds[position], "to": bounds[position + 1], "count": count}
+            for position, count in enumerate(price_counts) if count
+        ]
+        return counts
+
+    def category_ids(self, name: str) -> Set[str]:
+        """ID товарів, у яких category_path містить назву категорії (тільки для читання)"""
+        return self._secondary["category"].get(name, set())
+
+    def category_paths(self, competitor_id: str) -> Dict[Tuple[str, ...], Set[str]]:
+        """Шляхи категорій товарів конкурента: tuple(category_path) -> множина id (тільки для читання)"""
+        return self._category_paths.get(competitor_id, {})
+
+    def search(self, query: str) -> Optional[List[Tuple[str, float]]]:
+        """Повнотекстовий пошук за назвою та артикулом: [(product_id, релевантність)] або None для порожнього запиту"""
+        return self.text.search(query)
+
+    def _in_price_range(self, product_id: str, price_from: Optional[float], price_to: Optional[float]) -> bool:
+        prices = self._secondary_by_id.get(product_id, {}).get("price") or ()
+        if not prices:
+            return False
+        price = prices[0]
+        return (price_from is None or price >= price_from) and (price_to is None or price <= price_to)
+
+    def get(self, product_id: str) -> Optional[Dict]:
+        """Товар за id"""
+        return self.by_id.get(product_id)
+
+    def find_by_url(self, url: Optional[str]) -> Optional[Dict]:
+        """Товар за URL (порівняння нормалізованих URL)"""
+        product_id = self.by_url.get(normalize_url(url) or "")
+        return self.by_id.get(product_id) if product_id else None
+
+    def position(self, product_id: str) -> Optional[int]:
+        """Позиція товару в списку db["products"] на момент останнього збереження"""
+        return self._positions.get(product_id)
+
+    def _remove_key(self, key: str, product_id: str):
+        position = bisect.bisect_left(self._last_parsed_keys, (key, product_id))
+        if position < len(self._last_parsed_keys) and self._last_parsed_keys[position] == (key, product_id):
+            del self._last_parsed_keys[position]
+
+    def apply_saved(self, products: List[Dict], changed_ids: Optional[List[str]], signature: Optional[Tuple[int, int]]):
+        """
+        Синхронізує індекси після збереження бази.
+        Якщо changed_ids відомі - оновлює тільки ці товари, інакше перебудовує все.
+        """
+        if changed_ids is None or self.signature is None:
+            self.rebuild(products, signature)
+            return
+
+        changed = set(changed_ids)
+        found = set()
+        for position, product in enumerate(products):
+            product_id = product.get("id")
+            if product_id in changed:
+                self.update_product(product, position)
+                found.add(product_id)
+                if len(found) == len(changed):
+                    break
+        if changed - found:
+            # Товари видалено - позиції решти зсунулись, перебудовуємо індекси
+            self.rebuild(products, signature)
+            return
+        self.signature = signature
+
+    def stale_ids(self, before: str) -> List[str]:
+        """ID товарів, у яких last_parsed_at раніше за before (ISO), включно з товарами без парсингу"""
+        position = bisect.bisect_left(self._last_parsed_keys, (before, ""))
+        return [product_id for _, product_id in self._last_parsed_keys[:position]]
@@ -0,0 +1,135 @@
+"""
+Сортування, пагінація та проекція полів списку товарів (/products/list).
+
+Сортування: ключ з SORT_KEYS, "-" на початку - за спаданням. Товари без
+значення ключа завжди йдуть у кінці (за ID), незалежно від напрямку.
+Без ключа зберігається порядок вибірки (порядок бази або релевантність пошуку).
+
+Пагінація - курсорна: курсор кодує позицію останнього товару сторінки
+(значення ключа сортування та ID), тому наступна сторінка починається одразу
+після нього, навіть якщо між запитами товари були додані або змінені.
+Курсор прив'язаний до ключа сортування; без сортування він містить позицію у вибірці.
+Для сторінки з limit товари після курсора не сортуються повністю: heapq вибирає
+limit + 1 перших (O(n log limit) замість O(n log n)).
+"""
+import base64
+import heapq
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .storage import dumps, loads
+
+# Ключ сортування -> функція значення (None - значення немає)
+SORT_KEYS: Dict[str, Callable[[Dict, Dict[str, str]], Any]] = {
+    "price": lambda product, _: (
+        float(product["price"]) if isinstance(product.get("price"), (int, float)) else None
+    ),
+    "last_parsed_at": lambda product, _: product.get("last_parsed_at") or None,
+    "name": lambda product, _: (product.get("name") or product.get("name_parsed") or "").lower() or None,
+    "competitor": lambda product, competitor_names: (
+        (competitor_names.get(product.get("competitor_id")) or product.get("competitor_name") or "").lower() or None
+    ),
+}
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[Optional[str], bool]:
+    """Ключ сортування та ознака спадання ("-price" -> ("price", True)). ValueError - невідомий ключ"""
+    if not sort:
+        return None, False
+    descending = sort.startswith("-")
+    key = sort.lstrip("-+")
+    if key not in SORT_KEYS:
+        raise ValueError(f"Невідомий ключ сортування: {key}. Доступні: {', '.join(SORT_KEYS)}")
+    return key, descending
+
+
+def encode_cursor(sort: Optional[str], position: List) -> str:
+    return base64.urlsafe_b64encode(dumps([sort, position])).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: Optional[str]) -> List:
+    """Позиція з курсора. ValueError - курсор пошкоджений або створений для іншого сортування"""
+    try:
+        cursor_sort, position = loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Некоректний курсор")
+    if cursor_sort != sort or not isinstance(position, list):
+        raise ValueError("Курсор створено для іншого сортування")
+    return position
+
+
+def _present_key(item: Tuple[Any, str, Dict]) -> Tuple[Any, str]:
+    return item[0], item[1]
+
+
+def _missing_key(item: Tuple[str, Dict]) -> str:
+    return item[0]
+
+
+def paginate_products(products: List[Dict], sort: Optional[str] = None, cursor: Optional[str] = None,
+                      limit: Optional[int] = None,
+                      competitor_names: Optional[Dict[str, str]] = None) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Сортує вибірку та повертає сторінку після курсора і курсор наступної сторінки
+    (None - сторінка остання). Без limit повертаються всі товари після курсора.
+    """
+    key, descending = parse_sort(sort)
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    if key is None:
+        start = after[0] + 1 if after and isinstance(after[0], int) else 0
+        page = products[start:start + limit] if limit is not None else products[start:]
+        end = start + len(page)
+        next_cursor = encode_cursor(sort, [end - 1]) if limit is not None and end < len(products) else None
+        return page, next_cursor
+
+    get_value = SORT_KEYS[key]
+    names = competitor_names or {}
+    present: List[Tuple[Any, str, Dict]] = []
+    missing: List[Tuple[str, Dict]] = []
+    for product in products:
+        value = get_value(product, names)
+        if value is None:
+            missing.append((product.get("id") or "", product))
+        else:
+            present.append((value, product.get("id") or "", product))
+
+    # Позиція курсора: [1, значення, id] - серед товарів зі значенням, [0, id] - серед товарів без нього
+    if after:
+        try:
+            if after[0] == 1 and len(after) == 3:
+                position = (after[1], after[2])
+                present = [
+                    item for item in present
+                    if ((item[0], item[1]) < position if descending else (item[0], item[1]) > position)
+                ]
+            elif after[0] == 0 and len(after) == 2:
+                present = []
+                missing = [item for item in missing if item[0] > after[1]]
+        except TypeError:
+            raise ValueError("Некоректний курсор")
+
+    # Для сторінки потрібні тільки limit + 1 перших товарів після курсора - вибірка через heapq
+    # замість сортування всієї вибірки на кожен запит
+    if limit is None:
+        present.sort(key=_present_key, reverse=descending)
+        missing.sort(key=_missing_key)
+    else:
+        present = (heapq.nlargest if descending else heapq.nsmallest)(limit + 1, present, key=_present_key)
+        missing = heapq.nsmallest(max(0, limit + 1 - len(present)), missing, key=_missing_key)
+
+    ordered = [(1, item[0], item[1], item[2]) for item in present]
+    ordered += [(0, None, item[0], item[1]) for item in missing]
+    page_items = ordered[:limit] if limit is not None else ordered
+    next_cursor = None
+    if limit is not None and len(ordered) > len(page_items):
+        flag, value, product_id, _ = page_items[-1]
+        next_cursor = encode_cursor(sort, [1, value, product_id] if flag else [0, product_id])
+    return [item[3] for item in page_items], next_cursor
+
+
+def project_fields(products: List[Dict], fields: Optional[str]) -> List[Dict]:
+    """Залишає в записах тільки перелічені через кому поля (id - завжди)"""
+    if not fields:
+        return products
+    names = ["id"] + [name for name in dict.fromkeys(field.strip() for field in fields.split(",")) if name and name != "id"]
+    return [{name: product[name] for name in names if name in product} for product in products]
@@ -0,0 +1,164 @@
+"""
+Логи операцій з товарами (парсинг, регенерація та тест правил).
+
+Логи зберігаються окремо від db.json: кожен товар має власний обмежений
+кільцевий буфер - файл NDJSON у PRODUCT_LOGS_DIR, з якого читаються
+останні PRODUCT_LOG_LIMIT записів. Новий запис дописується в кінець файлу;
+коли в файлі накопичується вдвічі більше записів, ніж ліміт, файл атомарно
+перезаписується останніми PRODUCT_LOG_LIMIT записами (амортизовано O(1) на запис,
+розмір файлу обмежений).
+
+Додатково всі записи можуть дублюватися в глобальний журнал операцій
+(GLOBAL_LOG_FILE) з ротацією за розміром (logging.handlers.RotatingFileHandler).
+"""
+import asyncio
+import logging
+import logging.handlers
+import os
+import uuid
+from typing import Dict, List, Optional
+
+import aiofiles
+
+from .price_history import get_history_path
+from .storage import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+
+PRODUCT_LOGS_DIR = "app/db/logs"
+# Скільки останніх записів логу зберігається для кожного товару
+PRODUCT_LOG_LIMIT = 100
+
+# Глобальний журнал операцій усіх товарів (None - вимкнено)
+GLOBAL_LOG_FILE: Optional[str] = "app/db/operations.log"
+GLOBAL_LOG_MAX_BYTES = 5 * 1024 * 1024
+GLOBAL_LOG_BACKUP_COUNT = 3
+
+# Кількість записів у файлі логу товару: product_id -> кількість (для визначення моменту стиснення)
+_line_counts: Dict[str, int] = {}
+_log_locks: Dict[str, asyncio.Lock] = {}
+_global_logger: Optional[logging.Logger] = None
+
+
+def get_log_path(product_id: str) -> str:
+    """Шлях до кільцевого буфера логів товару (ім'я файлу - як у журналу історії)"""
+    return os.path.join(PRODUCT_LOGS_DIR, os.path.basename(get_history_path(product_id)))
+
+
+def _get_log_lock(product_id: str) -> asyncio.Lock:
+    lock = _log_locks.get(product_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _log_locks[product_id] = lock
+    return lock
+
+
+def _get_global_logger() -> Optional[logging.Logger]:
+    """Логер глобального журналу операцій з ротацією (створюється при першому записі)"""
+    global _global_logger
+    if GLOBAL_LOG_FILE is None:
+        return None
+    if _global_logger is None:
+        os.makedirs(os.path.dirname(GLOBAL_LOG_FILE), exist_ok=True)
+        handler = logging.handlers.RotatingFileHandler(
+            GLOBAL_LOG_FILE, maxBytes=GLOBAL_LOG_MAX_BYTES, backupCount=GLOBAL_LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        operations_logger = logging.getLogger(f"{__name__}.operations")
+        operations_logger.setLevel(logging.INFO)
+        operations_logger.propagate = False
+        operations_logger.addHandler(handler)
+        _global_logger = operations_logger
+    return _global_logger
+
+
+async def _read_entries(path: str) -> List[Dict]:
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            content = await f.read()
+    except FileNotFoundError:
+        return []
+
+    entries = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(loads(line))
+        except ValueError:
+            # Останній рядок міг бути записаний не повністю
+            continue
+    return entries
+
+
+async def _rewrite(path: str, entries: List[Dict]):
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    async with aiofiles.open(temp_path, "wb") as f:
+        await f.write(b"".join(dumps(entry) + b"\n" for entry in entries))
+    os.replace(temp_path, path)
+
+
+async def append_logs(product_id: str, entries: List[Dict]):
+    """Додає записи в кільцевий буфер логів товару (та в глобальний журнал, якщо він увімкнений)"""
+    if not entries:
+        return
+    path = get_log_path(product_id)
+    async with _get_log_lock(product_id):
+        count = _line_counts.get(product_id)
+        if count is None:
+            count = len(await _read_entries(path))
+
+        os.makedirs(PRODUCT_LOGS_DIR, exist_ok=True)
+        async with aiofiles.open(path, "ab") as f:
+            await f.write(b"".join(dumps(entry) + b"\n" for entry in entries))
+        count += len(entries)
+
+        if count > 2 * PRODUCT_LOG_LIMIT:
+            kept = (await _read_entries(path))[-PRODUCT_LOG_LIMIT:]
+            await _rewrite(path, kept)
+            count = len(kept)
+        _line_counts[product_id] = count
+
+    global_logger = _get_global_logger()
+    if global_logger is not None:
+        for entry in entries:
+            global_logger.info(dumps({"product_id": product_id, **entry}).decode("utf-8"))
+
+
+async def append_log(product_id: str, entry: Dict):
+    """Додає один запис у лог товару"""
+    await append_logs(product_id, [entry])
+
+
+async def load_logs(product_id: str, limit: Optional[int] = None) -> List[Dict]:
+    """Останні записи логу товару (не більше PRODUCT_LOG_LIMIT), у хронологічному порядку"""
+    limit = PRODUCT_LOG_LIMIT if limit is None else min(max(0, limit), PRODUCT_LOG_LIMIT)
+    if limit == 0:
+        return []
+    return (await _read_entries(get_log_path(product_id)))[-limit:]
+
+
+async def migrate_embedded_logs(products: List[Dict]) -> List[str]:
+    """
+    Переносить логи, що зберігались у записах товарів (поле logs), у кільцеві буфери.
+    Поле logs видаляється із записів. Повертає ID змінених товарів
+    (збереження бази - у викликаючій функції).
+    """
+    changed_ids = []
+    for product in products:
+        if "logs" not in product:
+            continue
+        embedded = product.pop("logs") or []
+        if embedded and product.get("id"):
+            path = get_log_path(product["id"])
+            existing = await _read_entries(path)
+            known_dates = {entry.get("date") for entry in existing}
+            entries = [entry for entry in embedded if entry.get("date") not in known_dates]
+            if entries:
+                os.makedirs(PRODUCT_LOGS_DIR, exist_ok=True)
+                kept = sorted(existing + entries, key=lambda entry: entry.get("date") or "")[-PRODUCT_LOG_LIMIT:]
+                await _rewrite(path, kept)
+                _line_counts[product["id"]] = len(kept)
+        changed_ids.append(product.get("id"))
+    return changed_ids
@@ -0,0 +1,336 @@
+"""
+Планувальник регулярних оновлень цін та наявності.
+
+Розклади зберігаються у schedules.json. Кожен розклад має cron-вираз
+(хвилина, година, день місяця, місяць, день тижня) та вибірку товарів
+(конкурент та/або категорії). Під час запуску товари рівномірно
+розподіляються по вікну оновлення, а кількість одночасних запитів
+обмежується налаштуванням concurrency розкладу та глобальним лімітом.
+"""
+import asyncio
+import logging
+import math
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from .parser import (
+    load_schedules, load_schedules_view, save_schedules, select_filtered_products, refresh_product, flush_pending_results,
+    register_task, update_task_progress, SCHEDULES_FILE,
+    make_task_signature, claim_task, release_task, run_coalesced_task, load_settings
+)
+from .storage import get_store_lock
+from .price_history import load_histories
+from .prioritizer import select_due_products, DEFAULT_TOKENS_PER_FETCH
+from .token_usage import get_average_tokens_per_request
+
+logger = logging.getLogger(__name__)
+
+
+# Як часто планувальник перевіряє, чи настав час запуску
+SCHEDULER_TICK_SECONDS = 30
+# Глобальний ліміт одночасних запитів для всіх розкладів
+SCHEDULER_MAX_CONCURRENCY = 4
+# Частка інтервалу до наступного запуску, по якій розподіляються запити
+SPREAD_WINDOW_RATIO = 0.9
+
+
+class CronExpression:
+    """Cron-вираз з п'яти полів: хвилина, година, день місяця, місяць, день тижня"""
+
+    def __init__(self, expression: str):
+        parts = (expression or "").split()
+        if len(parts) != 5:
+            raise ValueError("Cron-вираз має містити 5 полів: хвилина година день_місяця місяць день_тижня")
+
+        self.expression = " ".join(parts)
+        self.minutes = self._parse_field(parts[0], 0, 59)
+        self.hours = self._parse_field(parts[1], 0, 23)
+        self.days = self._parse_field(parts[2], 1, 31)
+        self.months = self._parse_field(parts[3], 1, 12)
+        # 0 і 7 - неділя
+        self.weekdays = {0 if d == 7 else d for d in self._parse_field(parts[4], 0, 7)}
+        self.days_restricted = parts[2] != "*"
+        self.weekdays_restricted = parts[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        """Розбирає поле cron: *, */n, a, a-b, a-b/n, a/n та списки через кому"""
+        values: Set[int] = set()
+        for part in field.split(","):
+            step = 1
+            has_step = "/" in part
+            if has_step:
+                part, step_str = part.split("/", 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Некоректний крок у полі cron: {field}")
+
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_str, end_str = part.split("-", 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(part)
+                end = high if has_step else start
+
+            if start < low or end > high or start > end:
+                raise ValueError(f"Значення поза діапазоном {low}-{high} у полі cron: {field}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime) -> bool:
+        """Перевіряє день (як у cron: якщо обмежені і день місяця, і день тижня - достатньо одного)"""
+        day_match = dt.day in self.days
+        weekday_match = (dt.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        if self.days_restricted:
+            return day_match
+        if self.weekdays_restricted:
+            return weekday_match
+        return True
+
+    def next_after(self, dt: datetime) -> datetime:
+        """Повертає найближчий час запуску строго після dt"""
+        candidate = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                # Переходимо на перше число наступного місяця
+                first_day = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (first_day + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"Cron-вираз '{self.expression}' не має жодного запуску")
+
+
+def get_next_run(schedule: Dict) -> Optional[datetime]:
+    """Обчислює час наступного запуску розкладу (відносно останнього запуску або створення)"""
+    try:
+        cron = CronExpression(schedule.get("cron", ""))
+        base = schedule.get("last_run_at") or schedule.get("created_at")
+        base_dt = datetime.fromisoformat(base) if base else datetime.now()
+        return cron.next_after(base_dt)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Некоректний розклад {schedule.get('id')}: {e}")
+        return None
+
+
+def describe_schedule(schedule: Dict) -> Dict:
+    """Повертає розклад разом з часом наступного запуску (для API)"""
+    next_run = get_next_run(schedule) if schedule.get("active", True) else None
+    result = dict(schedule)
+    result["next_run_at"] = next_run.isoformat() if next_run else None
+    return result
+
+
+def get_spread_seconds(schedule: Dict, now: datetime) -> float:
+    """Вікно, по якому рівномірно розподіляються запити одного запуску"""
+    if schedule.get("spread_minutes") is not None:
+        return max(0, schedule["spread_minutes"]) * 60
+    try:
+        next_run = CronExpression(schedule.get("cron", "")).next_after(now)
+        return (next_run - now).total_seconds() * SPREAD_WINDOW_RATIO
+    except ValueError:
+        return 0
+
+
+def get_run_interval_seconds(schedule: Dict, now: datetime) -> float:
+    """Інтервал між поточним та наступним запуском розкладу"""
+    try:
+        next_run = CronExpression(schedule.get("cron", "")).next_after(now)
+        return (next_run - now).total_seconds()
+    except ValueError:
+        return 0
+
+
+async def resolve_daily_fetch_budget(schedule: Dict) -> float:
+    """
+    Бюджет запитів на добу для адаптивного розкладу.
+    Бюджет токенів переводиться в запити за середнім споживанням токенів активного ключа.
+    """
+    if schedule.get("daily_fetch_budget"):
+        return float(schedule["daily_fetch_budget"])
+    if schedule.get("daily_token_budget"):
+        settings = await load_settings()
+        tokens_per_fetch = None
+        if settings.current_key:
+            tokens_per_fetch = await get_average_tokens_per_request(settings.current_key)
+        return schedule["daily_token_budget"] / (tokens_per_fetch or DEFAULT_TOKENS_PER_FETCH)
+    return 0.0
+
+
+async def select_adaptive_batch(schedule: Dict, products: List[Dict], now: datetime) -> List[Dict]:
+    """Вибирає товари для поточного запуску адаптивного розкладу в межах його частки добового бюджету"""
+    daily_budget = await resolve_daily_fetch_budget(schedule)
+    run_share = get_run_interval_seconds(schedule, now) / 86400
+    limit = math.ceil(daily_budget * run_share)
+    histories = await load_histories(products)
+    return select_due_products(products, daily_budget, limit, now, histories)
+
+
+class RefreshScheduler:
+    """Фоновий цикл, що запускає оновлення за розкладами"""
+
+    def __init__(self):
+        self._loop_task: Optional[asyncio.Task] = None
+        self._global_semaphore: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        """Запускає цикл планувальника (викликається при старті застосунку)"""
+        if self._loop_task and not self._loop_task.done():
+            return
+        self._global_semaphore = asyncio.Semaphore(SCHEDULER_MAX_CONCURRENCY)
+        self._loop_task = asyncio.create_task(self._run_loop())
+        logger.info("Планувальник оновлень запущено")
+
+    async def stop(self):
+        """Зупиняє цикл планувальника"""
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def _run_loop(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Помилка циклу планувальника: {e}")
+            await asyncio.sleep(SCHEDULER_TICK_SECONDS)
+
+    async def tick(self, now: Optional[datetime] = None):
+        """Запускає всі розклади, час яких настав"""
+        now = now or datetime.now()
+        schedules_db = await load_schedules_view()
+        for schedule in schedules_db.get("schedules", []):
+            if not schedule.get("active", True):
+                continue
+            next_run = get_next_run(schedule)
+            if next_run and next_run <= now:
+                await self.trigger(schedule["id"])
+
+    async def trigger(self, schedule_id: str) -> Optional[str]:
+        """
+        Запускає оновлення за розкладом та повертає task_id.
+        Якщо попередній запуск цього розкладу ще виконується - повертає його task_id.
+        """
+        task_id = str(uuid.uuid4())
+        signature = make_task_signature("scheduled_refresh", schedule_id)
+        existing_task_id = claim_task(signature, task_id)
+        if existing_task_id:
+            return existing_task_id
+
+        now = datetime.now()
+        async with get_store_lock(SCHEDULES_FILE):
+            schedules_db = await load_schedules()
+            schedule = None
+            for s in schedules_db.get("schedules", []):
+                if s["id"] == schedule_id:
+                    schedule = s
+                    break
+
+            if not schedule:
+                release_task(signature, task_id)
+                return None
+
+            # Пропущені запуски (наприклад, поки сервер був вимкнений) не накопичуються:
+            # наступний запуск рахується від поточного
+            schedule["last_run_at"] = now.isoformat()
+            schedule["last_task_id"] = task_id
+            await save_schedules(schedules_db)
+
+        await register_task(task_id, "scheduled_refresh", schedule_id=schedule_id)
+
+        asyncio.create_task(run_coalesced_task(signature, task_id, self._run_schedule(task_id, schedule, now)))
+        logger.info(f"Запущено оновлення за розкладом '{schedule.get('name')}' (task_id={task_id})")
+        return task_id
+
+    async def _run_schedule(self, task_id: str, schedule: Dict, started_at: datetime):
+        """Оновлює товари розкладу, рівномірно розподіляючи запити по вікну"""
+        try:
+            filters = {
+                "competitor_id": schedule.get("competitor_id"),
+                "category_ids": schedule.get("category_ids") or []
+            }
+            products: List[Dict] = await select_filtered_products(filters)
+            if schedule.get("adaptive"):
+                # Оновлюємо тільки товари, яких пора оновлювати з урахуванням частоти їх змін
+                products = await select_adaptive_batch(schedule, products, started_at)
+            total = len(products)
+
+            if total == 0:
+                await update_task_progress(task_id, done=0, total=0, status="finished")
+                return
+
+            await update_task_progress(task_id, done=0, total=total, status="running")
+
+            interval = get_spread_seconds(schedule, started_at) / total
+            semaphore = asyncio.Semaphore(max(1, schedule.get("concurrency") or 1))
+            global_semaphore = self._global_semaphore or asyncio.Semaphore(SCHEDULER_MAX_CONCURRENCY)
+            counters = {"done": 0, "success": 0, "errors": 0, "skipped": 0}
+
+            async def refresh_one(product_data: Dict):
+                try:
+                    async with global_semaphore:
+                        parsed_data = await refresh_product(product_data, buffered=True)
+                    if parsed_data is None:
+                        counters["skipped"] += 1
+                    else:
+                        counters["success"] += 1
+                    counters["done"] += 1
+                    await update_task_progress(task_id, done=counters["done"], total=total, skipped=counters["skipped"])
+                except Exception as e:
+                    counters["errors"] += 1
+                    counters["done"] += 1
+                    error_msg = f"Товар {product_data.get('name', product_data.get('id', 'unknown'))}: {str(e)}"
+                    await update_task_progress(task_id, done=counters["done"], total=total, error=error_msg)
+                finally:
+                    semaphore.release()
+
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            pending = set()
+            for idx, product_data in enumerate(products):
+                # Рівномірний розподіл: idx-й товар стартує не раніше start + idx * interval
+                delay = start + idx * interval - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await semaphore.acquire()
+                worker = asyncio.create_task(refresh_one(product_data))
+                pending.add(worker)
+                worker.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending)
+
+            # Зберігаємо результати, що залишились у буфері відкладеного запису
+            await flush_pending_results()
+
+            if counters["errors"] > 0 and counters["success"] == 0 and counters["skipped"] == 0:
+                await update_task_progress(task_id, status="failed")
+            else:
+                await update_task_progress(task_id, status="finished")
+        except Exception as e:
+            import traceback
+            error_details = traceback.format_exc()
+            await update_task_progress(task_id, status="failed", error=f"Критична помилка: {str(e)}\n{error_details}")
+
+
+scheduler = RefreshScheduler()
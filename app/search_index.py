@@ -0,0 +1,211 @@
+"""
+Повнотекстовий індекс товарів за назвою (name, name_parsed) та артикулом (sku).
+
+Текст розбивається на токени (слова та числа в нижньому регістрі, без апострофів,
+ё -> е). Українські та російські слова зводяться до основи легким стемером -
+відкидається найдовше типове закінчення, якщо залишається основа не коротша
+за MIN_STEM_LENGTH, тому "телевізори", "телевізорів" та "телевізор" мають одну основу.
+Артикул додатково індексується цілком без роздільників ("AB-123" -> "ab123")
+та суфіксами довжиною від MIN_SUFFIX_LENGTH (з меншою вагою), тому пошук
+за префіксом знаходить і частину коду з середини ("012" у "МБ1012Д").
+
+Інвертований індекс: термін -> {product_id: вага}. Вага залежить від поля
+(FIELD_WEIGHTS). Терміни зберігаються також у відсортованому списку - пошук за
+префіксом це бінарний пошук та прохід по сусідніх термінах.
+
+Пошук: кожен токен запиту зводиться до основи та шукається як префікс термінів
+(точний збіг важить більше за префіксний); товар має збігтися з усіма токенами.
+Результат - ID товарів, відсортовані за спаданням релевантності.
+"""
+import bisect
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Вага терміна залежно від поля товару
+FIELD_WEIGHTS = {"sku": 3.0, "name": 2.0, "name_parsed": 1.0}
+# Множник ваги для збігу за префіксом (а не цілим терміном)
+PREFIX_MATCH_FACTOR = 0.5
+# Множник ваги суфіксів артикула (збіг з частиною коду з середини)
+SUFFIX_MATCH_FACTOR = 0.5
+MIN_SUFFIX_LENGTH = 3
+# Довші токени артикула не розбиваються на суфікси
+MAX_SUFFIX_TOKEN_LENGTH = 32
+MIN_STEM_LENGTH = 3
+# Скільки термінів з префіксом враховується точно при оцінці вибірковості токена
+_ESTIMATE_TERMS = 64
+_MAX_CHAR = "\U0010ffff"
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_APOSTROPHES = re.compile(r"['’ʼ`]")
+_CYRILLIC = re.compile(r"^[а-яіїєґё]+$")
+# Типові закінчення українських та російських слів
+_ENDINGS = frozenset({
+    "ями", "ами", "ого", "ому", "ему", "его", "ими", "ыми", "ові", "еві", "ів", "їв",
+    "ій", "ий", "ый", "ой", "ая", "яя", "ое", "ее", "ую", "юю", "ої", "ов", "ев",
+    "ах", "ях", "ам", "ям", "ом", "ем", "ою", "ею", "ей", "их", "ых",
+    "а", "я", "о", "е", "у", "ю", "і", "ї", "и", "ы", "ь", "й", "є",
+})
+_ENDING_LENGTHS = sorted({len(ending) for ending in _ENDINGS}, reverse=True)
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Основа слова: відкидає найдовше типове закінчення (тільки для кириличних слів)"""
+    if len(word) <= MIN_STEM_LENGTH or not _CYRILLIC.match(word):
+        return word
+    for length in _ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM_LENGTH and word[-length:] in _ENDINGS:
+            return word[:-length]
+    return word
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Токени тексту (основи слів у нижньому регістрі)"""
+    if not text:
+        return []
+    text = _APOSTROPHES.sub("", str(text).lower()).replace("ё", "е")
+    return [stem(token) for token in _TOKEN_PATTERN.findall(text)]
+
+
+def _product_terms(product: Dict) -> Dict[str, float]:
+    """Терміни товару з вагами (для кожного терміна - найбільша вага серед полів)"""
+    terms: Dict[str, float] = {}
+    for field in ("name_parsed", "name", "sku"):
+        weight = FIELD_WEIGHTS[field]
+        tokens = tokenize(product.get(field))
+        if field == "sku" and len(tokens) > 1:
+            tokens.append("".join(tokens))
+        for token in tokens:
+            if weight > terms.get(token, 0):
+                terms[token] = weight
+        if field == "sku":
+            suffix_weight = weight * SUFFIX_MATCH_FACTOR
+            for token in tokens:
+                if len(token) > MAX_SUFFIX_TOKEN_LENGTH:
+                    continue
+                for start in range(1, len(token) - MIN_SUFFIX_LENGTH + 1):
+                    suffix = token[start:]
+                    if suffix_weight > terms.get(suffix, 0):
+                        terms[suffix] = suffix_weight
+    return terms
+
+
+class SearchIndex:
+    """Інвертований індекс назв та артикулів товарів"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self._terms: List[str] = []
+        self._terms_by_id: Dict[str, Tuple[str, ...]] = {}
+
+    def clear(self):
+        self.postings = {}
+        self._terms = []
+        self._terms_by_id = {}
+
+    def rebuild(self, products):
+        """Повна перебудова індексу"""
+        self.clear()
+        for product in products:
+            product_id = product.get("id")
+            if not product_id:
+                continue
+            terms = _product_terms(product)
+            self._terms_by_id[product_id] = tuple(terms)
+            for term, weight in terms.items():
+                self.postings.setdefault(term, {})[product_id] = weight
+        self._terms = sorted(self.postings)
+
+    def update(self, product_id: str, product: Dict):
+        """Оновлює терміни одного товару"""
+        terms = _product_terms(product)
+        if self._terms_by_id.get(product_id) == tuple(terms):
+            for term, weight in terms.items():
+                self.postings[term][product_id] = weight
+            return
+        self.remove(product_id)
+        self._terms_by_id[product_id] = tuple(terms)
+        for term, weight in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self._terms, term)
+            posting[product_id] = weight
+
+    def remove(self, product_id: str):
+        for term in self._terms_by_id.pop(product_id, ()):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self.postings[term]
+                position = bisect.bisect_left(self._terms, term)
+                if position < len(self._terms) and self._terms[position] == term:
+                    del self._terms[position]
+
+    def _term_range(self, token: str) -> Tuple[int, int]:
+        """Діапазон позицій термінів з префіксом token у відсортованому списку"""
+        low = bisect.bisect_left(self._terms, token)
+        return low, bisect.bisect_left(self._terms, token + _MAX_CHAR, low)
+
+    def _estimate(self, token: str) -> int:
+        """Оцінка кількості товарів для токена (для вибору порядку перетину)"""
+        low, high = self._term_range(token)
+        if high - low > _ESTIMATE_TERMS:
+            return sum(len(self.postings[term]) for term in self._terms[low:low + _ESTIMATE_TERMS]) + high - low
+        return sum(len(self.postings[term]) for term in self._terms[low:high])
+
+    def _match_token(self, token: str) -> Dict[str, float]:
+        """Товари, що мають термін з префіксом token: product_id -> найкраща вага"""
+        scores: Dict[str, float] = {}
+        low, high = self._term_range(token)
+        for term in self._terms[low:high]:
+            factor = 1.0 if term == token else PREFIX_MATCH_FACTOR
+            for product_id, weight in self.postings[term].items():
+                score = weight * factor
+                if score > scores.get(product_id, 0):
+                    scores[product_id] = score
+        return scores
+
+    def _score_product(self, product_id: str, token: str) -> float:
+        """Найкраща вага збігу токена з термінами одного товару (0 - немає збігу)"""
+        best = 0.0
+        for term in self._terms_by_id.get(product_id, ()):
+            if term.startswith(token):
+                score = self.postings[term][product_id] * (1.0 if term == token else PREFIX_MATCH_FACTOR)
+                if score > best:
+                    best = score
+        return best
+
+    def search(self, query: str) -> Optional[List[Tuple[str, float]]]:
+        """
+        Товари, що відповідають усім токенам запиту: [(product_id, релевантність)]
+        за спаданням релевантності. None - запит не містить жодного токена.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return None
+        # Товари вибираються за найрідшим токеном, решта токенів перевіряється
+        # тільки для них (за термінами кожного товару)
+        estimates = {token: self._estimate(token) for token in tokens}
+        tokens.sort(key=estimates.get)
+        scores = self._match_token(tokens[0])
+        for token in tokens[1:]:
+            if not scores:
+                break
+            if estimates[token] <= 4 * len(scores):
+                token_scores = self._match_token(token)
+                scores = {
+                    product_id: score + token_scores[product_id]
+                    for product_id, score in scores.items() if product_id in token_scores
+                }
+                continue
+            next_scores = {}
+            for product_id, score in scores.items():
+                token_score = self._score_product(product_id, token)
+                if token_score:
+                    next_scores[product_id] = score + token_score
+            scores = next_scores
+        return sorted(scores.items(), key=lambda item: -item[1])
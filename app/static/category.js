@@ -35,6 +35,9 @@ function displayCategory(data) {
     // Підкатегорії
     document.getElementById('subcategoriesCount').textContent = data.subcategories_count || 0;
     
+    // Товари (разом з підкатегоріями)
+    document.getElementById('productsCount').textContent = data.products_count || 0;
+    
     // Breadcrumb
     const breadcrumbContainer = document.getElementById('breadcrumb');
     breadcrumbContainer.innerHTML = breadcrumb.map((item, index) => {
@@ -11,6 +11,7 @@ async function loadCompetitor() {
         }
         const competitor = await response.json();
         displayCompetitor(competitor);
+        await loadCategoryCounts();
         displayCategoriesTree(competitor.categories || [], competitorId);
     } catch (error) {
         console.error('Помилка завантаження:', error);
@@ -18,6 +19,20 @@ async function loadCompetitor() {
     }
 }
 
+// Кількість товарів у категоріях (разом з підкатегоріями)
+let categoryProductCounts = {};
+
+async function loadCategoryCounts() {
+    try {
+        const response = await fetch(`/competitors/${competitorId}/category_counts`);
+        if (response.ok) {
+            categoryProductCounts = (await response.json()).counts || {};
+        }
+    } catch (error) {
+        console.error('Помилка завантаження кількості товарів:', error);
+    }
+}
+
 // Відображення даних конкурента
 function displayCompetitor(competitor) {
     document.getElementById('competitorName').textContent = competitor.name;
@@ -77,6 +92,11 @@ function renderCategories(categories, competitorId, level = 0) {
                         ${escapeHtml(category.name)}
                         ${needsManualCheck ? ' <span class="text-yellow-600 text-xs">⚠️ Потрібна перевірка</span>' : ''}
                     </a>
+                    ${categoryProductCounts[category.id] ? `
+                    <span class="text-gray-500 text-xs bg-gray-100 rounded px-2 py-0.5" title="Товарів у категорії">
+                        ${categoryProductCounts[category.id]}
+                    </span>
+                    ` : ''}
                     ${category.url && category.url !== '' && category.url !== 'null' ? `
                     <a href="${escapeHtml(category.url)}" target="_blank" 
                        class="text-blue-600 hover:underline text-xs truncate max-w-xs" 
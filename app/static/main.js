@@ -5,29 +5,34 @@ let competitors = [];
 let categories = [];
 // currentTaskId визначено в tasks.js, не дублюємо тут
 let selectedCategoryIds = []; // Вибрані категорії для фільтра
+let currentFilters = {}; // Фільтри поточного списку (для підвантаження наступних сторінок)
+let nextCursor = null; // Курсор наступної сторінки списку (null - сторінка остання)
+let totalProducts = 0;
 
-// Завантаження списку товарів з фільтрами
-async function loadProducts(filters = {}) {
+// Розмір сторінки списку товарів та поля, які показує таблиця
+const PRODUCTS_PAGE_SIZE = 100;
+const PRODUCT_LIST_FIELDS = 'id,name,name_parsed,url,status,price,availability,competitor_id,competitor_name,category_path';
+
+// Завантаження списку товарів з фільтрами (append - наступна сторінка поточного списку)
+async function loadProducts(filters = {}, append = false) {
     // Оголошуємо tbody один раз на початку функції
     let tbody = document.getElementById('productsTableBody');
     
     try {
-        if (tbody) {
+        if (!append) {
+            currentFilters = filters;
+            nextCursor = null;
+        }
+        if (tbody && !append) {
             tbody.innerHTML = '<tr><td colspan="9" class="px-4 py-8 text-center text-gray-500">Завантаження...</td></tr>';
         }
         
         // Формуємо URL з параметрами фільтрів
-        const params = new URLSearchParams();
-        if (filters.name) params.append('name', filters.name);
-        if (filters.competitor_id && filters.competitor_id !== 'all') params.append('competitor_id', filters.competitor_id);
-        if (filters.category_ids && filters.category_ids.length > 0) {
-            filters.category_ids.forEach(id => params.append('category_ids', id));
-        }
-        if (filters.status) params.append('status', filters.status);
-        if (filters.availability) params.append('availability', filters.availability);
-        if (filters.price_from) params.append('price_from', filters.price_from);
-        if (filters.price_to) params.append('price_to', filters.price_to);
-        if (filters.problematic) params.append('problematic', 'true');
+        const params = buildFilterParams(filters);
+        if (filters.sort) params.append('sort', filters.sort);
+        params.append('limit', PRODUCTS_PAGE_SIZE);
+        params.append('fields', PRODUCT_LIST_FIELDS);
+        if (append && nextCursor) params.append('cursor', nextCursor);
         
         const url = `/products/list?${params.toString()}`;
         console.log('Запит до:', url);
@@ -52,16 +57,23 @@ async function loadProducts(filters = {}) {
         const data = await response.json();
         console.log('Дані отримано, товарів:', data.products?.length || 0);
         
-        allProducts = data.products || [];
-        filteredProducts = data.products || [];
+        const pageProducts = data.products || [];
+        allProducts = append ? allProducts.concat(pageProducts) : pageProducts;
+        filteredProducts = allProducts;
+        nextCursor = data.next_cursor || null;
+        totalProducts = data.total ?? allProducts.length;
         
         // Перевіряємо, чи tbody все ще існує перед відображенням
         if (!tbody) {
             tbody = document.getElementById('productsTableBody');
         }
         if (tbody) {
-            displayProducts(filteredProducts);
+            displayProducts(pageProducts, append);
             updateParseButtons();
+            updateLoadMore();
+            if (!append) {
+                loadFacets(filters);
+            }
         } else {
             console.error('Елемент productsTableBody не знайдено після завантаження даних!');
         }
@@ -82,6 +94,56 @@ async function loadProducts(filters = {}) {
     }
 }
 
+// Параметри запиту для фільтрів списку товарів
+function buildFilterParams(filters) {
+    const params = new URLSearchParams();
+    if (filters.name) params.append('name', filters.name);
+    if (filters.competitor_id && filters.competitor_id !== 'all') params.append('competitor_id', filters.competitor_id);
+    if (filters.category_ids && filters.category_ids.length > 0) {
+        filters.category_ids.forEach(id => params.append('category_ids', id));
+    }
+    if (filters.status) params.append('status', filters.status);
+    if (filters.availability) params.append('availability', filters.availability);
+    if (filters.price_from) params.append('price_from', filters.price_from);
+    if (filters.price_to) params.append('price_to', filters.price_to);
+    if (filters.problematic) params.append('problematic', 'true');
+    return params;
+}
+
+// Кількість товарів для варіантів фільтрів (конкурент, статус, наявність)
+async function loadFacets(filters = {}) {
+    try {
+        const response = await fetch(`/products/facets?${buildFilterParams(filters).toString()}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const facets = await response.json();
+        const toCounts = (items, key) => Object.fromEntries((items || []).map(item => [String(item[key] ?? '').toLowerCase(), item.count]));
+        applyFacetCounts('filter-competitor', toCounts(facets.competitors, 'id'));
+        applyFacetCounts('filter-status', toCounts(facets.status, 'value'));
+        applyFacetCounts('filter-availability', toCounts(facets.availability, 'value'));
+    } catch (error) {
+        console.error('Помилка завантаження фасетів:', error);
+    }
+}
+
+// Додає кількість товарів до назв варіантів select (крім варіанту "всі")
+function applyFacetCounts(selectId, counts) {
+    const select = document.getElementById(selectId);
+    if (!select) return;
+    Array.from(select.options).forEach(option => {
+        if (!option.dataset.label) {
+            option.dataset.label = option.textContent;
+        }
+        if (!option.value || option.value === 'all') {
+            option.textContent = option.dataset.label;
+            return;
+        }
+        const count = counts[option.value.toLowerCase()] || 0;
+        option.textContent = `${option.dataset.label} (${count})`;
+    });
+}
+
 // Завантаження конкурентів для фільтрів
 async function loadCompetitors() {
     try {
@@ -573,16 +635,16 @@ function escapeHtml(text) {
 }
 
 // Відображення товарів у таблиці
-async function displayProducts(products) {
+async function displayProducts(products, append = false) {
     const tbody = document.getElementById('productsTableBody');
     
-    if (products.length === 0) {
+    if (products.length === 0 && !append) {
         tbody.innerHTML = '<tr><td colspan="9" class="px-4 py-8 text-center text-gray-500">Немає товарів. Додайте перший товар.</td></tr>';
         return;
     }
     
     // Спочатку показуємо товари без конкурентів та категорій
-    tbody.innerHTML = products.map(product => {
+    const rowsHtml = products.map(product => {
         const price = product.price ? `${product.price} грн` : '-';
         const availability = product.availability || '-';
         
@@ -627,10 +689,16 @@ async function displayProducts(products) {
             </tr>
         `;
     }).join('');
+    if (append) {
+        tbody.insertAdjacentHTML('beforeend', rowsHtml);
+    } else {
+        tbody.innerHTML = rowsHtml;
+    }
     
-    // Додаємо обробники для checkbox
-    document.querySelectorAll('.product-checkbox').forEach(checkbox => {
-        checkbox.addEventListener('change', updateSelectedButtons);
+    // Додаємо обробники для checkbox (тільки нових рядків)
+    products.forEach(product => {
+        const checkbox = tbody.querySelector(`.product-checkbox[data-id="${product.id}"]`);
+        if (checkbox) checkbox.addEventListener('change', updateSelectedButtons);
     });
     
     // Асинхронно завантажуємо конкурентів та категорії для кожного товару
@@ -796,6 +864,74 @@ function updateParseButtons() {
     }
 }
 
+// Масовий імпорт товарів (список URL з поля або файл CSV/TXT) одним запитом
+async function importProductsBulk() {
+    const textarea = document.getElementById('bulkImportUrls');
+    const fileInput = document.getElementById('bulkImportFile');
+    const importBtn = document.getElementById('bulkImportBtn');
+    const file = fileInput && fileInput.files.length > 0 ? fileInput.files[0] : null;
+    const urls = textarea ? textarea.value.split('\n').map(line => line.trim()).filter(Boolean) : [];
+    
+    if (!file && urls.length === 0) {
+        showToast('Вкажіть URL товарів або оберіть файл', 'error');
+        return;
+    }
+    
+    if (importBtn) importBtn.disabled = true;
+    try {
+        let response;
+        if (file) {
+            const formData = new FormData();
+            formData.append('file', file);
+            response = await fetch('/products/import', {method: 'POST', body: formData});
+        } else {
+            response = await fetch('/products/import', {
+                method: 'POST',
+                headers: {'Content-Type': 'application/json'},
+                body: JSON.stringify(urls)
+            });
+        }
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.detail || `HTTP error! status: ${response.status}`);
+        }
+        
+        showToast(`✅ Додано товарів: ${data.added}, дублікатів: ${data.duplicates}, некоректних URL: ${data.invalid}`, 'success');
+        if (textarea) textarea.value = '';
+        if (fileInput) fileInput.value = '';
+        const addProductModal = document.getElementById('addProductModal');
+        if (addProductModal) addProductModal.style.display = 'none';
+        applyFilters();
+    } catch (error) {
+        showToast('❌ Помилка імпорту: ' + error.message, 'error');
+    } finally {
+        if (importBtn) importBtn.disabled = false;
+    }
+}
+
+// Кнопка "Показати ще" та лічильник показаних товарів
+function updateLoadMore() {
+    const container = document.getElementById('load-more-container');
+    const counter = document.getElementById('products-count');
+    if (counter) {
+        counter.textContent = `Показано ${allProducts.length} з ${totalProducts}`;
+    }
+    if (container) {
+        container.classList.toggle('hidden', totalProducts === 0);
+    }
+    const loadMoreBtn = document.getElementById('load-more-btn');
+    if (loadMoreBtn) {
+        loadMoreBtn.classList.toggle('hidden', !nextCursor);
+    }
+}
+
+// Підвантаження наступної сторінки поточного списку
+function loadMoreProducts() {
+    if (nextCursor) {
+        loadProducts(currentFilters, true);
+    }
+}
+
 // Оновлення кнопки "Парсити вибране" при зміні checkbox
 function updateSelectedButtons() {
     const parseSelectedBtn = document.getElementById('parse-selected-btn');
@@ -818,7 +954,8 @@ function getCurrentFilters() {
         availability: document.getElementById('filter-availability').value,
         price_from: document.getElementById('filter-price-from').value,
         price_to: document.getElementById('filter-price-to').value,
-        problematic: document.getElementById('filter-problematic').checked
+        problematic: document.getElementById('filter-problematic').checked,
+        sort: document.getElementById('filter-sort').value
     };
 }
 
@@ -860,6 +997,9 @@ function clearFilter(filterName) {
         case 'problematic':
             document.getElementById('filter-problematic').checked = false;
             break;
+        case 'sort':
+            document.getElementById('filter-sort').value = '';
+            break;
     }
 }
 
@@ -872,6 +1012,7 @@ function resetAllFilters() {
     document.getElementById('filter-price-from').value = '';
     document.getElementById('filter-price-to').value = '';
     document.getElementById('filter-problematic').checked = false;
+    document.getElementById('filter-sort').value = '';
     
     // Очищаємо категорії
     selectedCategoryIds = [];
@@ -1328,6 +1469,12 @@ document.addEventListener('DOMContentLoaded', async () => {
     const resetFiltersBtn = document.getElementById('reset-filters-btn');
     if (resetFiltersBtn) resetFiltersBtn.addEventListener('click', resetAllFilters);
     
+    const loadMoreBtn = document.getElementById('load-more-btn');
+    if (loadMoreBtn) loadMoreBtn.addEventListener('click', loadMoreProducts);
+    
+    const bulkImportBtn = document.getElementById('bulkImportBtn');
+    if (bulkImportBtn) bulkImportBtn.addEventListener('click', importProductsBulk);
+    
     // Обробники для кнопок очищення окремих фільтрів
     document.querySelectorAll('.clear-filter-btn').forEach(btn => {
         btn.addEventListener('click', function(e) {
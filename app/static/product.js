@@ -250,11 +250,8 @@ async function displayProduct(data) {
     // Правила парсингу використовуються для альтернативного методу парсингу через CSS селектори
     // Але основний парсер працює через GPT, тому цей блок не потрібен
 
-    // БЛОК 7: Логи (показуємо лише останні 3 записи)
-    displayLogs(data.logs || [], data.logs || []);
-
-    // Зберігаємо всі логи для модального вікна
-    window.fullLogsData = data.logs || [];
+    // БЛОК 7: Логи (завантажуються окремим запитом, показуємо лише останні 3 записи)
+    loadProductLogs(data.id);
     
     // Завантажуємо характеристики для товару
     const productId = getProductId();
@@ -452,6 +449,25 @@ function displayFullHistory(history) {
     }).join('');
 }
 
+// Завантаження логів товару (зберігаються окремо від даних товару)
+async function loadProductLogs(productId) {
+    try {
+        const response = await fetch(`/products/${productId}/logs`);
+        if (!response.ok) {
+            throw new Error('Помилка завантаження логів');
+        }
+        const data = await response.json();
+        const logs = data.logs || [];
+        displayLogs(logs, logs);
+        // Зберігаємо всі логи для модального вікна
+        window.fullLogsData = logs;
+    } catch (error) {
+        console.error('Помилка завантаження логів:', error);
+        displayLogs([], []);
+        window.fullLogsData = [];
+    }
+}
+
 // Відображення логів (лише останні 3 записи)
 function displayLogs(logs, fullLogs) {
     const tbody = document.getElementById('logsTableBody');
@@ -0,0 +1,254 @@
+"""
+Атомарне збереження JSON-сховищ.
+
+- Кожне сховище (файл) має власне блокування для циклів читання-зміна-запис
+  (get_store_lock) та окреме внутрішнє блокування фіксації запису.
+- Запис атомарний: дані пишуться у тимчасовий файл поруч з цільовим,
+  скидаються на диск (fsync) і підміняють цільовий файл через os.replace.
+  Читач завжди бачить або стару, або нову версію файлу, але не обрізану.
+- Оптимістична перевірка версій: у документі зберігається лічильник revision.
+  Якщо документ прочитано з revision N, а у файлі вже інша ревізія
+  (хтось записав між читанням та записом), запис відхиляється StoreConflictError
+  замість тихого перезапису чужих змін.
+- Серіалізація через orjson (якщо встановлений, інакше стандартний json).
+  Усі сховища пишуться компактно, без відступів; pretty-друк - тільки на запит
+  при експорті (/export/{store_name}, dumps(pretty=True)).
+- Кеш для читання: read_json_view повертає розібраний документ з пам'яті, поки
+  сигнатура файлу (inode, mtime, розмір) не змінилась. Документ у кеші незмінний
+  (FrozenDict/FrozenList) і спільний для всіх викликів; для змін потрібна
+  копія - read_json або thaw().
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import aiofiles
+
+try:
+    import orjson
+except ImportError:  # orjson необов'язковий - без нього використовується стандартний json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Ключ лічильника ревізій у документі сховища
+REVISION_KEY = "revision"
+
+
+class StoreConflictError(Exception):
+    """Документ змінено іншим записом після того, як його прочитали"""
+
+    def __init__(self, path: str, expected: int, actual: int):
+        self.path = path
+        self.expected = expected
+        self.actual = actual
+        super().__init__(
+            f"Файл {path} змінено іншим записом (очікувана ревізія {expected}, поточна {actual})"
+        )
+
+
+# Блокування циклів читання-зміна-запис: path -> asyncio.Lock
+_store_locks: Dict[str, asyncio.Lock] = {}
+# Блокування фіксації запису (перевірка ревізії + підміна файлу): path -> asyncio.Lock
+_commit_locks: Dict[str, asyncio.Lock] = {}
+# Остання відома ревізія файлу: path -> (сигнатура файлу, ревізія)
+_known_revisions: Dict[str, Tuple[Tuple[int, int, int], int]] = {}
+# Кеш незмінних документів для читання: path -> (сигнатура файлу, документ)
+_view_cache: Dict[str, Tuple[Tuple[int, int, int], Any]] = {}
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError("Документ з кешу доступний тільки для читання - використовуйте read_json або thaw()")
+
+
+class FrozenDict(dict):
+    """dict, який не можна змінювати (спільний документ з кешу)"""
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+class FrozenList(list):
+    """list, який не можна змінювати (спільний документ з кешу)"""
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+
+def freeze(value: Any) -> Any:
+    """Рекурсивно перетворює JSON-документ на незмінний (вже незмінні частини не копіюються)"""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Рекурсивно створює змінну копію документа (copy-on-write для даних з кешу)"""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    return value
+
+
+def dumps(data: Any, pretty: bool = False) -> bytes:
+    """Серіалізує документ у UTF-8 JSON: компактно або з відступами (pretty)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, option=option)
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(content: bytes) -> Any:
+    """Розбирає JSON-документ"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def _get_lock(locks: Dict[str, asyncio.Lock], path: str) -> asyncio.Lock:
+    lock = locks.get(path)
+    if lock is None:
+        lock = asyncio.Lock()
+        locks[path] = lock
+    return lock
+
+
+def get_store_lock(path: str) -> asyncio.Lock:
+    """Блокування сховища для циклу читання-зміна-запис"""
+    return _get_lock(_store_locks, path)
+
+
+def get_file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Сигнатура файлу (inode, mtime, розмір) для перевірки, чи змінювався він.
+    Кожен атомарний запис створює новий inode, тому сигнатура змінюється завжди.
+    """
+    try:
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+def _remember_revision(path: str, signature: Optional[Tuple[int, int, int]], revision: int):
+    if signature is not None:
+        _known_revisions[path] = (signature, revision)
+
+
+async def read_json(path: str, default_factory: Callable[[], Any]) -> Any:
+    """
+    Читає JSON-документ. Якщо файлу немає або він пошкоджений - повертає default_factory().
+    Ревізія прочитаного файлу записується в документ (revision, 0 - якщо її немає)
+    і запам'ятовується для подальших перевірок.
+    """
+    signature = get_file_signature(path)
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            content = await f.read()
+        data = loads(content)
+    except FileNotFoundError:
+        return _stamp_revision(default_factory())
+    except Exception as e:
+        logger.error(f"Помилка читання {path}: {e}")
+        return _stamp_revision(default_factory())
+
+    if isinstance(data, dict):
+        _stamp_revision(data)
+        if signature is not None and signature == get_file_signature(path):
+            _remember_revision(path, signature, data[REVISION_KEY])
+    return data
+
+
+def _stamp_revision(data: Any) -> Any:
+    """
+    Записує в документ ревізію, з якою його прочитано (0 - файл без ревізії або його немає),
+    щоб перевірка конфліктів при записі працювала і для старих файлів без лічильника
+    """
+    if isinstance(data, dict):
+        data.setdefault(REVISION_KEY, 0)
+    return data
+
+
+async def read_json_view(path: str, default_factory: Callable[[], Any]) -> Any:
+    """
+    Повертає незмінний документ з кешу; файл перечитується тільки якщо його сигнатура змінилась.
+    Призначено для читання (API, фільтри, пошук) - змінювати результат не можна.
+    """
+    signature = get_file_signature(path)
+    cached = _view_cache.get(path)
+    if cached is not None and signature is not None and cached[0] == signature:
+        return cached[1]
+
+    data = freeze(await read_json(path, default_factory))
+    if signature is not None and signature == get_file_signature(path):
+        _view_cache[path] = (signature, data)
+    else:
+        _view_cache.pop(path, None)
+    return data
+
+
+async def _current_revision(path: str) -> int:
+    """Поточна ревізія файлу: з кешу, якщо файл не змінювався, інакше - з самого файлу"""
+    signature = get_file_signature(path)
+    if signature is None:
+        return 0
+    known = _known_revisions.get(path)
+    if known and known[0] == signature:
+        return known[1]
+    try:
+        async with aiofiles.open(path, "rb") as f:
+            data = loads(await f.read())
+    except Exception:
+        return 0
+    revision = data.get(REVISION_KEY, 0) if isinstance(data, dict) else 0
+    _remember_revision(path, signature, revision)
+    return revision
+
+
+async def write_json_atomic(path: str, data: Dict) -> int:
+    """
+    Атомарно записує документ та повертає його нову ревізію (також записується в data).
+    Якщо в data є revision і вона не збігається з ревізією файлу - StoreConflictError.
+    Документ пишеться компактно (читабельна копія - через експорт).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    async with _get_lock(_commit_locks, path):
+        current = await _current_revision(path)
+        expected = data.get(REVISION_KEY)
+        if expected is not None and expected != current:
+            raise StoreConflictError(path, expected, current)
+
+        data[REVISION_KEY] = current + 1
+        temp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+        try:
+            async with aiofiles.open(temp_path, "wb") as f:
+                await f.write(dumps(data))
+                await f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if expected is None:
+                data.pop(REVISION_KEY, None)
+            else:
+                data[REVISION_KEY] = expected
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        _remember_revision(path, get_file_signature(path), current + 1)
+        return current + 1
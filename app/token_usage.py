@@ -0,0 +1,236 @@
+"""
+Облік використання токенів API ключів.
+
+Кожен виклик GPT дописується одним рядком у append-only журнал (NDJSON,
+TOKEN_USAGE_LOG_FILE) і одразу додається до агрегатів у пам'яті: погодинних
+та щоденних кошиків для кожного ключа (кількість запитів, prompt, completion
+та всього токенів). Запис - O(1), settings.json більше не переписується
+на кожен виклик.
+
+Статистика за довільний період рахується з агрегатів: повні дні - з щоденних
+кошиків, неповні дні на межах періоду - з погодинних (з точністю до години).
+
+Погодинні кошики зберігаються HOURLY_RETENTION_DAYS діб (старіші прибираються
+при збереженні знімка), щоденні - без обмеження. Для неповного дня, старшого
+за цей період, використовується щоденний кошик (точність - доба).
+
+Агрегати періодично зберігаються знімком (TOKEN_USAGE_ROLLUPS_FILE) разом з
+позицією в журналі, до якої вони враховані. При старті завантажується знімок,
+і з журналу дочитуються тільки записи після цієї позиції.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import aiofiles
+
+from .storage import dumps, loads, read_json, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+TOKEN_USAGE_LOG_FILE = "app/db/token_usage.jsonl"
+TOKEN_USAGE_ROLLUPS_FILE = "app/db/token_usage_rollups.json"
+# Знімок агрегатів записується не частіше ніж раз на цей інтервал
+ROLLUPS_SNAPSHOT_INTERVAL_SECONDS = 60.0
+# Скільки діб зберігаються погодинні кошики
+HOURLY_RETENTION_DAYS = 31
+
+# Поля кошика: кількість запитів, prompt, completion, всього токенів
+_FIELDS = ("requests", "prompt_tokens", "completion_tokens", "total_tokens")
+
+
+def _hour_key(timestamp: str) -> str:
+    """Ключ погодинного кошика: YYYY-MM-DDTHH"""
+    return timestamp[:13]
+
+
+def _hourly_cutoff_day() -> str:
+    """Перший день (YYYY-MM-DD), для якого ще зберігаються погодинні кошики"""
+    return (datetime.now() - timedelta(days=HOURLY_RETENTION_DAYS)).strftime("%Y-%m-%d")
+
+
+def _add(bucket: List[int], entry: Dict):
+    bucket[0] += 1
+    bucket[1] += entry.get("prompt_tokens", 0) or 0
+    bucket[2] += entry.get("completion_tokens", 0) or 0
+    bucket[3] += entry.get("total_tokens", 0) or 0
+
+
+def _as_dict(bucket: List[int]) -> Dict:
+    return dict(zip(_FIELDS, bucket))
+
+
+class TokenUsageRollups:
+    """Погодинні та щоденні агрегати використання токенів за ключами"""
+
+    def __init__(self, log_path: str, snapshot_path: str):
+        self.log_path = log_path
+        self.snapshot_path = snapshot_path
+        # key_id -> {"hourly": {YYYY-MM-DDTHH: [..]}, "daily": {YYYY-MM-DD: [..]}}
+        self.keys: Dict[str, Dict[str, Dict[str, List[int]]]] = {}
+        self.offset = 0
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._last_snapshot = 0.0
+        self._dirty = False
+
+    def _apply(self, entry: Dict):
+        timestamp = entry.get("timestamp") or ""
+        if len(timestamp) < 13 or not entry.get("key_id"):
+            return
+        rollup = self.keys.setdefault(entry["key_id"], {"hourly": {}, "daily": {}})
+        _add(rollup["hourly"].setdefault(_hour_key(timestamp), [0, 0, 0, 0]), entry)
+        _add(rollup["daily"].setdefault(timestamp[:10], [0, 0, 0, 0]), entry)
+
+    async def _ensure_loaded(self):
+        """Завантажує знімок агрегатів та дочитує журнал після його позиції (під self._lock)"""
+        if self._loaded:
+            return
+        snapshot = await read_json(self.snapshot_path, dict)
+        try:
+            log_size = os.path.getsize(self.log_path)
+        except OSError:
+            log_size = 0
+        if snapshot.get("offset", 0) <= log_size:
+            self.keys = snapshot.get("keys", {})
+            self.offset = snapshot.get("offset", 0)
+        else:
+            # Журнал коротший за знімок (замінений або видалений) - перебудовуємо з нуля
+            self.keys, self.offset = {}, 0
+
+        if self.offset < log_size:
+            async with aiofiles.open(self.log_path, "rb") as f:
+                await f.seek(self.offset)
+                content = await f.read()
+            # Неповний останній рядок не враховується - він буде дочитаний наступного разу
+            complete = content[:content.rfind(b"\n") + 1]
+            for line in complete.splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    self._apply(loads(line))
+                except ValueError:
+                    logger.warning(f"Пропущено пошкоджений запис журналу {self.log_path}")
+            self.offset += len(complete)
+            self._dirty = bool(complete)
+        self._loaded = True
+
+    async def record(self, entries: List[Dict]):
+        """Дописує записи в журнал та оновлює агрегати"""
+        if not entries:
+            return
+        async with self._lock:
+            await self._ensure_loaded()
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            content = b"".join(dumps(entry) + b"\n" for entry in entries)
+            async with aiofiles.open(self.log_path, "ab") as f:
+                await f.write(content)
+            for entry in entries:
+                self._apply(entry)
+            self.offset += len(content)
+            self._dirty = True
+            if time.monotonic() - self._last_snapshot >= ROLLUPS_SNAPSHOT_INTERVAL_SECONDS:
+                await self._save_snapshot()
+
+    def _prune_hourly(self):
+        """Прибирає погодинні кошики, старші за HOURLY_RETENTION_DAYS діб"""
+        cutoff_day = _hourly_cutoff_day()
+        for rollup in self.keys.values():
+            hourly = rollup["hourly"]
+            for hour_key in [hour_key for hour_key in hourly if hour_key[:10] < cutoff_day]:
+                del hourly[hour_key]
+
+    async def _save_snapshot(self):
+        self._prune_hourly()
+        await write_json_atomic(self.snapshot_path, {"offset": self.offset, "keys": self.keys})
+        self._last_snapshot = time.monotonic()
+        self._dirty = False
+
+    async def flush(self):
+        """Зберігає знімок агрегатів, якщо вони змінились (при зупинці застосунку)"""
+        async with self._lock:
+            if self._loaded and self._dirty:
+                await self._save_snapshot()
+
+    async def totals(self, key_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict:
+        """
+        Сумарне використання ключа за період [start, end] (межі - з точністю до години,
+        старші за HOURLY_RETENTION_DAYS діб - до доби) та щоденні кошики, що потрапили в період.
+        """
+        async with self._lock:
+            await self._ensure_loaded()
+            rollup = self.keys.get(key_id) or {"hourly": {}, "daily": {}}
+
+        start_hour = start.strftime("%Y-%m-%dT%H") if start else None
+        end_hour = end.strftime("%Y-%m-%dT%H") if end else None
+        cutoff_day = _hourly_cutoff_day()
+        total = [0, 0, 0, 0]
+        daily = []
+        for day in sorted(rollup["daily"]):
+            if (start_hour and day < start_hour[:10]) or (end_hour and day > end_hour[:10]):
+                continue
+            full_day = (not start_hour or start_hour <= f"{day}T00") and (not end_hour or end_hour >= f"{day}T23")
+            # Погодинних кошиків за цей день вже немає - неповний день рахується цілим
+            if full_day or day < cutoff_day:
+                bucket = rollup["daily"][day]
+            else:
+                # Неповний день на межі періоду - сумуємо погодинні кошики
+                bucket = [0, 0, 0, 0]
+                for hour in range(24):
+                    hour_key = f"{day}T{hour:02d}"
+                    if (start_hour and hour_key < start_hour) or (end_hour and hour_key > end_hour):
+                        continue
+                    hourly = rollup["hourly"].get(hour_key)
+                    if hourly:
+                        bucket = [a + b for a, b in zip(bucket, hourly)]
+                if not bucket[0]:
+                    continue
+            total = [a + b for a, b in zip(total, bucket)]
+            daily.append({"date": day, **_as_dict(bucket)})
+        return {**_as_dict(total), "daily": daily}
+
+
+_rollups = TokenUsageRollups(TOKEN_USAGE_LOG_FILE, TOKEN_USAGE_ROLLUPS_FILE)
+
+
+def make_usage_entry(key_id: str, token_usage: Dict, timestamp: Optional[str] = None) -> Dict:
+    """Запис журналу використання токенів"""
+    return {
+        "key_id": key_id,
+        "timestamp": timestamp or datetime.now().isoformat(),
+        "prompt_tokens": token_usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": token_usage.get("completion_tokens", 0) or 0,
+        "total_tokens": token_usage.get("total_tokens", 0) or 0
+    }
+
+
+async def record_token_usage(key_id: str, token_usage: Dict):
+    """Записує використання токенів одним викликом GPT"""
+    await _rollups.record([make_usage_entry(key_id, token_usage)])
+
+
+async def record_token_usage_entries(entries: List[Dict]):
+    """Записує готові записи журналу (перенесення старої історії з налаштувань)"""
+    await _rollups.record(entries)
+
+
+async def get_usage_totals(key_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Dict:
+    """Сумарне використання токенів ключем за період (з агрегатів)"""
+    return await _rollups.totals(key_id, start, end)
+
+
+async def get_average_tokens_per_request(key_id: str, days: int = 7) -> Optional[float]:
+    """Середня кількість токенів на запит ключа за останні days діб (None, якщо запитів не було)"""
+    totals = await get_usage_totals(key_id, datetime.now() - timedelta(days=days))
+    if not totals["requests"] or not totals["total_tokens"]:
+        return None
+    return totals["total_tokens"] / totals["requests"]
+
+
+async def flush_token_usage():
+    """Зберігає знімок агрегатів (викликається при зупинці застосунку)"""
+    await _rollups.flush()
@@ -0,0 +1,135 @@
+"""
+Буфер відкладеного запису (write-behind) результатів парсингу.
+
+Під час масових задач кожен результат раніше одразу записувався в db.json
+(повне завантаження + повний запис бази на кожен товар). Буфер накопичує
+результати та передає їх у функцію збереження пакетами: коли набралось
+max_batch записів або минуло max_delay_seconds з моменту першого
+незбереженого запису.
+
+Збереження при збоях: кожен запис спочатку дописується в журнал (NDJSON)
+і тільки потім потрапляє в буфер. Після успішного збереження пакета журнал
+перезаписується залишком незбережених записів (з fsync). Якщо процес впав,
+записи з журналу застосовуються при наступному запуску (recover).
+
+Записи дописуються в журнал без fsync: журнал захищає від падіння процесу
+(дані вже передані ОС), але при збої ОС або живлення можуть втратитись записи
+після останнього збереженого пакета (не більше max_batch записів або
+max_delay_seconds). fsync на кожен запис звів би нанівець виграш від пакетів.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiofiles
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Накопичує записи та зберігає їх пакетами за кількістю або часом"""
+
+    def __init__(self, flush_fn: Callable[[List[Dict]], Awaitable[None]], journal_path: str,
+                 max_batch: int = 50, max_delay_seconds: float = 2.0):
+        self.flush_fn = flush_fn
+        self.journal_path = journal_path
+        self.max_batch = max_batch
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: List[Dict] = []
+        self._flush_lock = asyncio.Lock()
+        self._journal_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    async def add(self, item: Dict):
+        """
+        Додає запис: спочатку в журнал, потім у буфер; за потреби запускає збереження.
+        Помилка збереження пакета не піднімається звідси (це не помилка цього запису):
+        записи залишаються в буфері та журналі до наступної спроби, а помилку отримає
+        flush() у кінці задачі.
+        """
+        async with self._journal_lock:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            async with aiofiles.open(self.journal_path, "a", encoding="utf-8") as f:
+                await f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self._pending.append(item)
+
+        if len(self._pending) >= self.max_batch:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Помилка збереження пакета результатів (записи залишаються в буфері до наступної спроби): {str(e)}")
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.max_delay_seconds)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Помилка відкладеного збереження результатів: {str(e)}")
+
+    async def flush(self):
+        """Зберігає всі накопичені записи одним пакетом"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch = list(self._pending)
+            await self.flush_fn(batch)
+
+            # Прибираємо збережені записи та перезаписуємо журнал залишком
+            async with self._journal_lock:
+                del self._pending[:len(batch)]
+                await self._rewrite_journal(self._pending)
+
+    async def _rewrite_journal(self, items: List[Dict]):
+        if not items:
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            return
+        temp_path = f"{self.journal_path}.tmp"
+        async with aiofiles.open(temp_path, "w", encoding="utf-8") as f:
+            await f.write("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items))
+            await f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+
+    async def recover(self) -> int:
+        """Застосовує записи, що залишились у журналі після збою. Повертає їх кількість"""
+        try:
+            async with aiofiles.open(self.journal_path, "r", encoding="utf-8") as f:
+                content = await f.read()
+        except FileNotFoundError:
+            return 0
+
+        items = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Останній рядок міг бути записаний не повністю
+                logger.warning(f"Пропущено пошкоджений запис журналу {self.journal_path}")
+
+        async with self._flush_lock:
+            if items:
+                await self.flush_fn(items)
+            async with self._journal_lock:
+                await self._rewrite_journal(self._pending)
+        if items:
+            logger.info(f"Відновлено {len(items)} незбережених результатів з журналу")
+        return len(items)
+
+    async def close(self):
+        """Зупиняє таймер та зберігає все, що залишилось"""
+        if self._timer is not None and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
@@ -0,0 +1,197 @@
+"""
+Бенчмарк об'єднання дерев категорій при оновленні категорій конкурента.
+
+Старе дерево з N категорій (за замовчуванням 5 000) порівнюється з новим,
+у якому частина категорій перейменована, переміщена, видалена або додана,
+а частина змінила ID (зіставляється за URL):
+- legacy - попередній рекурсивний merge_categories з update_competitor_categories
+  (пошук відповідника перебором списку нових категорій для кожної старої)
+- merge_category_trees - один прохід з індексами за ID, URL та назвою
+
+Запуск з кореня проєкту:
+    python benchmarks/bench_category_merge.py --categories 5000 --width 50
+"""
+import argparse
+import copy
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.category_diff import merge_category_trees  # noqa: E402
+
+
+def make_tree(count: int, width: int):
+    """Дерево категорій з count вузлів: width кореневих категорій, у кожної категорії до width дітей"""
+    roots = []
+    nodes = []
+    for number in range(count):
+        category = {
+            "id": f"cat-{number}",
+            "name": f"Категорія {number}",
+            "url": f"https://shop.example/catalog/cat-{number}/",
+            "children": []
+        }
+        if number < width:
+            roots.append(category)
+        else:
+            nodes[number // width - 1]["children"].append(category)
+        nodes.append(category)
+    return roots, nodes
+
+
+def mutate_tree(roots, share: float, seed: int = 2):
+    """Нове дерево: перейменування, переміщення, видалення, нові категорії та зміна ID (share - частка кожної зміни)"""
+    rng = random.Random(seed)
+    roots = copy.deepcopy(roots)
+    flat = []
+    stack = [(node, roots) for node in roots]
+    while stack:
+        node, siblings = stack.pop()
+        flat.append((node, siblings))
+        stack.extend((child, node["children"]) for child in node["children"])
+    changed = max(1, int(len(flat) * share))
+    for node, _ in rng.sample(flat, changed):
+        node["name"] += " (нова назва)"
+    for node, _ in rng.sample(flat, changed):
+        node["id"] += "-v2"
+    removed = set()
+    for node, siblings in rng.sample(flat, changed):
+        if node in siblings and not node["children"]:
+            siblings.remove(node)
+            removed.add(id(node))
+    movable = [(node, siblings) for node, siblings in flat if id(node) not in removed]
+    for node, siblings in rng.sample(movable, changed):
+        target, _ = rng.choice(movable)
+        if node in siblings and target is not node and not node["children"]:
+            siblings.remove(node)
+            target["children"].append(node)
+    for number in range(changed):
+        target, _ = rng.choice(movable)
+        target["children"].append({
+            "id": f"new-{number}", "name": f"Нова категорія {number}",
+            "url": f"https://shop.example/catalog/new-{number}/", "children": []
+        })
+    return roots
+
+
+def legacy_merge(old_categories, new_categories):
+    """Попередній алгоритм об'єднання (рекурсивний, з перебором списків на кожному рівні)"""
+    def flat(categories_list):
+        result = []
+        for cat in categories_list:
+            result.append(cat)
+            if cat.get("children"):
+                result.extend(flat(cat["children"]))
+        return result
+
+    old_flat = flat(old_categories)
+    old_by_url = {cat["url"]: cat for cat in old_flat if cat.get("url")}
+    old_by_name = {cat["name"].lower(): cat for cat in old_flat if cat.get("name")}
+    stats = {"found": 0, "not_found": 0, "new": 0}
+
+    def mark_not_found(categories_list):
+        result = []
+        for cat in categories_list:
+            not_found_cat = cat.copy()
+            not_found_cat["needs_manual_check"] = True
+            if cat.get("children"):
+                not_found_cat["children"] = mark_not_found(cat["children"])
+            result.append(not_found_cat)
+            stats["not_found"] += 1
+        return result
+
+    def merge_matched(old_cat, new_cat):
+        merged_cat = new_cat.copy()
+        if old_cat.get("children") and new_cat.get("children"):
+            merged_cat["children"] = merge(old_cat["children"], new_cat["children"])
+        elif old_cat.get("children"):
+            merged_cat["children"] = mark_not_found(old_cat["children"])
+        else:
+            merged_cat["children"] = new_cat.get("children", [])
+        stats["found"] += 1
+        return merged_cat
+
+    def merge(old_list, new_list):
+        result = []
+        new_by_id = {cat.get("id"): cat for cat in new_list if cat.get("id")}
+        for old_cat in old_list:
+            old_id, old_name, old_url = old_cat.get("id"), old_cat.get("name", "").lower(), old_cat.get("url", "")
+            found = None
+            if old_id and old_id in new_by_id:
+                found = new_by_id[old_id]
+            elif old_url and old_url in old_by_url:
+                found = next((new_cat for new_cat in new_list if new_cat.get("url") == old_url), None)
+            elif old_name and old_name in old_by_name:
+                found = next((new_cat for new_cat in new_list if new_cat.get("name", "").lower() == old_name), None)
+            if found is not None:
+                result.append(merge_matched(old_cat, found))
+            else:
+                not_found_cat = old_cat.copy()
+                not_found_cat["needs_manual_check"] = True
+                if old_cat.get("children"):
+                    not_found_cat["children"] = mark_not_found(old_cat["children"])
+                result.append(not_found_cat)
+                stats["not_found"] += 1
+        old_ids = {cat.get("id") for cat in old_list if cat.get("id")}
+        old_urls = {cat.get("url") for cat in old_list if cat.get("url")}
+        old_names = {cat.get("name", "").lower() for cat in old_list if cat.get("name")}
+        for new_cat in new_list:
+            if ((not new_cat.get("id") or new_cat["id"] not in old_ids) and
+                    (not new_cat.get("url") or new_cat["url"] not in old_urls) and
+                    (not new_cat.get("name") or new_cat["name"].lower() not in old_names)):
+                merged_cat = new_cat.copy()
+                if new_cat.get("children"):
+                    merged_cat["children"] = merge([], new_cat["children"])
+                result.append(merged_cat)
+                stats["new"] += 1
+        return result
+
+    return merge(old_categories, new_categories), stats
+
+
+def measure(fn, repeat: int):
+    """Середній час виконання fn у мілісекундах та результат останнього виклику"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def count_nodes(categories) -> int:
+    total = 0
+    stack = list(categories)
+    while stack:
+        node = stack.pop()
+        total += 1
+        stack.extend(node.get("children") or [])
+    return total
+
+
+def main(categories: int, width: int, share: float, repeat: int):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), categories * 2))
+    old_tree, _ = make_tree(categories, width)
+    new_tree = mutate_tree(old_tree, share)
+    print(f"{categories} категорій (до {width} дітей у вузла), нове дерево: {count_nodes(new_tree)} категорій, "
+          f"частка кожної зміни {share:.0%}, повторів: {repeat}")
+
+    legacy_ms, (legacy_tree, stats) = measure(lambda: legacy_merge(old_tree, new_tree), repeat)
+    print(f"{'legacy':>22}: {legacy_ms:8.1f} ms, знайдено {stats['found']}, не знайдено {stats['not_found']}, "
+          f"нових {stats['new']}, вузлів {count_nodes(legacy_tree)}")
+
+    merge_ms, (merged_tree, changes) = measure(lambda: merge_category_trees(old_tree, new_tree), repeat)
+    print(f"{'merge_category_trees':>22}: {merge_ms:8.1f} ms, знайдено {changes['matched']}, "
+          f"не знайдено {len(changes['missing'])}, нових {len(changes['added'])}, "
+          f"переміщено {len(changes['moved'])}, перейменовано {len(changes['renamed'])}, вузлів {count_nodes(merged_tree)}")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--categories", type=int, default=5000, help="кількість категорій у старому дереві")
+    arg_parser.add_argument("--width", type=int, default=50, help="найбільша кількість дітей у категорії")
+    arg_parser.add_argument("--changes", type=float, default=0.05, help="частка категорій для кожного виду змін")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="кількість повторів кожного вимірювання")
+    args = arg_parser.parse_args()
+    main(args.categories, args.width, args.changes, args.repeat)
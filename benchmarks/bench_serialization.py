@@ -0,0 +1,91 @@
+"""
+Бенчмарк серіалізації сховищ.
+
+Порівнює для бази з N товарами (за замовчуванням 10 000):
+- stdlib indent=2 - попередній формат усіх сховищ
+- stdlib compact - без orjson, компактний формат
+- orjson compact / orjson pretty - якщо orjson встановлений
+та повний цикл збереження/читання через storage (write_json_atomic + read_json).
+
+Запуск з кореня проєкту:
+    python benchmarks/bench_serialization.py --products 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import storage  # noqa: E402
+from bench_write_behind import make_products  # noqa: E402
+
+
+def measure(fn, repeat: int) -> float:
+    """Середній час виконання fn у мілісекундах"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def formats():
+    """Набір форматів: назва -> (dumps, loads)"""
+    result = {
+        "stdlib indent=2": (
+            lambda data: json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8"),
+            json.loads
+        ),
+        "stdlib compact": (
+            lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            json.loads
+        ),
+    }
+    if storage.orjson is not None:
+        orjson = storage.orjson
+        result["orjson compact"] = (lambda data: orjson.dumps(data), orjson.loads)
+        result["orjson pretty"] = (lambda data: orjson.dumps(data, option=orjson.OPT_INDENT_2), orjson.loads)
+    return result
+
+
+async def store_roundtrip(db: dict, repeat: int):
+    """Повний цикл через storage: атомарний запис та читання з диска"""
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_serialization_"), "db.json")
+    save_ms = 0.0
+    load_ms = 0.0
+    for _ in range(repeat):
+        data = dict(db)
+        data.pop(storage.REVISION_KEY, None)
+        started = time.perf_counter()
+        await storage.write_json_atomic(path, data)
+        save_ms += (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        await storage.read_json(path, dict)
+        load_ms += (time.perf_counter() - started) * 1000
+    return save_ms / repeat, load_ms / repeat, os.path.getsize(path)
+
+
+def main(products: int, history_len: int, repeat: int):
+    db = make_products(products, history_len)
+    print(f"{products} товарів, {history_len} записів історії, повторів: {repeat}")
+    for name, (dump, load) in formats().items():
+        content = dump(db)
+        dump_ms = measure(lambda: dump(db), repeat)
+        load_ms = measure(lambda: load(content), repeat)
+        print(f"{name:>16}: dumps {dump_ms:8.1f} ms, loads {load_ms:8.1f} ms, розмір {len(content) / 1024 / 1024:6.2f} MiB")
+
+    save_ms, load_ms, size = asyncio.run(store_roundtrip(db, repeat))
+    backend = "orjson" if storage.orjson is not None else "stdlib"
+    print(f"{'storage (' + backend + ')':>16}: save {save_ms:8.1f} ms, load {load_ms:8.1f} ms, розмір {size / 1024 / 1024:6.2f} MiB")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--products", type=int, default=10000, help="кількість товарів")
+    arg_parser.add_argument("--history", type=int, default=5, help="кількість записів історії в кожного товару")
+    arg_parser.add_argument("--repeat", type=int, default=5, help="кількість повторів кожного вимірювання")
+    args = arg_parser.parse_args()
+    main(args.products, args.history, args.repeat)
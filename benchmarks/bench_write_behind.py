@@ -0,0 +1,144 @@
+"""
+Бенчмарк відкладеного запису результатів масового оновлення.
+
+Порівнює масове оновлення (parse_all_products) у двох режимах:
+- direct: кожен результат одразу зберігається в db.json, прогрес записується на кожен товар
+- batched: результати зберігаються пакетами через буфер, прогрес записується з інтервалом
+
+Парсинг підміняється миттєвою функцією, тому вимірюється тільки робота зі сховищем.
+Запуск з кореня проєкту:
+    python benchmarks/bench_write_behind.py --products 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import parser  # noqa: E402
+
+
+def make_products(count: int, history_len: int):
+    """Генерує базу товарів, що вже парсились (оновлюються тільки ціна та наявність)"""
+    now = datetime.now()
+    products = []
+    for i in range(count):
+        parsed_at = (now - timedelta(days=2)).isoformat()
+        products.append({
+            "id": f"product-{i}",
+            "url": f"https://shop.example.com/product/{i}",
+            "name": f"Товар {i}",
+            "name_parsed": f"Товар {i}",
+            "sku": f"SKU-{i:06d}",
+            "price": 100.0 + i % 50,
+            "availability": "в наявності",
+            "competitor_id": f"competitor-{i % 5}",
+            "category_path": ["Каталог", f"Категорія {i % 20}"],
+            "status": "parsed",
+            "created_at": parsed_at,
+            "last_parsed_at": parsed_at,
+            "history": [
+                {"date": parsed_at, "price": 100.0 + i % 50, "availability": "в наявності"}
+                for _ in range(history_len)
+            ],
+            "logs": []
+        })
+    return {"products": products}
+
+
+async def fake_parse_product(product):
+    return {"price": round(random.uniform(50, 150), 2), "availability": "в наявності"}
+
+
+async def run_mode(mode: str, db: dict) -> dict:
+    """Запускає масове оновлення в одному режимі та рахує записані байти"""
+    with open(parser.DB_FILE, "w", encoding="utf-8") as f:
+        json.dump(db, f, ensure_ascii=False)
+    for path in (parser.PROGRESS_FILE, parser.RESULTS_JOURNAL_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    parser._product_index.signature = None
+    parser._last_fetched.clear()
+
+    written = {"db": 0, "progress": 0, "journal": 0, "db_writes": 0, "progress_writes": 0}
+    original_save_db = parser.save_db
+    original_save_progress = parser.save_progress
+    original_add = parser._result_buffer.add
+
+    async def counting_save_db(data, changed_ids=None):
+        await original_save_db(data, changed_ids)
+        written["db"] += os.path.getsize(parser.DB_FILE)
+        written["db_writes"] += 1
+
+    async def counting_save_progress(data):
+        await original_save_progress(data)
+        written["progress"] += os.path.getsize(parser.PROGRESS_FILE)
+        written["progress_writes"] += 1
+
+    async def counting_add(item):
+        written["journal"] += len(json.dumps(item, ensure_ascii=False).encode("utf-8")) + 1
+        await original_add(item)
+
+    parser.save_db = counting_save_db
+    parser.save_progress = counting_save_progress
+    parser._result_buffer.add = counting_add
+    original_refresh = parser.refresh_product
+    original_interval = parser.PROGRESS_WRITE_INTERVAL_SECONDS
+    if mode == "direct":
+        # Поведінка без буфера: кожен результат і кожна зміна прогресу записуються одразу
+        async def direct_refresh(product_data, full=False, respect_window=True, buffered=False):
+            return await original_refresh(product_data, full, respect_window, buffered=False)
+        parser.refresh_product = direct_refresh
+        parser.PROGRESS_WRITE_INTERVAL_SECONDS = 0
+
+    try:
+        task_id = f"bench-{mode}"
+        await parser.save_progress({"tasks": {task_id: {"type": "parse_all", "total": 0, "done": 0, "errors": [], "status": "running"}}})
+        started = time.perf_counter()
+        await parser.parse_all_products(task_id)
+        elapsed = time.perf_counter() - started
+        status = await parser.get_task_status(task_id)
+    finally:
+        parser.save_db = original_save_db
+        parser.save_progress = original_save_progress
+        parser._result_buffer.add = original_add
+        parser.refresh_product = original_refresh
+        parser.PROGRESS_WRITE_INTERVAL_SECONDS = original_interval
+
+    return {"mode": mode, "seconds": elapsed, "status": status.get("status"), "done": status.get("done"), **written}
+
+
+async def main(products: int, history_len: int, modes):
+    workdir = tempfile.mkdtemp(prefix="bench_write_behind_")
+    os.chdir(workdir)
+    os.makedirs("app/db", exist_ok=True)
+    parser.parse_product = fake_parse_product
+    db = make_products(products, history_len)
+
+    for mode in modes:
+        result = await run_mode(mode, db)
+        total_bytes = result["db"] + result["progress"] + result["journal"]
+        print(
+            f"{result['mode']:>8}: {result['seconds']:8.2f} s, "
+            f"db {result['db'] / 1024 / 1024:10.1f} MiB ({result['db_writes']} записів), "
+            f"progress {result['progress'] / 1024:8.1f} KiB ({result['progress_writes']} записів), "
+            f"journal {result['journal'] / 1024:8.1f} KiB, "
+            f"всього {total_bytes / 1024 / 1024:10.1f} MiB, "
+            f"status={result['status']} done={result['done']}"
+        )
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--products", type=int, default=5000, help="кількість товарів")
+    arg_parser.add_argument("--history", type=int, default=5, help="кількість записів історії в кожного товару")
+    arg_parser.add_argument("--modes", nargs="+", choices=["direct", "batched"], default=["direct", "batched"],
+                            help="режими для порівняння (direct на 5000 товарів виконується десятки хвилин)")
+    args = arg_parser.parse_args()
+    asyncio.run(main(args.products, args.history, args.modes))